@@ -2,4 +2,10 @@
 set -o errexit
 pip install -r requirements.txt
 python manage.py collectstatic --no-input
+python manage.py build_email_templates
 python manage.py migrate
+
+# Aperçus PNG des factures (core/preview.py) : pdftoppm, paquet poppler-utils
+if ! command -v pdftoppm > /dev/null; then
+    echo "⚠️ pdftoppm introuvable (installer poppler-utils) : aperçus des factures désactivés"
+fi
@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init
 
 # Définit le module de settings Django par défaut
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -13,17 +14,81 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Autodiscover des tâches dans les apps Django
 app.autodiscover_tasks()
+app.autodiscover_tasks(related_name='taskss')
 
 # Configuration du planning (Celery Beat)
 app.conf.beat_schedule = {
     'check-overdue-invoices-daily': {
-        'task': 'core.tasks.check_overdue_invoices',
+        'task': 'core.taskss.check_overdue_invoices',
         'schedule': crontab(hour=9, minute=0),  # Tous les jours à 9h
     },
+    'deliver-webhooks': {
+        'task': 'core.taskss.deliver_webhooks',
+        'schedule': 60.0,  # Nouvelles tentatives des webhooks en échec
+    },
+    'drain-email-outbox': {
+        'task': 'core.taskss.drain_email_outbox',
+        'schedule': 60.0,  # Nouvelles tentatives des emails en échec
+    },
+    'retry-stripe-events': {
+        'task': 'core.taskss.retry_stripe_events',
+        'schedule': 300.0,  # Événements Stripe en attente dont le nouvel essai est dû
+    },
 }
 
 app.conf.timezone = 'Europe/Paris'
 
+# Files d'attente : une par type de travail, chacune avec ses workers, pour
+# qu'une rafale de rendus PDF ne retarde ni les emails ni la maintenance.
+#   celery -A config worker -Q pdf -c 2 -O fair --prefetch-multiplier=1 --max-tasks-per-child=50 --max-memory-per-child=400000
+#   celery -A config worker -Q email -P threads -c 8 --prefetch-multiplier=4
+#   celery -A config worker -Q maintenance,default -c 1 --prefetch-multiplier=1
+#   celery -A config beat
+# Rendu (CPU, mémoire) : un seul message réservé à la fois et process recyclés
+# au-delà de 400 Mo ; envois (I/O) : threads et plusieurs messages d'avance.
+# Mesure : python manage.py queue_load_test
+app.conf.task_default_queue = 'default'
+app.conf.task_routes = {
+    'core.taskss.prerender_invoice_pdf': {'queue': 'pdf'},
+    'core.taskss.render_invoice_preview': {'queue': 'pdf'},
+    'core.taskss.archive_invoice_pdf_task': {'queue': 'pdf'},
+    'core.taskss.drain_email_outbox': {'queue': 'email'},
+    'core.taskss.deliver_webhooks': {'queue': 'email'},
+    'core.taskss.check_overdue_invoices': {'queue': 'maintenance'},
+    'core.taskss.process_stripe_events': {'queue': 'maintenance'},
+    'core.taskss.retry_stripe_events': {'queue': 'maintenance'},
+    'core.taskss.import_clients_task': {'queue': 'maintenance'},
+}
+
+# Priorités (Redis : 0 = la plus haute, 9 = la plus basse) ; chaque tâche
+# donne la sienne dans son décorateur, 5 par défaut
+app.conf.task_default_priority = 5
+app.conf.broker_transport_options = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': list(range(10)),
+    'sep': ':',
+}
+
+# Un worker ne réserve qu'un message d'avance par process (surchargé par
+# --prefetch-multiplier pour les workers d'envoi)
+app.conf.worker_prefetch_multiplier = 1
+
+
+@worker_process_init.connect
+def preload_pdf_renderer(**kwargs):
+    """Les workers de rendu PDF chargent WeasyPrint dès le démarrage"""
+    from django.conf import settings
+    if settings.PDF_PRELOAD:
+        from core.pdf import preload
+        preload()
+
+
+@worker_process_init.connect
+def warm_up_templates(**kwargs):
+    """Les workers compilent les templates des PDF et des emails avant la première tâche"""
+    from core.warmup import warm_up_if_enabled
+    warm_up_if_enabled()
+
 
 @app.task(bind=True)
 def debug_task(self):
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Classes d'opérateurs des index (core.models.PrefixSearchIndex)
+    'django.contrib.postgres',
     'core',
     'django_celery_beat',
 ]
@@ -64,8 +66,14 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates compilés une seule fois par process puis gardés en mémoire
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -76,6 +84,9 @@ TEMPLATES = [
     },
 ]
 
+# Compile les templates chauds et les URLs au démarrage (voir core.warmup)
+TEMPLATE_WARMUP = config('TEMPLATE_WARMUP', default=bool(os.environ.get('RENDER')), cast=bool)
+
 WSGI_APPLICATION = 'config.wsgi.application'
 
 
@@ -128,6 +139,9 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
+# WeasyPrint est chargé à la demande ; à activer sur les workers dédiés au rendu PDF
+PDF_PRELOAD = config('PDF_PRELOAD', default=False, cast=bool)
+
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
@@ -155,8 +169,8 @@ if os.environ.get('RENDER'):
     
     DEFAULT_FROM_EMAIL = 'FactureSnap <info@myjunkfuel.com>' 
 else:
-    # LOCAL : Gmail SMTP
-    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    # LOCAL : Gmail SMTP, connexions gardées ouvertes entre deux envois
+    EMAIL_BACKEND = 'core.email_backend.PooledSMTPBackend'
     EMAIL_HOST = 'smtp.gmail.com'
     EMAIL_PORT = 587
     EMAIL_USE_TLS = True
@@ -164,6 +178,20 @@ else:
     EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
     DEFAULT_FROM_EMAIL = config('EMAIL_HOST_USER')
 
+# Des workers "manage.py drain_email_outbox --loop" vident la file d'envoi :
+# les requêtes se contentent alors de mettre les emails en file
+EMAIL_OUTBOX_WORKERS = config('EMAIL_OUTBOX_WORKERS', default=False, cast=bool)
+
+# Destinataire des alertes (mail_admins), ex. événement Stripe abandonné
+ADMIN_EMAIL = config('ADMIN_EMAIL', default='')
+ADMINS = [('FactureSnap', ADMIN_EMAIL)] if ADMIN_EMAIL else []
+SERVER_EMAIL = DEFAULT_FROM_EMAIL
+
+# Celery : sans broker, les tâches tournent dans un pool de threads du process (core.dispatch)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='')
+TASK_POOL_WORKERS = config('TASK_POOL_WORKERS', default=2, cast=int)
+TASK_POOL_QUEUE = config('TASK_POOL_QUEUE', default=50, cast=int)
+
 # Celery Configuration
 #if os.environ.get('RENDER'):
     # Production : Redis sur Render
@@ -191,10 +219,26 @@ STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY', default='')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
 STRIPE_PRICE_ID = config('STRIPE_PRICE_ID', default='')
+# Permet de pointer vers un serveur Stripe local (ex: stripe-mock) en test
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='')
 
 # URL de base pour les webhooks
 SITE_URL = config('SITE_URL', default='http://127.0.0.1:8000')
 
+# Durée de validité des liens de téléchargement envoyés aux clients (60 jours)
+INVOICE_LINK_MAX_AGE = config('INVOICE_LINK_MAX_AGE', default=60 * 24 * 60 * 60, cast=int)
+
+# Pixel d'ouverture et lien de clic dans les emails de facture (voir core/tracking.py)
+EMAIL_TRACKING = config('EMAIL_TRACKING', default=True, cast=bool)
+
+# Webhooks sortants vers des adresses internes (127.0.0.1, réseaux privés) :
+# refusés sauf pour tester en local avec manage.py webhook_stub
+WEBHOOK_ALLOW_PRIVATE_URLS = config('WEBHOOK_ALLOW_PRIVATE_URLS', default=False, cast=bool)
+
+# Proxies devant Django (le load balancer de Render en production) : l'IP du
+# visiteur est lue dans X-Forwarded-For pour les limites de débit publiques
+TRUSTED_PROXY_COUNT = config('TRUSTED_PROXY_COUNT', default=1 if os.environ.get('RENDER') else 0, cast=int)
+
 
 if os.environ.get('RENDER'):
     # Production : PostgreSQL via Render
@@ -211,11 +255,61 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Tâches en arrière-plan dans des threads (core.dispatch) : les
+            # transactions prennent le verrou d'écriture dès le début
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
         }
     }
 
 
 
+# ============================================
+# CACHE & SESSIONS
+# ============================================
+
+# Cache partagé entre les workers et les serveurs (Redis si REDIS_URL est défini)
+REDIS_URL = config('REDIS_URL', default='')
+CACHE_VERSION = config('CACHE_VERSION', default=1, cast=int)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'facturesnap',
+            'VERSION': CACHE_VERSION,
+            'OPTIONS': {
+                # Redis lent ou absent : on abandonne vite (voir core.cache)
+                'socket_connect_timeout': 1,
+                'socket_timeout': 1,
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'facturesnap',
+            'KEY_PREFIX': 'facturesnap',
+            'VERSION': CACHE_VERSION,
+        },
+    }
+
+# Cache mémoire du process, utilisé en secours quand Redis ne répond pas
+CACHES['local'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'facturesnap-local',
+    'KEY_PREFIX': 'facturesnap',
+    'VERSION': CACHE_VERSION,
+}
+
+# Sessions lues dans le cache, écrites aussi en base
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
 # ============================================
 # PRODUCTION SETTINGS (Render.com)
 # ============================================
@@ -33,7 +33,11 @@ urlpatterns = [
     
     # App
     path('app/', include('core.urls')),
+    path('api/v1/', include('core.api_urls')),
     path('stripe/webhook/', core_views.stripe_webhook, name='stripe_webhook'),
+    path('f/<str:token>/', core_views.public_invoice_pdf, name='public_invoice_pdf'),
+    path('t/o/<str:token>.gif', core_views.track_open, name='track_open'),
+    path('t/c/<str:token>/', core_views.track_click, name='track_click'),
     path('mentions-legales/', TemplateView.as_view(template_name='legal/mentions.html'), name='mentions'),
     path('cgv/', TemplateView.as_view(template_name='legal/cgv.html'), name='cgv'),
     path('robots.txt', core_views.robots_txt, name='robots'),
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Templates et URLs compilés avant la première requête (voir core.warmup)
+from core.warmup import warm_up_if_enabled  # noqa: E402
+warm_up_if_enabled()
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Client, Invoice, InvoiceItem,UserProfile
+from .models import Client, Invoice, InvoiceItem,UserProfile, StripeEvent, ClientImport, InvoiceNumberSequence, ApiToken, WebhookEndpoint, WebhookEvent, EmailOutbox, DeliveryStats
+from .taskss import schedule_bulk_send
 
 
 
@@ -41,7 +42,7 @@ class InvoiceAdmin(admin.ModelAdmin):
     list_display = ('invoice_number', 'client', 'issue_date', 'due_date', 'status', 'total', 'user')
     list_filter = ('status', 'issue_date', 'due_date')
     search_fields = ('invoice_number', 'client__name', 'client__email')
-    readonly_fields = ('subtotal', 'tax_amount', 'total', 'created_at', 'updated_at', 'sent_at', 'paid_at')
+    readonly_fields = ('subtotal', 'tax_amount', 'total', 'created_at', 'updated_at', 'sent_at', 'paid_at', 'pdf_archive', 'pdf_sha256', 'pdf_archived_at')
     inlines = [InvoiceItemInline]
     
     fieldsets = (
@@ -58,25 +59,39 @@ class InvoiceAdmin(admin.ModelAdmin):
             'fields': ('notes',),
             'classes': ('collapse',)
         }),
+        ('PDF archivé', {
+            'fields': ('pdf_archive', 'pdf_sha256', 'pdf_archived_at'),
+            'classes': ('collapse',)
+        }),
         ('Métadonnées', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
     
-    actions = ['mark_as_sent', 'mark_as_paid']
+    actions = ['mark_as_sent', 'mark_as_paid', 'cancel', 'send_by_email']
     
     def mark_as_sent(self, request, queryset):
-        for invoice in queryset:
-            invoice.mark_as_sent()
-        self.message_user(request, f"{queryset.count()} facture(s) marquée(s) comme envoyée(s).")
+        count = queryset.mark_as_sent()
+        self.message_user(request, f"{count} facture(s) marquée(s) comme envoyée(s).")
     mark_as_sent.short_description = "Marquer comme envoyée"
     
     def mark_as_paid(self, request, queryset):
-        for invoice in queryset:
-            invoice.mark_as_paid()
-        self.message_user(request, f"{queryset.count()} facture(s) marquée(s) comme payée(s).")
+        count = queryset.mark_as_paid()
+        self.message_user(request, f"{count} facture(s) marquée(s) comme payée(s).")
     mark_as_paid.short_description = "Marquer comme payée"
+    
+    def cancel(self, request, queryset):
+        count = queryset.cancel()
+        self.message_user(request, f"{count} facture(s) annulée(s).")
+    cancel.short_description = "Annuler"
+    
+    def send_by_email(self, request, queryset):
+        ids = list(queryset.exclude(status='cancelled').values_list('id', flat=True))
+        if ids:
+            schedule_bulk_send(request.user, ids)
+        self.message_user(request, f"Envoi de {len(ids)} facture(s) programmé.")
+    send_by_email.short_description = "Envoyer par email"
 
 
 
@@ -92,10 +107,10 @@ class UserProfileAdmin(admin.ModelAdmin):
             'fields': ('user',)
         }),
         ('Informations freelance', {
-            'fields': ('company_name', 'address', 'postal_code', 'city', 'country', 'siret', 'phone', 'logo')
+            'fields': ('company_name', 'address', 'postal_code', 'city', 'country', 'siret', 'phone', 'logo', 'invoice_delivery')
         }),
         ('Abonnement', {
-            'fields': ('is_premium', 'trial_end_date', 'stripe_customer_id', 'stripe_subscription_id')
+            'fields': ('is_premium', 'trial_end_date', 'stripe_customer_id', 'stripe_subscription_id', 'subscription_status', 'subscription_current_period_end')
         }),
         ('Métadonnées', {
             'fields': ('created_at', 'updated_at', 'days_left'),
@@ -112,3 +127,99 @@ class UserProfileAdmin(admin.ModelAdmin):
             return f"{days} jour(s) d'essai restant(s)"
         return "Essai terminé ⚠️"
     days_left.short_description = "Statut"
+
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'customer_id', 'stripe_created', 'processed_at', 'attempts', 'next_attempt_at', 'failed_at')
+    list_filter = ('event_type', 'processed_at', 'failed_at')
+    search_fields = ('event_id', 'customer_id')
+    readonly_fields = ('event_id', 'event_type', 'customer_id', 'payload', 'stripe_created', 'received_at', 'processed_at', 'attempts', 'last_error', 'next_attempt_at', 'failed_at')
+    actions = ['replay']
+    
+    def replay(self, request, queryset):
+        """Remet en file les événements non traités (abandonnés ou en attente d'un nouvel essai)"""
+        from core.taskss import schedule_stripe_events
+        
+        queryset = queryset.filter(processed_at__isnull=True)
+        customer_ids = set(queryset.values_list('customer_id', flat=True))
+        updated = queryset.update(failed_at=None, next_attempt_at=None, attempts=0)
+        for customer_id in customer_ids:
+            schedule_stripe_events(customer_id)
+        self.message_user(request, f'{updated} événement(s) remis en file.')
+    replay.short_description = 'Rejouer'
+
+
+@admin.register(ClientImport)
+class ClientImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'total_rows', 'imported_count', 'error_count', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'file', 'status', 'total_rows', 'imported_count', 'error_count', 'errors_preview', 'error_report', 'created_at', 'finished_at')
+
+
+@admin.register(InvoiceNumberSequence)
+class InvoiceNumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'year', 'last_number')
+    search_fields = ('user__username',)
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'key_prefix', 'created_at', 'last_used_at')
+    search_fields = ('name', 'user__username', 'key_prefix')
+    readonly_fields = ('key_prefix', 'key_hash', 'created_at', 'last_used_at')
+    
+    def has_add_permission(self, request):
+        # Les jetons se créent depuis la page Paramètres (la clé n'est montrée qu'une fois)
+        return False
+
+
+@admin.register(WebhookEndpoint)
+class WebhookEndpointAdmin(admin.ModelAdmin):
+    list_display = ('url', 'user', 'is_active', 'consecutive_failures', 'circuit_open_until', 'last_success_at')
+    list_filter = ('is_active',)
+    search_fields = ('url', 'user__username')
+    readonly_fields = ('secret', 'consecutive_failures', 'circuit_open_until', 'last_success_at', 'last_error', 'created_at')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'endpoint', 'status', 'attempts', 'next_attempt_at', 'delivered_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('endpoint__url',)
+    readonly_fields = ('endpoint', 'event_type', 'payload', 'attempts', 'last_error', 'created_at', 'delivered_at')
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        """Remet les événements en file pour un nouvel essai immédiat"""
+        from django.utils import timezone
+        
+        updated = queryset.exclude(status='delivered').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} événement(s) remis en file.')
+    retry_now.short_description = 'Renvoyer maintenant'
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'invoice', 'user', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('invoice__invoice_number', 'user__username')
+    readonly_fields = ('user', 'invoice', 'kind', 'attempts', 'last_error', 'job_id', 'created_at', 'sent_at')
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        """Remet les emails en file pour un nouvel essai immédiat"""
+        from django.utils import timezone
+        
+        updated = queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} email(s) remis en file.')
+    retry_now.short_description = 'Renvoyer maintenant'
+
+
+@admin.register(DeliveryStats)
+class DeliveryStatsAdmin(admin.ModelAdmin):
+    list_display = ('invoice', 'user', 'opens', 'clicks', 'first_opened_at', 'last_opened_at', 'last_clicked_at')
+    search_fields = ('invoice__invoice_number', 'user__username')
+    readonly_fields = ('user', 'invoice', 'opens', 'clicks', 'first_opened_at', 'last_opened_at', 'last_clicked_at')
@@ -0,0 +1,571 @@
+"""
+API JSON v1 (/api/v1/) : factures, lignes, clients et changements de statut.
+Authentification par jeton (en-tête « Authorization: Bearer <jeton> »).
+Les listes sont sérialisées avec values() (pas d'instances de modèles),
+paginées par curseur et acceptent ?fields= pour ne renvoyer que certains champs.
+Les créations et modifications se font par lots de API_BATCH_MAX objets au
+plus, dans une seule transaction : tout passe ou rien ne passe.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Lower
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from functools import wraps
+from . import cache, ratelimit
+from .forms import ClientForm
+from .importers import create_invoice_batch, normalize_row, parse_date, parse_decimal, parse_invoice_items, parse_invoice_record, CENT
+from .middleware import ENTITLEMENT_CACHE_TIMEOUT, SubscriptionMiddleware
+from .models import ApiToken, Client, Invoice, InvoiceItem
+import base64
+import json
+import math
+
+
+API_BATCH_MAX = 100
+API_PAGE_SIZE = 50
+API_PAGE_SIZE_MAX = 200
+API_TOKEN_CACHE_TIMEOUT = 10 * 60
+
+# Champs exposés : nom dans l'API -> champ ou expression pour values()
+INVOICE_FIELDS = {
+    'id': 'id',
+    'invoice_number': 'invoice_number',
+    'status': 'status',
+    'client_id': 'client_id',
+    'client_name': F('client__name'),
+    'client_email': F('client__email'),
+    'issue_date': 'issue_date',
+    'due_date': 'due_date',
+    'subtotal': 'subtotal',
+    'tax_rate': 'tax_rate',
+    'tax_amount': 'tax_amount',
+    'total': 'total',
+    'notes': 'notes',
+    'sent_at': 'sent_at',
+    'paid_at': 'paid_at',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+ITEM_FIELDS = {
+    'id': 'id',
+    'invoice_id': 'invoice_id',
+    'description': 'description',
+    'quantity': 'quantity',
+    'unit_price': 'unit_price',
+    'total': 'total',
+}
+
+CLIENT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'email': 'email',
+    'phone': 'phone',
+    'address': 'address',
+    'postal_code': 'postal_code',
+    'city': 'city',
+    'country': 'country',
+    'siret': 'siret',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+# Champs modifiables par PATCH /api/v1/invoices/
+INVOICE_UPDATABLE_FIELDS = ('issue_date', 'due_date', 'tax_rate', 'notes')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.errors = errors
+
+
+def error_response(message, status=400, errors=None):
+    data = {'error': message}
+    if errors:
+        data['errors'] = errors
+    return JsonResponse(data, status=status)
+
+
+# --- Authentification -------------------------------------------------------
+
+def get_token_user_id(key_hash):
+    """
+    ID de l'utilisateur du jeton, ou None si le jeton est inconnu. None n'est
+    pas mis en cache : un jeton créé juste après un essai refusé est accepté
+    tout de suite (les essais refusés sont limités par IP, voir api_view).
+    """
+    token = ApiToken.objects.filter(key_hash=key_hash).values('id', 'user_id').first()
+    if token is None:
+        return None
+
+    # Date de dernière utilisation mise à jour au plus une fois par heure
+    if cache.add('api-token-used', token['id'], True, timeout=60 * 60):
+        ApiToken.objects.filter(id=token['id']).update(last_used_at=timezone.now())
+    return token['user_id']
+
+
+def authenticate(request):
+    """Utilisateur correspondant au jeton de la requête, ou None"""
+    header = request.headers.get('Authorization', '')
+    scheme, _, key = header.partition(' ')
+    if scheme.lower() not in ('bearer', 'token') or not key.strip():
+        return None
+
+    key_hash = ApiToken.hash_key(key.strip())
+    user_id = cache.get_or_set('api-token', key_hash, lambda: get_token_user_id(key_hash), timeout=API_TOKEN_CACHE_TIMEOUT)
+    if not user_id:
+        return None
+
+    return User.objects.filter(id=user_id, is_active=True).first()
+
+
+def api_view(*methods):
+    """
+    Décorateur des vues de l'API : vérifie la méthode, le jeton et l'accès
+    (essai ou premium), et transforme les ApiError en réponses JSON.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return error_response('Méthode non autorisée', status=405)
+
+            user = authenticate(request)
+            if user is None:
+                # Jetons essayés au hasard : chaque essai refusé coûte un jeton du seau de l'IP
+                wait = ratelimit.retry_after(f'ip:{ratelimit.client_ip(request)}', 'api-auth')
+                if wait:
+                    response = error_response('Trop de jetons refusés, réessayez plus tard', status=429)
+                    response['Retry-After'] = str(max(1, math.ceil(wait)))
+                    return response
+                
+                response = error_response('Jeton API manquant ou invalide', status=401)
+                response['WWW-Authenticate'] = 'Bearer'
+                return response
+
+            if not (user.is_staff or cache.get_or_set(
+                'entitlement', user.id,
+                lambda: SubscriptionMiddleware.get_entitlement(user),
+                timeout=ENTITLEMENT_CACHE_TIMEOUT
+            )):
+                return error_response("Période d'essai terminée : abonnement requis", status=402)
+
+            request.user = user
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as e:
+                return error_response(e.message, status=e.status, errors=e.errors)
+        return wrapper
+    return decorator
+
+
+# --- Lecture : champs, curseur ---------------------------------------------
+
+def select_fields(request, available):
+    """Champs demandés avec ?fields=a,b,c (tous par défaut)"""
+    requested = request.GET.get('fields')
+    if not requested:
+        return available
+
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"Champs inconnus : {', '.join(unknown)}")
+
+    # L'id sert au curseur : toujours renvoyé
+    return {name: available[name] for name in ['id'] + [n for n in names if n != 'id']}
+
+
+def values_for(queryset, fields):
+    """values() avec les expressions (client_name...) sous leur nom d'API"""
+    plain = [name for name, source in fields.items() if isinstance(source, str) and source == name]
+    expressions = {name: source for name, source in fields.items() if name not in plain}
+    return queryset.values(*plain, **expressions)
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ApiError('Curseur invalide')
+
+
+def paginate(request, queryset, fields):
+    """
+    Pagination par curseur sur l'id décroissant : chaque page coûte une
+    requête indexée, quelle que soit sa position.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', API_PAGE_SIZE)), API_PAGE_SIZE_MAX)
+    except ValueError:
+        raise ApiError('Paramètre limit invalide')
+    limit = max(limit, 1)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        queryset = queryset.filter(id__lt=decode_cursor(cursor))
+
+    rows = list(values_for(queryset.order_by('-id'), fields)[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return JsonResponse({'results': rows[:limit], 'next_cursor': next_cursor})
+
+
+# --- Écriture : lots --------------------------------------------------------
+
+def read_batch(request, key):
+    """
+    Objets envoyés dans le corps JSON : {"<key>": [...]}, une liste, ou un
+    seul objet. Au plus API_BATCH_MAX objets.
+    """
+    try:
+        body = json.loads(request.body or b'null')
+    except ValueError:
+        raise ApiError('Corps JSON invalide')
+
+    if isinstance(body, dict) and key in body:
+        body = body[key]
+    objects = body if isinstance(body, list) else [body]
+
+    if not objects or not all(isinstance(obj, dict) for obj in objects):
+        raise ApiError('Objets JSON attendus')
+    if len(objects) > API_BATCH_MAX:
+        raise ApiError(f'{API_BATCH_MAX} objets maximum par requête', status=413)
+    return objects
+
+
+def get_owned(queryset, objects):
+    """Objets du lot (par id) appartenant à l'utilisateur, en une requête"""
+    ids = [obj.get('id') for obj in objects]
+    if not all(isinstance(i, int) for i in ids):
+        raise ApiError('Chaque objet doit avoir un id entier')
+
+    found = queryset.in_bulk(ids)
+    missing = [i for i in ids if i not in found]
+    if missing:
+        raise ApiError('Objets introuvables', status=404, errors=[{'id': i, 'error': 'Introuvable'} for i in missing])
+    return found
+
+
+# --- Factures ---------------------------------------------------------------
+
+@api_view('GET', 'POST', 'PATCH')
+def invoices(request):
+    """
+    GET : liste (filtres ?status= et ?client_id=).
+    POST : création par lot, avec lignes (même format que l'import).
+    PATCH : modification par lot ({"id": ..., "due_date": ...}).
+    """
+    if request.method == 'POST':
+        return create_invoices(request)
+    if request.method == 'PATCH':
+        return update_invoices(request)
+
+    queryset = Invoice.objects.filter(user=request.user)
+    if request.GET.get('status'):
+        queryset = queryset.filter(status=request.GET['status'])
+    if request.GET.get('client_id', '').isdigit():
+        queryset = queryset.filter(client_id=request.GET['client_id'])
+
+    return paginate(request, queryset, select_fields(request, INVOICE_FIELDS))
+
+
+def create_invoices(request):
+    objects = read_batch(request, 'invoices')
+    
+    # Clients du lot résolus en une requête
+    emails = {str(obj.get('client_email') or '').strip().lower() for obj in objects}
+    client_ids = dict(
+        Client.objects.filter(user=request.user)
+        .annotate(email_lower=Lower('email'))
+        .filter(email_lower__in=emails)
+        .values_list('email_lower', 'id')
+    )
+
+    batch = []
+    errors = []
+    for index, obj in enumerate(objects):
+        try:
+            fields, items = parse_invoice_record(obj, client_ids)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        batch.append((index, fields, items))
+
+    if errors:
+        raise ApiError('Lot refusé : aucune facture créée', errors=errors)
+
+    with transaction.atomic():
+        numbers = create_invoice_batch(request.user, batch, errors)
+        if errors:
+            transaction.set_rollback(True)
+            raise ApiError('Lot refusé : aucune facture créée', errors=errors)
+
+    cache.delete('stats', request.user.id)
+    cache.delete('recent-clients', request.user.id)
+
+    created = values_for(Invoice.objects.filter(user=request.user, invoice_number__in=numbers).order_by('id'), INVOICE_FIELDS)
+    return JsonResponse({'results': list(created)}, status=201)
+
+
+def update_invoices(request):
+    objects = read_batch(request, 'invoices')
+    found = get_owned(Invoice.objects.filter(user=request.user), objects)
+
+    now = timezone.now()
+    changed_fields = {'updated_at'}
+    errors = []
+    for index, obj in enumerate(objects):
+        invoice = found[obj['id']]
+        try:
+            unknown = set(obj) - {'id'} - set(INVOICE_UPDATABLE_FIELDS)
+            if unknown:
+                raise ValueError(f"Champs non modifiables : {', '.join(sorted(unknown))}")
+            if 'issue_date' in obj:
+                invoice.issue_date = parse_date(obj['issue_date'], "Date d'émission")
+            if 'due_date' in obj:
+                invoice.due_date = parse_date(obj['due_date'], "Date d'échéance")
+            if invoice.due_date < invoice.issue_date:
+                raise ValueError("La date d'échéance doit être après la date d'émission.")
+            if 'tax_rate' in obj:
+                invoice.tax_rate = parse_decimal(obj['tax_rate'], "Taux de TVA")
+                if invoice.tax_rate < 0:
+                    raise ValueError("Le taux de TVA ne peut pas être négatif.")
+                invoice.tax_amount = (invoice.subtotal * invoice.tax_rate / 100).quantize(CENT)
+                invoice.total = invoice.subtotal + invoice.tax_amount
+                changed_fields.update(['tax_amount', 'total'])
+            if 'notes' in obj:
+                invoice.notes = str(obj['notes'] or '')
+        except ValueError as e:
+            errors.append({'index': index, 'id': obj['id'], 'error': str(e)})
+            continue
+
+        invoice.updated_at = now
+        changed_fields.update(set(obj) - {'id'})
+
+    if errors:
+        raise ApiError('Lot refusé : aucune facture modifiée', errors=errors)
+
+    with transaction.atomic():
+        Invoice.objects.bulk_update(found.values(), sorted(changed_fields))
+
+    cache.delete('stats', request.user.id)
+
+    updated = values_for(Invoice.objects.filter(id__in=found).order_by('id'), INVOICE_FIELDS)
+    return JsonResponse({'results': list(updated)})
+
+
+@api_view('GET')
+def invoice_detail(request, invoice_id):
+    """Une facture avec ses lignes (deux requêtes values())"""
+    invoice = values_for(Invoice.objects.filter(user=request.user, id=invoice_id), select_fields(request, INVOICE_FIELDS)).first()
+    if invoice is None:
+        raise ApiError('Facture introuvable', status=404)
+
+    invoice['items'] = list(values_for(InvoiceItem.objects.filter(invoice_id=invoice_id).order_by('id'), ITEM_FIELDS))
+    return JsonResponse(invoice)
+
+
+@api_view('GET', 'POST')
+def invoice_items(request, invoice_id):
+    """
+    GET : lignes d'une facture.
+    POST : ajout de lignes par lot ; les totaux sont recalculés une seule fois.
+    """
+    invoice = Invoice.objects.filter(user=request.user, id=invoice_id).first()
+    if invoice is None:
+        raise ApiError('Facture introuvable', status=404)
+
+    if request.method == 'GET':
+        items = values_for(InvoiceItem.objects.filter(invoice=invoice).order_by('id'), select_fields(request, ITEM_FIELDS))
+        return JsonResponse({'results': list(items)})
+
+    objects = read_batch(request, 'items')
+    try:
+        items = parse_invoice_items(objects)
+    except ValueError as e:
+        raise ApiError('Lot refusé : aucune ligne ajoutée', errors=[{'error': str(e)}])
+
+    with transaction.atomic():
+        InvoiceItem.objects.bulk_create([InvoiceItem(invoice=invoice, **item) for item in items])
+
+        # Totaux recalculés en base, une fois pour tout le lot
+        subtotal = invoice.items.aggregate(subtotal=Sum('total'))['subtotal'] or 0
+        tax_amount = (subtotal * invoice.tax_rate / 100).quantize(CENT)
+        Invoice.objects.filter(id=invoice.id).update(
+            subtotal=subtotal, tax_amount=tax_amount, total=subtotal + tax_amount, updated_at=timezone.now(),
+        )
+
+    cache.delete('stats', request.user.id)
+
+    items = values_for(InvoiceItem.objects.filter(invoice=invoice).order_by('id'), ITEM_FIELDS)
+    return JsonResponse({'results': list(items)}, status=201)
+
+
+@api_view('POST')
+def invoice_status(request):
+    """
+    Changement de statut par lot : {"action": "mark_paid" | "mark_sent" | "cancel", "ids": [...]}.
+    Un seul UPDATE ; les factures déjà payées ou annulées sont ignorées.
+    """
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError('Corps JSON invalide')
+
+    action = body.get('action')
+    ids = body.get('ids') or []
+    if action not in ('mark_paid', 'mark_sent', 'cancel'):
+        raise ApiError('Action inconnue')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        raise ApiError('ids doit être une liste d\'entiers')
+    if len(ids) > API_BATCH_MAX:
+        raise ApiError(f'{API_BATCH_MAX} objets maximum par requête', status=413)
+
+    queryset = Invoice.objects.filter(user=request.user, id__in=ids)
+    if action == 'mark_paid':
+        updated = queryset.mark_as_paid()
+    elif action == 'mark_sent':
+        updated = queryset.mark_as_sent()
+    else:
+        updated = queryset.cancel()
+
+    results = values_for(queryset.order_by('id'), {'id': 'id', 'status': 'status'})
+    return JsonResponse({'updated': updated, 'results': list(results)})
+
+
+# --- Clients ----------------------------------------------------------------
+
+@api_view('GET', 'POST', 'PATCH')
+def clients(request):
+    """
+    GET : liste (?q= recherche par début de nom ou d'email).
+    POST : création par lot (règles de ClientForm, emails uniques).
+    PATCH : modification par lot.
+    """
+    if request.method == 'POST':
+        return create_clients(request)
+    if request.method == 'PATCH':
+        return update_clients(request)
+
+    queryset = Client.objects.filter(user=request.user)
+    query = request.GET.get('q', '').strip()
+    if query:
+        queryset = queryset.filter(Q(name__istartswith=query) | Q(email__istartswith=query))
+
+    return paginate(request, queryset, select_fields(request, CLIENT_FIELDS))
+
+
+def create_clients(request):
+    objects = read_batch(request, 'clients')
+    known_emails = {email.lower() for email in Client.objects.filter(user=request.user).values_list('email', flat=True)}
+
+    new_clients = []
+    errors = []
+    for index, obj in enumerate(objects):
+        # Mêmes noms de champs et valeurs par défaut que l'import
+        form = ClientForm(data=normalize_row(obj))
+        if not form.is_valid():
+            errors.append({'index': index, 'errors': form.errors.get_json_data()})
+            continue
+
+        email_key = form.cleaned_data['email'].lower()
+        if email_key in known_emails:
+            errors.append({'index': index, 'errors': {'email': [{'message': 'Un client avec cet email existe déjà.', 'code': 'unique'}]}})
+            continue
+        known_emails.add(email_key)
+
+        client = form.save(commit=False)
+        client.user = request.user
+        new_clients.append(client)
+
+    if errors:
+        raise ApiError('Lot refusé : aucun client créé', errors=errors)
+
+    with transaction.atomic():
+        Client.objects.bulk_create(new_clients)
+
+    cache.delete('recent-clients', request.user.id)
+
+    created = Client.objects.filter(user=request.user, email__in=[c.email for c in new_clients]).order_by('id')
+    return JsonResponse({'results': list(values_for(created, CLIENT_FIELDS))}, status=201)
+
+
+def update_clients(request):
+    objects = read_batch(request, 'clients')
+    found = get_owned(Client.objects.filter(user=request.user), objects)
+
+    # Emails des autres clients, pour l'unicité (une requête)
+    other_emails = {}
+    for client_id, email in Client.objects.filter(user=request.user).values_list('id', 'email'):
+        other_emails.setdefault(email.lower(), set()).add(client_id)
+
+    errors = []
+    validated = []
+    for index, obj in enumerate(objects):
+        client = found[obj['id']]
+        old_email = client.email.lower()
+        data = {name: getattr(client, name) for name in ClientForm.Meta.fields}
+        data.update({name: value for name, value in obj.items() if name in ClientForm.Meta.fields})
+
+        form = ClientForm(data=data, instance=client)
+        if not form.is_valid():
+            errors.append({'index': index, 'id': client.id, 'errors': form.errors.get_json_data()})
+            continue
+
+        # L'ancien email est libéré : deux clients du lot peuvent échanger leurs emails
+        other_emails[old_email].discard(client.id)
+        validated.append((index, obj, client, old_email))
+
+    freed_emails = {old_email for _, _, _, old_email in validated}
+
+    now = timezone.now()
+    changed_fields = {'updated_at'}
+    swapped = []
+    for index, obj, client, old_email in validated:
+        email_key = client.email.lower()
+        if other_emails.setdefault(email_key, set()) - {client.id}:
+            errors.append({'index': index, 'id': client.id, 'errors': {'email': [{'message': 'Un client avec cet email existe déjà.', 'code': 'unique'}]}})
+            continue
+        other_emails[email_key].add(client.id)
+
+        if email_key != old_email and email_key in freed_emails:
+            swapped.append(client)
+        client.updated_at = now
+        changed_fields.update(name for name in obj if name in ClientForm.Meta.fields)
+
+    if errors:
+        raise ApiError('Lot refusé : aucun client modifié', errors=errors)
+
+    with transaction.atomic():
+        # L'index unique (user, email) est vérifié ligne par ligne : les emails
+        # échangés passent d'abord par une valeur provisoire unique
+        if swapped:
+            Client.objects.bulk_update(
+                [Client(id=client.id, email=f'swap-{client.id}@swap.invalid') for client in swapped], ['email']
+            )
+        Client.objects.bulk_update(found.values(), sorted(changed_fields))
+
+    cache.delete('recent-clients', request.user.id)
+
+    updated = Client.objects.filter(id__in=found).order_by('id')
+    return JsonResponse({'results': list(values_for(updated, CLIENT_FIELDS))})
+
+
+@api_view('GET')
+def client_detail(request, client_id):
+    client = values_for(Client.objects.filter(user=request.user, id=client_id), select_fields(request, CLIENT_FIELDS)).first()
+    if client is None:
+        raise ApiError('Client introuvable', status=404)
+    return JsonResponse(client)
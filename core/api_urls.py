@@ -0,0 +1,16 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    # Factures
+    path('invoices/', api.invoices, name='invoices'),
+    path('invoices/status/', api.invoice_status, name='invoice_status'),
+    path('invoices/<int:invoice_id>/', api.invoice_detail, name='invoice_detail'),
+    path('invoices/<int:invoice_id>/items/', api.invoice_items, name='invoice_items'),
+    
+    # Clients
+    path('clients/', api.clients, name='clients'),
+    path('clients/<int:client_id>/', api.client_detail, name='client_detail'),
+]
@@ -0,0 +1,136 @@
+"""
+Abonnements Stripe : accès au client Stripe et traitement des événements
+reçus par le webhook.
+Le SDK Stripe est importé au premier appel seulement, pour ne pas alourdir
+le démarrage des workers web.
+"""
+from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+from . import cache
+from .models import UserProfile
+
+
+_stripe = None
+
+
+def get_stripe():
+    """Retourne le module stripe, configuré avec la clé du compte"""
+    global _stripe
+    
+    if _stripe is None:
+        import stripe
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        if settings.STRIPE_API_BASE:
+            # Serveur Stripe local (stripe-mock) pour les tests
+            stripe.api_base = settings.STRIPE_API_BASE
+        _stripe = stripe
+    
+    return _stripe
+
+
+def handle_stripe_event(event_type, data_object):
+    """Aiguille un événement Stripe vers le bon traitement"""
+    if event_type == 'checkout.session.completed':
+        handle_checkout_session(data_object)
+    
+    elif event_type == 'customer.subscription.updated':
+        handle_subscription_updated(data_object)
+    
+    elif event_type == 'customer.subscription.deleted':
+        handle_subscription_cancelled(data_object)
+    
+    elif event_type == 'invoice.paid':
+        handle_payment_succeeded(data_object)
+    
+    elif event_type == 'invoice.payment_failed':
+        handle_payment_failed(data_object)
+
+
+def handle_checkout_session(session):
+    """Traite un paiement réussi"""
+    user_id = session['metadata'].get('user_id')
+    
+    if user_id:
+        try:
+            profile = UserProfile.objects.select_related('user').get(user_id=user_id)
+            
+            profile.is_premium = True
+            profile.stripe_customer_id = session['customer'] or ''
+            profile.stripe_subscription_id = session['subscription'] or ''
+            profile.subscription_status = 'active'
+            profile.save()
+            
+            print(f"✅ Compte Premium activé pour {profile.user.username}")
+            
+        except UserProfile.DoesNotExist:
+            print(f"❌ Utilisateur {user_id} introuvable")
+
+
+def handle_subscription_updated(subscription):
+    """Met à jour la copie locale de l'état de l'abonnement"""
+    try:
+        profile = UserProfile.objects.select_related('user').get(stripe_subscription_id=subscription['id'])
+        
+        profile.subscription_status = subscription['status']
+        profile.is_premium = subscription['status'] in UserProfile.ACTIVE_SUBSCRIPTION_STATUSES
+        
+        period_end = subscription.get('current_period_end')
+        if period_end:
+            profile.subscription_current_period_end = datetime.fromtimestamp(period_end, tz=dt_timezone.utc)
+        
+        profile.save()
+        
+        print(f"🔄 Abonnement {subscription['status']} pour {profile.user.username}")
+        
+    except UserProfile.DoesNotExist:
+        print(f"❌ Profil introuvable pour l'abonnement {subscription['id']}")
+
+
+def handle_subscription_cancelled(subscription):
+    """Traite l'annulation d'un abonnement"""
+    try:
+        profile = UserProfile.objects.select_related('user').get(stripe_subscription_id=subscription['id'])
+        profile.is_premium = False
+        profile.subscription_status = 'canceled'
+        profile.save()
+        
+        print(f"❌ Abonnement annulé pour {profile.user.username}")
+        
+    except UserProfile.DoesNotExist:
+        print(f"❌ Profil introuvable pour l'abonnement {subscription['id']}")
+
+
+def handle_payment_succeeded(invoice):
+    """Traite un paiement d'abonnement réussi (renouvellement)"""
+    customer_id = invoice['customer']
+    
+    profiles = UserProfile.objects.filter(stripe_customer_id=customer_id).exclude(
+        subscription_status='canceled'
+    )
+    user_ids = list(profiles.values_list('user_id', flat=True))
+    
+    if not user_ids:
+        print(f"❌ Profil introuvable pour le client {customer_id}")
+        return
+    
+    profiles.update(is_premium=True, subscription_status='active', updated_at=timezone.now())
+    # update() n'envoie pas post_save : on invalide le cache des droits nous-mêmes
+    for user_id in user_ids:
+        cache.delete('entitlement', user_id)
+
+
+def handle_payment_failed(invoice):
+    """Traite un paiement échoué"""
+    customer_id = invoice['customer']
+    
+    try:
+        profile = UserProfile.objects.select_related('user').get(stripe_customer_id=customer_id)
+        # Stripe relance le paiement : l'accès est conservé pendant ce délai
+        profile.subscription_status = 'past_due'
+        profile.save()
+        # Tu peux envoyer un email de rappel ici
+        print(f"⚠️ Paiement échoué pour {profile.user.username}")
+        
+    except UserProfile.DoesNotExist:
+        print(f"❌ Profil introuvable pour le client {customer_id}")
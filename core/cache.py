@@ -0,0 +1,84 @@
+"""
+Cache partagé entre les workers gunicorn et les serveurs.
+Les clés sont regroupées par espace de noms ('pdf', 'stats', 'entitlement'...).
+Si Redis ne répond pas, on bascule sur le cache mémoire du process.
+"""
+from django.core.cache import caches
+import time
+
+
+def make_key(namespace, key):
+    """Construit la clé complète (le préfixe et la version sont ajoutés par Django)"""
+    return f'{namespace}:{key}'
+
+
+def _call(method, *args, **kwargs):
+    """Appelle le cache partagé, ou le cache local si le partagé est indisponible"""
+    try:
+        return getattr(caches['default'], method)(*args, **kwargs)
+    except Exception as e:
+        print(f"⚠️ [CACHE] Cache partagé indisponible ({e}), repli sur le cache local")
+        return getattr(caches['local'], method)(*args, **kwargs)
+
+
+def get(namespace, key, default=None):
+    return _call('get', make_key(namespace, key), default)
+
+
+def set(namespace, key, value, timeout=None):
+    _call('set', make_key(namespace, key), value, timeout)
+
+
+def add(namespace, key, value, timeout=None):
+    """Stocke la valeur seulement si la clé n'existe pas ; retourne True si ajoutée"""
+    return _call('add', make_key(namespace, key), value, timeout)
+
+
+def incr(namespace, key, delta=1, timeout=None):
+    """Incrémente un compteur, créé à 0 s'il n'existe pas ; retourne la nouvelle valeur"""
+    full_key = make_key(namespace, key)
+    _call('add', full_key, 0, timeout)
+    return _call('incr', full_key, delta)
+
+
+def take_token(namespace, key, rate, burst, timeout=60 * 60):
+    """
+    Seau à jetons partagé (algorithme GCRA) : `rate` jetons par seconde, au plus
+    `burst` d'avance. Prend un jeton et retourne 0, ou, si le seau est vide,
+    retourne le nombre de secondes avant le prochain jeton.
+    Seul le compteur est stocké (instant théorique du prochain jeton, en ms) :
+    incr() le fait avancer atomiquement, même entre plusieurs serveurs.
+    """
+    interval = max(1, round(1000 / rate))
+    now = int(time.time() * 1000)
+    
+    tat = incr(namespace, key, interval, timeout)
+    
+    # Seau resté inactif : il est plein, on repart de maintenant
+    if tat - interval < now:
+        set(namespace, key, now + interval, timeout)
+        return 0
+    
+    # Seau vide : on rend le jeton et on indique quand réessayer
+    if tat - now > burst * interval:
+        incr(namespace, key, -interval, timeout)
+        return (tat - now - burst * interval) / 1000
+    
+    return 0
+
+
+def delete(namespace, key):
+    _call('delete', make_key(namespace, key))
+
+
+def get_or_set(namespace, key, compute, timeout=None):
+    """
+    Retourne la valeur en cache, ou la calcule avec compute() et la stocke.
+    None n'est jamais mis en cache.
+    """
+    value = get(namespace, key)
+    if value is None:
+        value = compute()
+        if value is not None:
+            set(namespace, key, value, timeout)
+    return value
@@ -3,6 +3,7 @@ from django.contrib import messages
 from core.models import UserProfile
 from django.utils import timezone
 from datetime import timedelta
+from functools import wraps
 
 def admin_required(view_func):
     """
@@ -35,4 +36,24 @@ def admin_required(view_func):
         
         return view_func(request, *args, **kwargs)
     
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def rate_limited(action, by_ip=False):
+    """
+    Décorateur qui limite le débit d'une action par utilisateur, ou par
+    adresse IP pour les pages publiques (by_ip=True), voir core.ratelimit.
+    Au-delà : réponse 429 avec Retry-After.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            from core import ratelimit
+            
+            key = f'ip:{ratelimit.client_ip(request)}' if by_ip else request.user.id
+            wait = ratelimit.retry_after(key, action)
+            if wait:
+                return ratelimit.too_many_requests(request, wait)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
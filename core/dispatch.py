@@ -0,0 +1,135 @@
+"""
+Lancement des tâches en arrière-plan, avec ou sans broker.
+Avec CELERY_BROKER_URL, submit() envoie la tâche dans la file Celery.
+Sans broker, ou s'il est injoignable, la tâche tourne dans un pool de
+threads du process web. Le pool a TASK_POOL_WORKERS threads et au plus
+TASK_POOL_QUEUE tâches en attente. Quand il est plein, la tâche tourne dans
+le thread appelant (contre-pression), ou elle est abandonnée si elle n'est
+que spéculative. self.retry() garde le même nombre d'essais et le même délai
+qu'avec Celery. À l'arrêt du process, les tâches déjà lancées sont terminées.
+"""
+from celery.exceptions import Retry
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+import atexit
+import threading
+import traceback
+import uuid
+
+
+_executor = None
+_slots = None
+_timers = set()
+_lock = threading.Lock()
+
+
+def broker_configured():
+    return bool(settings.CELERY_BROKER_URL)
+
+
+def submit(task, args=(), kwargs=None, countdown=None, speculative=False):
+    """
+    Lance la tâche Celery `task` en arrière-plan. Retourne False seulement si
+    une tâche spéculative a été abandonnée (pool local plein).
+    """
+    kwargs = kwargs or {}
+
+    if broker_configured():
+        try:
+            task.apply_async(args=args, kwargs=kwargs, countdown=countdown)
+            return True
+        except Exception as e:
+            print(f"⚠️ Broker indisponible ({e}), tâche {task.name} exécutée sur place")
+
+    if countdown:
+        schedule_local(countdown, task, args, kwargs, 0, speculative)
+        return True
+    return submit_local(task, args, kwargs, 0, speculative)
+
+
+def get_executor():
+    """Pool de threads du process, créé au premier usage"""
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _slots = threading.BoundedSemaphore(settings.TASK_POOL_WORKERS + settings.TASK_POOL_QUEUE)
+            _executor = ThreadPoolExecutor(max_workers=settings.TASK_POOL_WORKERS, thread_name_prefix='task')
+            atexit.register(shutdown)
+    return _executor
+
+
+def submit_local(task, args, kwargs, retries, speculative=False):
+    executor = get_executor()
+
+    # File locale pleine : on ralentit l'appelant plutôt que d'empiler sans fin
+    if not _slots.acquire(blocking=False):
+        if speculative:
+            print(f"⚠️ Pool de tâches plein, {task.name} abandonnée")
+            return False
+        run_local(task, args, kwargs, retries)
+        return True
+
+    def job():
+        try:
+            run_local(task, args, kwargs, retries)
+        finally:
+            _slots.release()
+            # Chaque thread du pool a sa propre connexion à la base
+            connection.close()
+
+    try:
+        executor.submit(job)
+    except RuntimeError:
+        # Pool arrêté (fin du process) : on termine la tâche sur place
+        _slots.release()
+        run_local(task, args, kwargs, retries)
+    return True
+
+
+def schedule_local(delay, task, args, kwargs, retries, speculative=False):
+    """Lance la tâche dans le pool local après `delay` secondes"""
+    def fire():
+        with _lock:
+            _timers.discard(timer)
+        submit_local(task, args, kwargs, retries, speculative)
+
+    timer = threading.Timer(delay, fire)
+    timer.daemon = True
+    with _lock:
+        _timers.add(timer)
+    timer.start()
+
+
+def run_local(task, args, kwargs, retries):
+    """
+    Exécute la tâche comme le ferait un worker Celery : self.request.retries
+    est renseigné, et self.retry() reprogramme la tâche après son délai.
+    """
+    task.push_request(
+        id=uuid.uuid4().hex, args=list(args), kwargs=kwargs, retries=retries,
+        is_eager=True, called_directly=False, delivery_info={},
+    )
+    try:
+        task.run(*args, **kwargs)
+    except Retry as retry:
+        schedule_local(retry.when or 0, task, args, kwargs, retries + 1)
+    except Exception as e:
+        print(f"❌ [TÂCHE] {task.name} : {e}")
+        traceback.print_exc()
+    finally:
+        task.pop_request()
+
+
+def shutdown():
+    """Fin du process : termine les tâches lancées, signale les tentatives perdues"""
+    with _lock:
+        timers = list(_timers)
+        _timers.clear()
+    for timer in timers:
+        timer.cancel()
+    if timers:
+        print(f"⚠️ {len(timers)} tâche(s) programmée(s) non exécutée(s) à l'arrêt")
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
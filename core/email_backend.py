@@ -3,10 +3,15 @@ Backend email personnalisé utilisant l'API HTTP de Brevo
 pour contourner les restrictions SMTP de Render Free.
 """
 from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.smtp import EmailBackend as SMTPBackend
 from django.conf import settings
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 import base64
+import os
+import smtplib
+import threading
+import time
 
 
 class BrevoAPIBackend(BaseEmailBackend):
@@ -56,13 +61,20 @@ class BrevoAPIBackend(BaseEmailBackend):
                     from_name = "FactureSnap"
                     from_addr = from_email
                 
+                # Corps HTML et/ou texte (EmailMultiAlternatives : texte + HTML en alternative)
+                html_content = message.body if message.content_subtype == 'html' else None
+                text_content = message.body if message.content_subtype != 'html' else None
+                for content, mimetype in getattr(message, 'alternatives', []):
+                    if mimetype == 'text/html':
+                        html_content = content
+                
                 # Prépare l'email
                 send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
                     to=[{"email": recipient} for recipient in message.to],
                     sender={"name": from_name, "email": from_addr},
                     subject=message.subject,
-                    html_content=message.body if message.content_subtype == 'html' else None,
-                    text_content=message.body if message.content_subtype != 'html' else None,
+                    html_content=html_content,
+                    text_content=text_content,
                 )
                 
                 # Ajoute Reply-To si présent
@@ -105,4 +117,109 @@ class BrevoAPIBackend(BaseEmailBackend):
                 if not self.fail_silently:
                     raise
         
-        return num_sent
\ No newline at end of file
+        return num_sent
+
+
+# Connexions SMTP gardées ouvertes par process
+SMTP_POOL_SIZE = 4
+SMTP_POOL_IDLE_TIMEOUT = 60  # au-delà, le serveur a pu fermer : on ne réutilise pas
+SMTP_POOL_NOOP_AFTER = 5  # au-delà, NOOP avant réutilisation
+
+_smtp_pool = {}
+_smtp_pool_lock = threading.Lock()
+
+
+def _quit_quietly(connection):
+    try:
+        connection.quit()
+    except Exception:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class PooledSMTPBackend(SMTPBackend):
+    """
+    Backend SMTP qui garde quelques connexions authentifiées ouvertes par
+    process : un email ne paie plus la connexion TCP, le TLS et l'AUTH à
+    chaque envoi. Une connexion restée inactive est vérifiée (NOOP) avant
+    d'être réutilisée ; si le serveur l'a coupée, l'email repart sur une
+    connexion neuve.
+    """
+    
+    def pool_key(self):
+        # Le pid évite de partager une connexion héritée d'un fork (workers Celery)
+        return (os.getpid(), self.host, self.port, self.username, self.use_tls, self.use_ssl)
+    
+    def open(self):
+        if self.connection:
+            return False
+        
+        self.connection = self.checkout()
+        if self.connection is not None:
+            return True
+        return super().open()
+    
+    def close(self):
+        if self.connection is None:
+            return
+        
+        connection, self.connection = self.connection, None
+        with _smtp_pool_lock:
+            idle = _smtp_pool.setdefault(self.pool_key(), [])
+            if len(idle) < SMTP_POOL_SIZE:
+                idle.append((connection, time.monotonic()))
+                return
+        
+        _quit_quietly(connection)
+    
+    def checkout(self):
+        """Connexion libre du pool, encore valide ; None s'il faut en ouvrir une"""
+        while True:
+            with _smtp_pool_lock:
+                idle = _smtp_pool.get(self.pool_key())
+                if not idle:
+                    return None
+                connection, last_used = idle.pop()
+            
+            age = time.monotonic() - last_used
+            if age > SMTP_POOL_IDLE_TIMEOUT:
+                _quit_quietly(connection)
+                continue
+            
+            if age > SMTP_POOL_NOOP_AFTER:
+                try:
+                    healthy = connection.noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    healthy = False
+                if not healthy:
+                    _quit_quietly(connection)
+                    continue
+            
+            return connection
+    
+    def _send(self, email_message):
+        try:
+            return self._send_once(email_message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Connexion coupée par le serveur : une seule nouvelle tentative, sur une connexion neuve
+            _quit_quietly(self.connection)
+            self.connection = None
+            if not super().open():
+                return False
+            return super()._send(email_message)
+    
+    def _send_once(self, email_message):
+        """Premier essai : les coupures remontent toujours, pour pouvoir reconnecter"""
+        fail_silently, self.fail_silently = self.fail_silently, False
+        try:
+            return super()._send(email_message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            raise
+        except smtplib.SMTPException:
+            if not fail_silently:
+                raise
+            return False
+        finally:
+            self.fail_silently = fail_silently
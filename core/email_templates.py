@@ -0,0 +1,178 @@
+"""
+Templates d'emails précompilés. build_email_templates lit chaque template
+de templates/emails/, recopie les règles du bloc <style> dans l'attribut
+style de chaque balise (beaucoup de clients mail ignorent <style>), puis
+en tire une version texte. Les deux versions sont écrites dans
+templates/emails/compiled/ ; un envoi ne fait plus que remplacer les
+variables. Si la commande n'a pas été lancée, la compilation est faite
+en mémoire au premier envoi du process.
+"""
+from django.conf import settings
+from django.template import TemplateDoesNotExist, engines
+from django.template.loader import get_template
+from xml.etree import ElementTree
+from pathlib import Path
+import cssselect2
+import re
+import tinycss2
+import tinyhtml5
+
+
+EMAIL_TEMPLATES = ['invoice_email', 'reminder_email']
+COMPILED_DIR = 'emails/compiled'
+
+# Balises qui commencent une nouvelle ligne dans la version texte
+TEXT_BLOCKS = {'div', 'p', 'h1', 'h2', 'h3', 'table', 'tr', 'ul', 'ol', 'li'}
+TEXT_PARAGRAPHS = {'p', 'h1', 'h2', 'h3', 'table', 'ul', 'ol'}
+
+_compiled = {}
+
+
+def get_compiled_dir():
+    return Path(settings.BASE_DIR) / 'templates' / COMPILED_DIR
+
+
+def render_email(name, context):
+    """Rend l'email `name` (ex. 'invoice_email'). Retourne (html, texte)."""
+    html_template, text_template = get_compiled(name)
+    html = html_template.render(context)
+    # Les balises {% if %} laissent des lignes vides dans la version texte
+    text = re.sub(r'\n\s*\n\s*(\n\s*)+', '\n\n', text_template.render(context)).strip()
+    return html, text + '\n'
+
+
+def get_compiled(name):
+    templates = _compiled.get(name)
+    if templates is None:
+        try:
+            templates = (
+                get_template(f'{COMPILED_DIR}/{name}.html'),
+                get_template(f'{COMPILED_DIR}/{name}.txt'),
+            )
+        except TemplateDoesNotExist:
+            print(f"⚠️ Template {name} non précompilé (manage.py build_email_templates), compilation en mémoire")
+            html, text = compile_email_template(name)
+            engine = engines['django']
+            templates = (engine.from_string(html), engine.from_string(text))
+        _compiled[name] = templates
+    return templates
+
+
+def compile_email_template(name):
+    """Source Django du template avec CSS en ligne, et de sa version texte"""
+    source = get_template(f'emails/{name}.html').template.source
+    root = tinyhtml5.parse(source, namespace_html_elements=False)
+    inline_css(root)
+    html = '<!DOCTYPE html>\n' + ElementTree.tostring(root, encoding='unicode', method='html')
+    text = '{% autoescape off %}' + html_to_text(root) + '{% endautoescape %}\n'
+    return html, text
+
+
+def build_all():
+    """Écrit les templates compilés ; retourne les chemins écrits"""
+    folder = get_compiled_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name in EMAIL_TEMPLATES:
+        html, text = compile_email_template(name)
+        for extension, content in (('html', html), ('txt', text)):
+            path = folder / f'{name}.{extension}'
+            path.write_text(content, encoding='utf-8')
+            written.append(path)
+    _compiled.clear()
+    return written
+
+
+def inline_css(root):
+    """
+    Applique les règles des blocs <style> dans l'attribut style des balises,
+    par ordre de spécificité. Les règles qu'on ne peut pas mettre en ligne
+    (@media, :hover...) restent dans un bloc <style>.
+    """
+    matcher = cssselect2.Matcher()
+    kept = []
+    order = 0
+
+    for style in root.iter('style'):
+        for rule in tinycss2.parse_stylesheet(style.text or '', skip_whitespace=True, skip_comments=True):
+            if rule.type != 'qualified-rule' or any(token.type == 'literal' and token.value == ':' for token in rule.prelude):
+                kept.append(rule.serialize())
+                continue
+
+            declarations = [
+                (declaration.lower_name, tinycss2.serialize(declaration.value).strip(), declaration.important)
+                for declaration in tinycss2.parse_blocks_contents(rule.content, skip_whitespace=True, skip_comments=True)
+                if declaration.type == 'declaration'
+            ]
+            for selector in cssselect2.compile_selector_list(rule.prelude):
+                matcher.add_selector(selector, (order, declarations))
+            order += 1
+
+    for element in cssselect2.ElementWrapper.from_html_root(root).iter_subtree():
+        matches = matcher.match(element)
+        if not matches:
+            continue
+
+        properties = {}
+        for important in (False, True):
+            for _, _, _, (_, declarations) in sorted(matches, key=lambda match: (match[0], match[3][0])):
+                for name, value, is_important in declarations:
+                    if is_important == important:
+                        properties[name] = value + (' !important' if important else '')
+
+        # Le style déjà écrit sur la balise reste prioritaire
+        existing = element.etree_element.get('style')
+        if existing:
+            for declaration in tinycss2.parse_blocks_contents(existing, skip_whitespace=True, skip_comments=True):
+                if declaration.type == 'declaration':
+                    properties[declaration.lower_name] = tinycss2.serialize(declaration.value).strip()
+
+        element.etree_element.set('style', '; '.join(f'{name}: {value}' for name, value in properties.items()))
+
+    head = root.find('head')
+    for style in list(root.iter('style')):
+        if kept:
+            style.text = '\n'.join(kept)
+            kept = []
+        else:
+            head.remove(style)
+
+
+def html_to_text(root):
+    """Version texte du body : un bloc par ligne, les liens suivis de leur adresse"""
+    parts = []
+
+    def add_text(text):
+        # Les retours à la ligne du source HTML ne comptent pas, seuls ceux des blocs
+        if text:
+            parts.append(re.sub(r'\s+', ' ', text))
+
+    def walk(element):
+        tag = element.tag
+        if tag in ('style', 'script', 'head'):
+            return
+        # Lignes de tableau en CSS (invoice-row) : libellé et valeur sur la même ligne
+        display = re.search(r'display:\s*([\w-]+)', element.get('style', ''))
+        display = display.group(1) if display else None
+        if display == 'table-cell':
+            parts.append(' ')
+            tag = 'span'
+        elif display == 'table-row':
+            tag = 'tr'
+        if tag in TEXT_BLOCKS:
+            parts.append('\n\n' if tag in TEXT_PARAGRAPHS else '\n')
+        if tag == 'br':
+            parts.append('\n')
+        add_text(element.text)
+        for child in element:
+            walk(child)
+            add_text(child.tail)
+        if tag == 'a' and element.get('href'):
+            parts.append(f" : {element.get('href')}")
+        if tag in TEXT_BLOCKS:
+            parts.append('\n\n' if tag in TEXT_PARAGRAPHS else '\n')
+
+    walk(root.find('body'))
+
+    lines = [re.sub(' +', ' ', line).strip() for line in ''.join(parts).split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip() + '\n'
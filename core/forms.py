@@ -1,10 +1,38 @@
 from django import forms
-from .models import Invoice, InvoiceItem, Client,UserProfile
+from django.urls import reverse
+from .models import Invoice, InvoiceItem, Client,UserProfile, WebhookEndpoint
+from django.conf import settings
 from django.forms import inlineformset_factory
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from datetime import date
 
+class ClientAutocompleteSelect(forms.Select):
+    """
+    Liste des clients remplie à la demande par l'autocomplétion :
+    seul le client sélectionné est rendu dans la page.
+    """
+    
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        clients = []
+        for v in value:
+            # Valeur postée invalide ou client d'un autre compte : rien à afficher
+            try:
+                client = field.to_python(v)
+            except forms.ValidationError:
+                continue
+            if client is not None:
+                clients.append(client)
+        
+        all_choices = self.choices
+        self.choices = [('', field.empty_label)] + [(c.pk, field.label_from_instance(c)) for c in clients]
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = all_choices
+
+
 class InvoiceForm(forms.ModelForm):
     """Formulaire pour créer/modifier une facture"""
     
@@ -12,7 +40,7 @@ class InvoiceForm(forms.ModelForm):
         model = Invoice
         fields = ['client', 'invoice_number', 'issue_date', 'due_date', 'tax_rate', 'notes']
         widgets = {
-            'client': forms.Select(attrs={
+            'client': ClientAutocompleteSelect(attrs={
                 'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500 focus:border-transparent'
             }),
             'invoice_number': forms.TextInput(attrs={
@@ -44,7 +72,9 @@ class InvoiceForm(forms.ModelForm):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         if user:
+            # La validation ne lit que le client soumis (queryset.get(pk=...))
             self.fields['client'].queryset = Client.objects.filter(user=user)
+        self.fields['client'].widget.attrs['data-autocomplete-url'] = reverse('core:client_autocomplete')
     
     def clean_issue_date(self):
         """Valide que la date d'émission n'est pas dans le futur"""
@@ -145,6 +175,92 @@ class ClientForm(forms.ModelForm):
             if len(siret) != 14:
                 raise forms.ValidationError("Le SIRET doit contenir exactement 14 chiffres.")
         return siret
+class ClientImportForm(forms.Form):
+    """Formulaire d'import de clients (CSV ou JSON)"""
+    
+    ALLOWED_EXTENSIONS = ('.csv', '.json', '.jsonl')
+    MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+    
+    file = forms.FileField(
+        label="Fichier",
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500',
+            'accept': '.csv,.json,.jsonl'
+        })
+    )
+    
+    def clean_file(self):
+        """Valide l'extension et la taille du fichier"""
+        file = self.cleaned_data.get('file')
+        if file:
+            if not file.name.lower().endswith(self.ALLOWED_EXTENSIONS):
+                raise forms.ValidationError("Le fichier doit être au format CSV ou JSON.")
+            if file.size > self.MAX_UPLOAD_SIZE:
+                raise forms.ValidationError("Le fichier ne doit pas dépasser 50 Mo.")
+        return file
+
+
+class BankStatementForm(forms.Form):
+    """Relevé bancaire à rapprocher des factures ouvertes (CSV, OFX ou CAMT.053)"""
+    
+    ALLOWED_EXTENSIONS = ('.csv', '.ofx', '.qfx', '.xml')
+    # Au-delà, utiliser la commande `manage.py reconcile_statement`
+    MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+    
+    file = forms.FileField(
+        label="Relevé",
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500',
+            'accept': '.csv,.ofx,.qfx,.xml'
+        })
+    )
+    
+    def clean_file(self):
+        """Valide l'extension et la taille du fichier"""
+        file = self.cleaned_data.get('file')
+        if file:
+            if not file.name.lower().endswith(self.ALLOWED_EXTENSIONS):
+                raise forms.ValidationError("Le relevé doit être au format CSV, OFX ou CAMT.053 (XML).")
+            if file.size > self.MAX_UPLOAD_SIZE:
+                raise forms.ValidationError("Le relevé ne doit pas dépasser 10 Mo.")
+        return file
+
+
+class WebhookEndpointForm(forms.ModelForm):
+    """Formulaire d'ajout d'une URL de webhook"""
+    
+    events = forms.MultipleChoiceField(
+        label="Événements",
+        choices=WebhookEndpoint.EVENT_CHOICES,
+        initial=[value for value, label in WebhookEndpoint.EVENT_CHOICES],
+        widget=forms.CheckboxSelectMultiple,
+    )
+    
+    class Meta:
+        model = WebhookEndpoint
+        fields = ['url', 'events']
+        widgets = {
+            'url': forms.URLInput(attrs={
+                'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500',
+                'placeholder': 'https://exemple.fr/webhooks/facturesnap'
+            }),
+        }
+    
+    def clean_url(self):
+        """Exige HTTPS en production et un hôte public (pas d'adresse du réseau interne)"""
+        from .webhooks import UnsafeWebhookURL, check_url
+        
+        url = self.cleaned_data.get('url')
+        if url and not settings.DEBUG and not url.startswith('https://'):
+            raise forms.ValidationError("L'URL doit commencer par https://")
+        if url:
+            try:
+                check_url(url)
+            except UnsafeWebhookURL as e:
+                raise forms.ValidationError(f"URL refusée : {e}")
+        return url
+
+
 class UserForm(forms.ModelForm):
     """Formulaire pour les infos de base de l'utilisateur"""
     
@@ -172,7 +288,7 @@ class UserProfileForm(forms.ModelForm):
     
     class Meta:
         model = UserProfile
-        fields = ['company_name', 'address', 'postal_code', 'city', 'country', 'siret', 'phone', 'logo']
+        fields = ['company_name', 'address', 'postal_code', 'city', 'country', 'siret', 'phone', 'logo', 'invoice_delivery']
         widgets = {
             'company_name': forms.TextInput(attrs={
                 'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500',
@@ -206,6 +322,9 @@ class UserProfileForm(forms.ModelForm):
             'logo': forms.FileInput(attrs={
                 'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500'
             }),
+            'invoice_delivery': forms.Select(attrs={
+                'class': 'w-full border border-gray-300 rounded-lg px-4 py-2 focus:ring-2 focus:ring-blue-500'
+            }),
         }
 
 
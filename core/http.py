@@ -0,0 +1,92 @@
+"""
+Réponses HTTP pour servir des fichiers stockés, avec prise en charge des
+requêtes Range (reprise de téléchargement, lecteurs PDF qui chargent par
+morceaux).
+"""
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+import re
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_file_range(file, start, length):
+    """Lit `length` octets du fichier à partir de `start`, par blocs"""
+    file.seek(start)
+    remaining = length
+    try:
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def parse_range(range_header, size):
+    """
+    Retourne (début, fin) inclus pour un en-tête "bytes=a-b", ou None si
+    l'en-tête est absent ou non géré (plusieurs plages).
+    Lève ValueError si la plage est hors du fichier.
+    """
+    match = RANGE_RE.match(range_header.strip())
+    if not match:
+        return None
+    
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    
+    if not start:
+        # "bytes=-500" : les 500 derniers octets
+        start = max(0, size - int(end))
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    
+    if start > end or start >= size:
+        raise ValueError("Plage hors du fichier")
+    
+    return start, end
+
+
+def ranged_file_response(request, file, size, filename, content_type, etag=None):
+    """
+    Sert un fichier en streaming : réponse 206 si le client demande une plage,
+    200 avec le fichier complet sinon.
+    """
+    range_header = request.META.get('HTTP_RANGE', '')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    
+    # If-Range : la plage n'est valable que si le fichier n'a pas changé
+    if range_header and if_range and etag and if_range.strip('"') != etag:
+        range_header = ''
+    
+    try:
+        byte_range = parse_range(range_header, size) if range_header else None
+    except ValueError:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, filename=filename)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_file_range(file, start, length),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,542 @@
+"""
+Import groupé de clients et de factures depuis un fichier CSV ou JSON.
+Le fichier est lu ligne par ligne (ou objet par objet) et les objets valides
+sont insérés par lots : la mémoire utilisée ne dépend pas de la taille du
+fichier, seulement du lot en cours et de l'ensemble des emails déjà connus.
+Les lignes refusées sont écrites dans un rapport CSV joint à l'import.
+"""
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from . import cache, webhooks
+from .forms import ClientForm
+from .models import Client, ClientImport, Invoice, InvoiceItem, InvoiceNumberSequence
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import csv
+import io
+import json
+import tempfile
+
+
+IMPORT_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+
+# Colonnes acceptées en plus des noms de champs du modèle
+COLUMN_ALIASES = {
+    'nom': 'name',
+    'raison_sociale': 'name',
+    'e-mail': 'email',
+    'mail': 'email',
+    'telephone': 'phone',
+    'téléphone': 'phone',
+    'tel': 'phone',
+    'adresse': 'address',
+    'code_postal': 'postal_code',
+    'cp': 'postal_code',
+    'ville': 'city',
+    'pays': 'country',
+}
+
+
+def normalize_row(row):
+    """Ramène les noms de colonnes aux champs de ClientForm"""
+    data = {}
+    for column, value in row.items():
+        if column is None:
+            continue
+        key = column.strip().lower().replace(' ', '_')
+        key = COLUMN_ALIASES.get(key, key)
+        if key in ClientForm.Meta.fields:
+            data[key] = '' if value is None else str(value).strip()
+    
+    # Colonne absente : valeur par défaut du modèle (ex. pays = France)
+    for name in ClientForm.Meta.fields:
+        if not data.get(name):
+            field = Client._meta.get_field(name)
+            if field.has_default():
+                data[name] = field.get_default()
+    return data
+
+
+def iter_csv_rows(file):
+    """Lignes d'un CSV (séparateur , ; ou tabulation détecté sur l'en-tête)"""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    sample = text.read(READ_CHUNK_SIZE)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample.split('\n', 1)[0], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    
+    for row in csv.DictReader(text, dialect=dialect):
+        yield row
+
+
+def iter_json_rows(file):
+    """
+    Objets d'un fichier JSON : tableau d'objets ou JSON Lines (un objet par ligne).
+    Le tableau est décodé objet par objet, sans charger le fichier entier.
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig')
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    
+    while True:
+        # Saute les séparateurs entre deux objets
+        buffer = buffer.lstrip(' \t\r\n,[]')
+        
+        if not buffer:
+            if eof:
+                return
+            chunk = text.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        
+        try:
+            obj, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Objet coupé en fin de bloc : on lit la suite
+            chunk = text.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        
+        buffer = buffer[end:]
+        yield obj if isinstance(obj, dict) else {}
+
+
+def iter_rows(client_import):
+    """
+    Lignes du fichier importé selon son extension, avec le numéro de ligne
+    de la première (après l'en-tête pour un CSV).
+    """
+    client_import.file.open('rb')
+    if client_import.file.name.lower().endswith('.csv'):
+        return iter_csv_rows(client_import.file.file), 2
+    return iter_json_rows(client_import.file.file), 1
+
+
+def format_errors(form):
+    return ' ; '.join(
+        f"{field}: {' '.join(errors)}" if field != '__all__' else ' '.join(errors)
+        for field, errors in form.errors.items()
+    )
+
+
+def run_client_import(client_import):
+    """
+    Valide chaque ligne avec les règles de ClientForm, écarte les emails déjà
+    présents (chez l'utilisateur ou plus haut dans le fichier) et insère les
+    clients valides par lots de IMPORT_BATCH_SIZE.
+    Seuls les clients réellement insérés sont comptés : un client créé
+    pendant l'import avec le même email est signalé comme doublon.
+    """
+    user = client_import.user
+    
+    # Une seule requête pour tous les doublons possibles
+    known_emails = {email.lower() for email in Client.objects.filter(user=user).values_list('email', flat=True)}
+    
+    ClientImport.objects.filter(pk=client_import.pk).update(status='running')
+    
+    batch = []
+    total_rows = imported_count = error_count = 0
+    errors_preview = []
+    
+    with tempfile.TemporaryFile(mode='w+', newline='', encoding='utf-8') as report:
+        writer = csv.writer(report)
+        writer.writerow(['ligne', 'email', 'erreur'])
+        
+        def reject(line, email, error, count=1):
+            nonlocal error_count
+            error_count += count
+            writer.writerow([line, email, error])
+            if len(errors_preview) < ClientImport.ERRORS_PREVIEW_SIZE:
+                errors_preview.append({'line': line, 'email': email, 'error': error})
+        
+        def flush():
+            nonlocal imported_count
+            # Clients créés entre-temps (à la main, par l'API) : signalés comme doublons
+            existing = set(
+                Client.objects.filter(user=user)
+                .annotate(email_key=Lower('email'))
+                .filter(email_key__in=[client.email.lower() for _, client in batch])
+                .values_list('email_key', flat=True)
+            )
+            for line, client in batch:
+                if client.email.lower() in existing:
+                    reject(line, client.email, "Un client avec cet email existe déjà.")
+            clients = [client for _, client in batch if client.email.lower() not in existing]
+            emails = [client.email for client in clients]
+            
+            with transaction.atomic():
+                # ignore_conflicts : un client créé à l'instant n'interrompt pas l'import ;
+                # seules les lignes réellement insérées sont comptées
+                before = Client.objects.filter(user=user, email__in=emails).count()
+                Client.objects.bulk_create(clients, batch_size=IMPORT_BATCH_SIZE, ignore_conflicts=True)
+                inserted = Client.objects.filter(user=user, email__in=emails).count() - before
+            
+            imported_count += inserted
+            if inserted < len(clients):
+                reject('', '', "Client(s) créé(s) pendant l'import avec le même email : ignoré(s).", count=len(clients) - inserted)
+            
+            batch.clear()
+            ClientImport.objects.filter(pk=client_import.pk).update(
+                total_rows=total_rows, imported_count=imported_count, error_count=error_count,
+            )
+        
+        try:
+            rows, first_line = iter_rows(client_import)
+            for line, row in enumerate(rows, start=first_line):
+                total_rows += 1
+                data = normalize_row(row)
+                email = data.get('email', '')
+                
+                form = ClientForm(data=data)
+                if not form.is_valid():
+                    reject(line, email, format_errors(form))
+                    continue
+                
+                email_key = form.cleaned_data['email'].lower()
+                if email_key in known_emails:
+                    reject(line, email, "Un client avec cet email existe déjà.")
+                    continue
+                known_emails.add(email_key)
+                
+                client = form.save(commit=False)
+                client.user = user
+                batch.append((line, client))
+                
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    flush()
+            
+            flush()
+            status = 'done'
+        
+        except (ValueError, csv.Error) as e:
+            # Fichier illisible (encodage, JSON invalide...) : on garde ce qui est déjà importé
+            print(f"❌ Import {client_import.id} interrompu : {e}")
+            flush()
+            reject(total_rows + 1, '', f"Fichier illisible : {e}")
+            status = 'failed'
+        
+        finally:
+            client_import.file.close()
+        
+        if error_count:
+            report.flush()
+            report.buffer.seek(0)
+            client_import.error_report.save(f'import_{client_import.id}_erreurs.csv', File(report.buffer), save=False)
+    
+    client_import.status = status
+    client_import.total_rows = total_rows
+    client_import.imported_count = imported_count
+    client_import.error_count = error_count
+    client_import.errors_preview = errors_preview
+    client_import.finished_at = timezone.now()
+    client_import.save()
+    
+    # bulk_create n'envoie pas post_save
+    cache.delete('recent-clients', user.id)
+    
+    print(f"✅ Import {client_import.id} : {imported_count} client(s) importé(s), {error_count} erreur(s)")
+    return client_import
+
+
+
+# --- Factures ---------------------------------------------------------------
+
+INVOICE_IMPORT_BATCH_SIZE = 1000
+INVOICE_IMPORT_STATUSES = ('draft', 'sent', 'paid')
+CENT = Decimal('0.01')
+
+
+def group_invoice_rows(rows):
+    """
+    Regroupe les lignes CSV (une par ligne de facture) en factures.
+    Les lignes consécutives qui ont la même référence (colonne `ref` ou
+    `invoice_number`) forment une seule facture ; sans référence, chaque
+    ligne est une facture à une seule ligne.
+    """
+    current = None
+    current_key = None
+    
+    for row in rows:
+        row = {k.strip().lower(): (v or '').strip() for k, v in row.items() if k}
+        key = row.get('ref') or row.get('invoice_number')
+        
+        if current is None or not key or key != current_key:
+            if current is not None:
+                yield current
+            current = {
+                'invoice_number': row.get('invoice_number', ''),
+                'client_email': row.get('client_email', ''),
+                'issue_date': row.get('issue_date', ''),
+                'due_date': row.get('due_date', ''),
+                'tax_rate': row.get('tax_rate', ''),
+                'status': row.get('status', ''),
+                'notes': row.get('notes', ''),
+                'items': [],
+            }
+            current_key = key
+        
+        current['items'].append({
+            'description': row.get('description', ''),
+            'quantity': row.get('quantity', ''),
+            'unit_price': row.get('unit_price', ''),
+        })
+    
+    if current is not None:
+        yield current
+
+
+def iter_invoice_records(file, name):
+    """Factures d'un fichier CSV (une ligne par ligne de facture) ou JSON"""
+    if name.lower().endswith('.csv'):
+        return group_invoice_rows(iter_csv_rows(file))
+    return iter_json_rows(file)
+
+
+def parse_date(value, label):
+    if isinstance(value, date):
+        return value
+    value = str(value or '').strip()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"{label} : date invalide ({value or 'vide'}).")
+
+
+def parse_decimal(value, label, default=None):
+    if value in (None, '') and default is not None:
+        return default
+    try:
+        return Decimal(str(value).replace(',', '.').replace(' ', ''))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"{label} : nombre invalide ({value or 'vide'}).")
+
+
+def parse_invoice_record(record, client_ids):
+    """
+    Valide une facture importée (mêmes règles que InvoiceForm et
+    InvoiceItemForm) et calcule ses totaux en mémoire.
+    Retourne (champs de la facture, lignes) ou lève ValueError.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Format de facture invalide.")
+    
+    email = str(record.get('client_email') or '').strip().lower()
+    client_id = client_ids.get(email)
+    if client_id is None:
+        raise ValueError(f"Client introuvable ({email or 'email vide'}).")
+    
+    issue_date = parse_date(record.get('issue_date') or date.today(), "Date d'émission")
+    due_date = parse_date(record.get('due_date'), "Date d'échéance")
+    if issue_date > date.today():
+        raise ValueError("La date d'émission ne peut pas être dans le futur.")
+    if due_date < issue_date:
+        raise ValueError("La date d'échéance doit être après la date d'émission.")
+    
+    tax_rate = parse_decimal(record.get('tax_rate'), "Taux de TVA", default=Decimal('20.00'))
+    if tax_rate < 0:
+        raise ValueError("Le taux de TVA ne peut pas être négatif.")
+    
+    status = str(record.get('status') or 'draft').strip()
+    if status not in INVOICE_IMPORT_STATUSES:
+        raise ValueError(f"Statut invalide ({status}).")
+    
+    invoice_number = str(record.get('invoice_number') or '').strip()
+    if len(invoice_number) > 50:
+        raise ValueError("Numéro de facture trop long (50 caractères max).")
+    
+    items = parse_invoice_items(record.get('items') or [])
+    
+    # Totaux calculés une fois, sans calculate_totals() à chaque ligne
+    subtotal = sum(item['total'] for item in items)
+    tax_amount = (subtotal * tax_rate / 100).quantize(CENT)
+    
+    fields = {
+        'client_id': client_id,
+        'invoice_number': invoice_number,
+        'status': status,
+        'issue_date': issue_date,
+        'due_date': due_date,
+        'tax_rate': tax_rate,
+        'subtotal': subtotal,
+        'tax_amount': tax_amount,
+        'total': subtotal + tax_amount,
+        'notes': str(record.get('notes') or ''),
+    }
+    return fields, items
+
+
+def parse_invoice_items(records):
+    """Valide des lignes de facture et calcule leur total ; lève ValueError"""
+    items = []
+    for position, item in enumerate(records, start=1):
+        if not isinstance(item, dict):
+            raise ValueError(f"Ligne {position} : format invalide.")
+        description = str(item.get('description') or '').strip()
+        if not description:
+            raise ValueError(f"Ligne {position} : description obligatoire.")
+        quantity = parse_decimal(item.get('quantity'), f"Ligne {position}, quantité", default=Decimal('1'))
+        unit_price = parse_decimal(item.get('unit_price'), f"Ligne {position}, prix unitaire")
+        if quantity <= 0:
+            raise ValueError(f"Ligne {position} : la quantité doit être supérieure à 0.")
+        if unit_price < 0:
+            raise ValueError(f"Ligne {position} : le prix ne peut pas être négatif.")
+        items.append({
+            'description': description[:500],
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total': (quantity * unit_price).quantize(CENT),
+        })
+    
+    if not items:
+        raise ValueError("Une facture doit avoir au moins une ligne.")
+    return items
+
+
+def allocate_invoice_numbers(user, year, count, taken):
+    """
+    Réserve `count` numéros pour l'année en sautant ceux déjà utilisés
+    (facture saisie à la main avec un numéro du compteur, ou numéro fourni
+    ailleurs dans le lot). À appeler dans la transaction du lot.
+    """
+    numbers = []
+    while len(numbers) < count:
+        block = InvoiceNumberSequence.allocate(user, year, count - len(numbers))
+        used = taken | set(Invoice.objects.filter(invoice_number__in=block).values_list('invoice_number', flat=True))
+        numbers += [number for number in block if number not in used]
+    return numbers
+
+
+def create_invoice_batch(user, batch, errors):
+    """
+    Écrit un lot de factures validées : numéros manquants réservés par blocs,
+    puis un bulk_create pour les factures et un pour leurs lignes.
+    La réservation des numéros et les insertions sont dans la même transaction :
+    si le lot échoue, le compteur revient en arrière et la numérotation reste
+    sans trou.
+    Retourne les numéros créés.
+    """
+    # Numéros fournis déjà utilisés : une seule requête pour le lot
+    explicit = [fields['invoice_number'] for _, fields, _ in batch if fields['invoice_number']]
+    taken = set(Invoice.objects.filter(invoice_number__in=explicit).values_list('invoice_number', flat=True))
+    
+    accepted = []
+    for index, fields, items in batch:
+        number = fields['invoice_number']
+        if number:
+            if number in taken:
+                errors.append({'index': index, 'invoice_number': number, 'error': "Ce numéro de facture existe déjà."})
+                continue
+            taken.add(number)
+        accepted.append((index, fields, items))
+    
+    # Numéros manquants : un bloc par année d'émission
+    missing_by_year = {}
+    for _, fields, _ in accepted:
+        if not fields['invoice_number']:
+            missing_by_year.setdefault(fields['issue_date'].year, []).append(fields)
+    
+    now = timezone.now()
+    
+    with transaction.atomic():
+        # Le compteur reste verrouillé jusqu'au commit du lot
+        for year, year_invoices in missing_by_year.items():
+            numbers = allocate_invoice_numbers(user, year, len(year_invoices), taken)
+            for fields, number in zip(year_invoices, numbers):
+                fields['invoice_number'] = number
+        
+        invoices = []
+        for _, fields, _ in accepted:
+            invoice = Invoice(user=user, **fields)
+            if invoice.status in ('sent', 'paid'):
+                invoice.sent_at = now
+            if invoice.status == 'paid':
+                invoice.paid_at = now
+            invoices.append(invoice)
+        
+        try:
+            with transaction.atomic():
+                Invoice.objects.bulk_create(invoices, batch_size=INVOICE_IMPORT_BATCH_SIZE)
+        except IntegrityError:
+            # Numéro enregistré ailleurs entre la vérification et l'insertion :
+            # les factures sont reprises une à une pour situer le doublon
+            inserted = []
+            for invoice, entry in zip(invoices, accepted):
+                try:
+                    with transaction.atomic():
+                        Invoice.objects.bulk_create([invoice])
+                except IntegrityError:
+                    errors.append({'index': entry[0], 'invoice_number': invoice.invoice_number, 'error': "Ce numéro de facture existe déjà."})
+                    continue
+                inserted.append((invoice, entry))
+            invoices = [invoice for invoice, _ in inserted]
+            accepted = [entry for _, entry in inserted]
+        
+        InvoiceItem.objects.bulk_create(
+            [
+                InvoiceItem(invoice=invoice, **item)
+                for invoice, (_, _, items) in zip(invoices, accepted)
+                for item in items
+            ],
+            batch_size=INVOICE_IMPORT_BATCH_SIZE,
+        )
+        if invoices:
+            webhooks.emit('invoice.created', [invoice.id for invoice in invoices], [user.id])
+    
+    return [invoice.invoice_number for invoice in invoices]
+
+
+def import_invoices(user, records, batch_size=INVOICE_IMPORT_BATCH_SIZE):
+    """
+    Importe des factures avec leurs lignes.
+    `records` est un itérable de dicts (client_email, invoice_number facultatif,
+    issue_date, due_date, tax_rate, status, notes, items) : il est consommé au fil
+    de l'eau, par lots de `batch_size`.
+    Retourne {'total', 'created', 'errors'} ; chaque erreur donne l'index de la
+    facture dans le fichier.
+    """
+    # Une seule requête pour résoudre tous les clients
+    client_ids = {
+        email.lower(): client_id
+        for email, client_id in Client.objects.filter(user=user).values_list('email', 'id')
+    }
+    
+    total = 0
+    created = []
+    errors = []
+    batch = []
+    
+    for index, record in enumerate(records):
+        total += 1
+        try:
+            fields, items = parse_invoice_record(record, client_ids)
+        except ValueError as e:
+            number = record.get('invoice_number', '') if isinstance(record, dict) else ''
+            errors.append({'index': index, 'invoice_number': number, 'error': str(e)})
+            continue
+        
+        batch.append((index, fields, items))
+        if len(batch) >= batch_size:
+            created += create_invoice_batch(user, batch, errors)
+            batch = []
+    
+    if batch:
+        created += create_invoice_batch(user, batch, errors)
+    
+    # bulk_create n'envoie pas post_save
+    cache.delete('stats', user.id)
+    cache.delete('recent-clients', user.id)
+    
+    errors.sort(key=lambda error: error['index'])
+    return {'total': total, 'created': created, 'errors': errors}
@@ -0,0 +1,28 @@
+"""
+Liens signés vers le PDF d'une facture, envoyés au client à la place de la
+pièce jointe. Le lien expire après INVOICE_LINK_MAX_AGE secondes.
+"""
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+
+SALT = 'core.invoice-link'
+
+
+def make_invoice_token(invoice):
+    return signing.TimestampSigner(salt=SALT).sign(str(invoice.pk))
+
+
+def read_invoice_token(token):
+    """Retourne l'ID de la facture, ou None si le lien est invalide ou expiré"""
+    try:
+        value = signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.INVOICE_LINK_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return int(value)
+
+
+def get_invoice_url(invoice):
+    """URL publique (absolue) du PDF de la facture"""
+    return settings.SITE_URL + reverse('public_invoice_pdf', args=[make_invoice_token(invoice)])
@@ -0,0 +1,27 @@
+"""
+Base des commandes de mesure et de charge (benchmark_*, queue_load_test,
+webhook_stub). Elles créent et suppriment des données, changent des réglages
+du process ou ouvrent des ports : elles ne tournent qu'en DEBUG, sauf avec
+--i-know pour les lancer volontairement ailleurs (jamais en production).
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class BenchmarkCommand(BaseCommand):
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--i-know', action='store_true',
+            help='Lance la commande même si DEBUG est désactivé',
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        if not settings.DEBUG and not options.get('i_know'):
+            raise CommandError(
+                f"{self.__module__.rsplit('.', 1)[-1]} est une commande de mesure : "
+                "elle ne tourne qu'avec DEBUG=True, ou avec --i-know."
+            )
+        return super().execute(*args, **options)
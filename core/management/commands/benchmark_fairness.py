@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from core import cache, outbox
+from core.management.benchmark import BenchmarkCommand
+from core.models import Client, EmailOutbox, Invoice
+from datetime import date
+import statistics
+import threading
+import time
+
+
+class SlowEmailBackend(EmailBackend):
+    """Backend de test : chaque email prend SEND_TIME secondes, comme un vrai envoi"""
+    SEND_TIME = 0.005
+
+    def send_messages(self, messages):
+        time.sleep(self.SEND_TIME * len(messages))
+        return super().send_messages(messages)
+
+
+class Command(BenchmarkCommand):
+    help = ("Mesure la latence de la file d'envoi pour des utilisateurs ordinaires, "
+            "seuls puis à côté d'un utilisateur qui envoie en masse")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--noisy', type=int, default=1000, help='Emails mis en file par l\'utilisateur bruyant')
+        parser.add_argument('--tenants', type=int, default=10, help='Nombre d\'utilisateurs ordinaires')
+        parser.add_argument('--emails', type=int, default=5, help='Emails par utilisateur ordinaire')
+        parser.add_argument('--interval', type=float, default=0.05, help='Écart entre deux emails ordinaires (s)')
+        parser.add_argument('--send-time', type=float, default=0.005, help='Durée d\'un envoi simulé (s)')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith='bench-fairness-').exists():
+            raise CommandError("Des comptes bench-fairness-* existent déjà : supprimez-les avant de relancer la mesure.")
+
+        # Réglages modifiés pour ce process seulement, rétablis à la fin
+        saved_settings = {name: getattr(settings, name) for name in ('EMAIL_BACKEND', 'EMAIL_OUTBOX_WORKERS')}
+        settings.EMAIL_BACKEND = f'{__name__}.SlowEmailBackend'
+        # La commande vide elle-même la file : pas d'envoi déclenché par enqueue()
+        settings.EMAIL_OUTBOX_WORKERS = True
+        SlowEmailBackend.SEND_TIME = options['send_time']
+
+        noisy, quiet = self.create_tenants(options['tenants'])
+        user_ids = [invoice.user_id for invoice in [noisy] + quiet]
+        try:
+            for label, noisy_count in (('Seuls', 0), ('Avec un utilisateur bruyant', options['noisy'])):
+                latencies, noisy_sent = self.run_scenario(noisy, quiet, noisy_count, options)
+                values = sorted(latencies)
+                p95 = values[max(0, int(len(values) * 0.95) - 1)]
+                self.stdout.write(self.style.MIGRATE_HEADING(label))
+                self.stdout.write(f"  utilisateurs ordinaires : médiane {statistics.median(values) * 1000:6.0f} ms   "
+                                  f"p95 {p95 * 1000:6.0f} ms   max {values[-1] * 1000:6.0f} ms   ({len(values)} emails)")
+                if noisy_count:
+                    self.stdout.write(f"  utilisateur bruyant : {noisy_sent}/{noisy_count} email(s) envoyé(s) pendant la mesure")
+        finally:
+            # Seuls les comptes créés par la mesure sont supprimés
+            # (les clients sont protégés tant qu'ils ont des factures)
+            Invoice.objects.filter(user_id__in=user_ids).delete()
+            User.objects.filter(id__in=user_ids).delete()
+            for name, value in saved_settings.items():
+                setattr(settings, name, value)
+
+    def create_tenants(self, count):
+        invoices = []
+        for name in ['noisy'] + [f'quiet-{n}' for n in range(count)]:
+            user = User.objects.create_user(f'bench-fairness-{name}', f'{name}@bench.invalid')
+            client = Client.objects.create(user=user, name=name, email=f'client-{name}@bench.invalid',
+                                           address='1 rue du Test', postal_code='75001', city='Paris')
+            invoices.append(Invoice.objects.create(user=user, client=client, invoice_number=f'BENCH-{name}',
+                                                   due_date=date.today()))
+        return invoices[0], invoices[1:]
+
+    def run_scenario(self, noisy, quiet, noisy_count, options):
+        EmailOutbox.objects.filter(invoice__in=[noisy] + quiet).delete()
+        for invoice in [noisy] + quiet:
+            cache.delete('rate-limit', f'email:{invoice.user_id}')
+
+        if noisy_count:
+            with transaction.atomic():
+                outbox.enqueue('reminder', [noisy] * noisy_count)
+
+        stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                if not outbox.drain():
+                    time.sleep(0.01)
+            connection.close()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+
+        try:
+            # Les utilisateurs ordinaires envoient chacun leur tour, à intervalle régulier
+            for _ in range(options['emails']):
+                for invoice in quiet:
+                    with transaction.atomic():
+                        outbox.enqueue('reminder', [invoice])
+                    time.sleep(options['interval'])
+
+            quiet_rows = EmailOutbox.objects.filter(invoice__in=quiet)
+            deadline = time.time() + 60
+            while quiet_rows.filter(status='pending').exists() and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+
+        latencies = [
+            (sent_at - created_at).total_seconds()
+            for created_at, sent_at in quiet_rows.filter(status='sent').values_list('created_at', 'sent_at')
+        ]
+        noisy_sent = EmailOutbox.objects.filter(invoice=noisy, status='sent').count()
+        return latencies, noisy_sent
@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from core.management.benchmark import BenchmarkCommand
+from core.models import Client, Invoice
+from core.reconciliation import apply_matches, reconcile_statement
+from datetime import date
+from decimal import Decimal
+import csv
+import io
+import random
+import time
+
+
+class Command(BenchmarkCommand):
+    help = ("Mesure le rapprochement d'un relevé bancaire généré contre des factures ouvertes "
+            "(lecture du CSV, index, rapprochement, mise à jour groupée)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=100000, help='Factures ouvertes')
+        parser.add_argument('--lines', type=int, default=50000, help='Crédits du relevé')
+        parser.add_argument('--clients', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        
+        start = time.perf_counter()
+        user, invoices = self.create_invoices(rng, options)
+        self.stdout.write(f"{len(invoices)} factures ouvertes créées en {time.perf_counter() - start:.1f} s")
+        
+        try:
+            statement, expected = self.build_statement(rng, invoices, options['lines'])
+            
+            start = time.perf_counter()
+            matches, unmatched = reconcile_statement(user, statement, 'releve.csv')
+            reconcile_time = time.perf_counter() - start
+            
+            confirmed = [match for match in matches if match['confirmed']]
+            wrong = sum(1 for match in confirmed if expected.get(match['line']['line']) != match['invoice']['id'])
+            
+            start = time.perf_counter()
+            paid = apply_matches(user, [match['invoice']['id'] for match in confirmed])
+            apply_time = time.perf_counter() - start
+            
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Relevé de {options['lines']} crédits, {len(invoices)} factures ouvertes"))
+            self.stdout.write(f"  rapprochement (CSV + index + règles) : {reconcile_time:.2f} s")
+            self.stdout.write(f"  sûrs : {len(confirmed)} (dont {wrong} erronés)   à vérifier : {len(matches) - len(confirmed)}   "
+                              f"sans facture : {len(unmatched)}")
+            self.stdout.write(f"  mise à jour groupée : {paid} facture(s) payée(s) en {apply_time:.2f} s")
+        finally:
+            Invoice.objects.filter(user=user).delete()
+            user.delete()
+
+    def create_invoices(self, rng, options):
+        # Compte dédié, sans URL de webhook : mark_as_paid n'émet aucun événement
+        if User.objects.filter(username='bench-reconcile').exists():
+            raise CommandError("Le compte bench-reconcile existe déjà : supprimez-le avant de relancer la mesure.")
+        user = User.objects.create_user('bench-reconcile', 'bench-reconcile@bench.invalid')
+        
+        words = ['Atelier', 'Studio', 'Conseil', 'Bâtiment', 'Boulangerie', 'Garage', 'Pixel', 'Nova', 'Horizon', 'Durand', 'Martin', 'Lefèvre']
+        clients = Client.objects.bulk_create([
+            Client(user=user, name=f"{rng.choice(words)} {rng.choice(words)} {n} SARL", email=f'client-{n}@bench.invalid',
+                   address='1 rue du Test', postal_code='75001', city='Paris')
+            for n in range(options['clients'])
+        ])
+        
+        # Montants ronds fréquents : beaucoup de factures partagent le même montant
+        amounts = [Decimal(rng.choice([120, 250, 500, 600, 1200, 1500])) for _ in range(options['invoices'] // 2)]
+        amounts += [Decimal(rng.randint(5000, 900000)) / 100 for _ in range(options['invoices'] - len(amounts))]
+        rng.shuffle(amounts)
+        
+        invoices = Invoice.objects.bulk_create([
+            Invoice(user=user, client=rng.choice(clients), invoice_number=f'INV-2026-{user.id}-{n:06d}', status='sent',
+                    due_date=date.today(), subtotal=amount, total=amount)
+            for n, amount in enumerate(amounts, start=1)
+        ], batch_size=2000)
+        
+        client_names = {client.id: client.name for client in clients}
+        return user, [(invoice.id, invoice.invoice_number, invoice.total, client_names[invoice.client_id]) for invoice in invoices]
+
+    def build_statement(self, rng, invoices, count):
+        """CSV du relevé et, pour chaque ligne qui doit être rapprochée, la facture attendue"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(['Date opération', 'Libellé', 'Montant', 'Contrepartie'])
+        expected = {}
+        
+        paid = rng.sample(invoices, min(count, len(invoices)))
+        for n in range(count):
+            invoice_id, number, total, client_name = paid[n % len(paid)]
+            kind = rng.random()
+            amount_text = f'{total:.2f}'.replace('.', ',')
+            if kind < 0.5:
+                # Virement avec le numéro de facture, écrit à la manière de la banque
+                reference = f"VIR SEPA {number.replace('-', ' ') if rng.random() < 0.5 else number} {client_name[:10]}"
+                writer.writerow([date.today().strftime('%d/%m/%Y'), reference, amount_text, client_name.upper()])
+                expected[n + 2] = invoice_id
+            elif kind < 0.8:
+                # Sans référence : seulement le montant et le nom du client
+                writer.writerow([date.today().strftime('%d/%m/%Y'), 'VIREMENT RECU', amount_text, client_name.upper()])
+                expected[n + 2] = invoice_id
+            else:
+                writer.writerow([date.today().strftime('%d/%m/%Y'), 'REMISE CB', f'{rng.randint(1, 99999) / 100:.2f}'.replace('.', ','), ''])
+        
+        return io.BytesIO(buffer.getvalue().encode('utf-8')), expected
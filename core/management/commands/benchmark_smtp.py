@@ -0,0 +1,98 @@
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import CommandError
+from core import email_backend
+from core.management.benchmark import BenchmarkCommand
+import asyncio
+import socket
+import time
+
+
+class CountingHandler:
+    """Serveur SMTP de test : compte les emails, EHLO ralenti comme un TLS + AUTH"""
+
+    def __init__(self, handshake):
+        self.handshake = handshake
+        self.received = 0
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        await asyncio.sleep(self.handshake)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return '250 OK'
+
+
+class Command(BenchmarkCommand):
+    help = ("Débit d'envoi sur un serveur SMTP local (aiosmtpd) : une connexion par email, "
+            "connexions du pool (PooledSMTPBackend), une connexion par lot")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=200)
+        parser.add_argument('--handshake', type=float, default=0.05,
+                            help='Durée simulée de la connexion TLS + AUTH (s)')
+
+    def handle(self, *args, **options):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise CommandError("aiosmtpd n'est pas installé : pip install aiosmtpd")
+
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+
+        handler = CountingHandler(options['handshake'])
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+
+        def connection(backend, **kwargs):
+            return get_connection(backend, host='127.0.0.1', port=port, username='', password='',
+                                  use_tls=False, use_ssl=False, fail_silently=False, **kwargs)
+
+        def message(n, conn):
+            return EmailMessage(f'Facture BENCH-{n}', 'Bonjour,\n\nVotre facture.\n',
+                                'factures@bench.invalid', [f'client-{n}@bench.invalid'], connection=conn)
+
+        def per_email(backend):
+            for n in range(options['emails']):
+                message(n, connection(backend)).send()
+
+        def per_batch():
+            conn = connection('django.core.mail.backends.smtp.EmailBackend')
+            conn.send_messages([message(n, conn) for n in range(options['emails'])])
+
+        scenarios = [
+            ('Une connexion par email', lambda: per_email('django.core.mail.backends.smtp.EmailBackend')),
+            ('Pool de connexions, email par email', lambda: per_email('core.email_backend.PooledSMTPBackend')),
+            ('Une connexion pour le lot', per_batch),
+        ]
+
+        try:
+            for label, run in scenarios:
+                handler.received = handler.sessions = 0
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                self.stdout.write(self.style.MIGRATE_HEADING(label))
+                self.stdout.write(f"  {handler.received} emails en {elapsed:.2f} s   "
+                                  f"{handler.received / elapsed:7.1f} emails/s   {handler.sessions} connexion(s)")
+
+            # Le serveur redémarre : les connexions gardées dans le pool sont mortes
+            controller.stop()
+            controller = Controller(handler, hostname='127.0.0.1', port=port)
+            controller.start()
+            handler.received = handler.sessions = 0
+            per_email('core.email_backend.PooledSMTPBackend')
+            self.stdout.write(self.style.MIGRATE_HEADING('Pool après coupure du serveur'))
+            self.stdout.write(f"  {handler.received}/{options['emails']} emails reçus   {handler.sessions} connexion(s)")
+        finally:
+            with email_backend._smtp_pool_lock:
+                pooled = [conn for idle in email_backend._smtp_pool.values() for conn, _ in idle]
+                email_backend._smtp_pool.clear()
+            for conn in pooled:
+                email_backend._quit_quietly(conn)
+            controller.stop()
@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.loader import get_template
+from core import email_templates
+from core.models import Invoice
+from core.snapshot import take_snapshot
+import time
+
+
+class Command(BaseCommand):
+    help = 'Mesure le temps de rendu des templates d\'envoi (premier rendu et régime établi)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoice-id', type=int, help='Facture utilisée pour le rendu (par défaut la plus récente)')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.select_related('client', 'user')
+        if options['invoice_id']:
+            invoice = invoices.filter(id=options['invoice_id']).first()
+        else:
+            invoice = invoices.order_by('-created_at').first()
+        
+        if invoice is None:
+            raise CommandError('Aucune facture trouvée pour le benchmark.')
+        
+        email_context = {
+            'client_name': invoice.client.name,
+            'invoice_number': invoice.invoice_number,
+            'issue_date': invoice.issue_date.strftime('%d/%m/%Y'),
+            'due_date': invoice.due_date.strftime('%d/%m/%Y'),
+            'subtotal': invoice.subtotal,
+            'tax_rate': invoice.tax_rate,
+            'tax_amount': invoice.tax_amount,
+            'total': invoice.total,
+            'notes': invoice.notes,
+            'days_overdue': 0,
+            'freelance_name': invoice.user.get_full_name() or invoice.user.username,
+            'freelance_email': invoice.user.email,
+        }
+        
+        templates = [
+            ('invoices/invoice_pdf.html', take_snapshot(invoice).template_context()),
+            ('emails/invoice_email.html', email_context),
+            ('emails/reminder_email.html', email_context),
+        ]
+        
+        engine = engines['django'].engine
+        iterations = options['iterations']
+        
+        for template_name, context in templates:
+            # Vide le cache du loader pour mesurer un premier rendu à froid
+            for loader in engine.template_loaders:
+                if hasattr(loader, 'reset'):
+                    loader.reset()
+            
+            start = time.perf_counter()
+            get_template(template_name).render(context)
+            first_ms = (time.perf_counter() - start) * 1000
+            
+            start = time.perf_counter()
+            for _ in range(iterations):
+                get_template(template_name).render(context)
+            steady_ms = (time.perf_counter() - start) * 1000 / iterations
+            
+            self.stdout.write(
+                f'{template_name:30} premier rendu : {first_ms:7.2f} ms | '
+                f'régime établi : {steady_ms:6.3f} ms'
+            )
+        
+        # Emails : CSS mis en ligne à chaque envoi, ou une fois par build_email_templates
+        for name in email_templates.EMAIL_TEMPLATES:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                html, text = email_templates.compile_email_template(name)
+                engines['django'].from_string(html).render(email_context)
+                engines['django'].from_string(text).render(email_context)
+            inline_ms = (time.perf_counter() - start) * 1000 / iterations
+            
+            email_templates.get_compiled(name)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                email_templates.render_email(name, email_context)
+            compiled_ms = (time.perf_counter() - start) * 1000 / iterations
+            
+            self.stdout.write(
+                f'{name:30} CSS en ligne à l\'envoi : {inline_ms:7.2f} ms | '
+                f'précompilé (HTML + texte) : {compiled_ms:6.3f} ms'
+            )
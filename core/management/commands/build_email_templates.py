@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core import email_templates
+
+
+class Command(BaseCommand):
+    help = ("Précompile les templates d'emails : CSS en ligne et version texte, "
+            "écrits dans templates/emails/compiled/ (à relancer après chaque modification)")
+
+    def handle(self, *args, **options):
+        for path in email_templates.build_all():
+            self.stdout.write(f"  {path.relative_to(settings.BASE_DIR)}")
+        self.stdout.write(self.style.SUCCESS("✅ Templates d'emails compilés"))
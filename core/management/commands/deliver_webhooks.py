@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from core.webhooks import deliver_pending
+import time
+
+
+class Command(BaseCommand):
+    help = 'Envoie les webhooks en attente (sans Celery, ou pour mesurer le débit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Continue tant que des événements sont envoyés')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        total = 0
+        
+        while True:
+            delivered = deliver_pending()
+            total += delivered
+            if not options['loop'] or not delivered:
+                break
+        
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"{total} événement(s) envoyé(s) en {elapsed:.2f} s ({rate:.0f}/s)"))
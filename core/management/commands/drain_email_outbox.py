@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from core.outbox import drain
+import time
+
+
+class Command(BaseCommand):
+    help = "Vide la file d'envoi des emails. Lancer plusieurs process en parallèle pour augmenter le débit."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Tourne en continu (worker)')
+        parser.add_argument('--poll', type=float, default=5.0, help='Attente en secondes quand la file est vide')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        total = 0
+        
+        try:
+            while True:
+                sent = drain()
+                total += sent
+                if sent:
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"{total} email(s) envoyé(s) en {elapsed:.1f} s ({total / elapsed:.1f}/s)")
+                elif not options['loop']:
+                    break
+                else:
+                    time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
+        
+        self.stdout.write(self.style.SUCCESS(f"{total} email(s) envoyé(s)"))
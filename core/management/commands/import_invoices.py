@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core.importers import INVOICE_IMPORT_BATCH_SIZE, import_invoices, iter_invoice_records
+import time
+
+
+class Command(BaseCommand):
+    help = 'Importe des factures (avec leurs lignes) depuis un fichier CSV ou JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Utilisateur propriétaire des factures')
+        parser.add_argument('path', help='Fichier .csv (une ligne par ligne de facture), .json ou .jsonl')
+        parser.add_argument('--batch-size', type=int, default=INVOICE_IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Utilisateur introuvable : {options['username']}")
+        
+        start = time.perf_counter()
+        
+        try:
+            with open(options['path'], 'rb') as file:
+                records = iter_invoice_records(file, options['path'])
+                result = import_invoices(user, records, batch_size=options['batch_size'])
+        except OSError as e:
+            raise CommandError(f"Fichier illisible : {e}")
+        except ValueError as e:
+            raise CommandError(f"Import interrompu : {e}")
+        
+        for error in result['errors']:
+            self.stderr.write(f"Facture {error['index'] + 1} {error['invoice_number']} : {error['error']}")
+        
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(result['created'])}/{result['total']} facture(s) importée(s) en {elapsed:.1f} s, "
+            f"{len(result['errors'])} erreur(s)"
+        ))
@@ -0,0 +1,153 @@
+from celery import shared_task
+from config.celery import app
+from core.management.benchmark import BenchmarkCommand
+from pathlib import Path
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Tâches factices, routées dans la file des vraies tâches qu'elles imitent
+RENDER_LIKE = 'core.taskss.prerender_invoice_pdf'
+EMAIL_LIKE = 'core.taskss.drain_email_outbox'
+MAINTENANCE_LIKE = 'core.taskss.check_overdue_invoices'
+
+
+def record_latency(kind, sent_at):
+    line = f'{kind} {time.time() - sent_at:.4f}\n'
+    with open(Path(app.conf.broker_transport_options['data_folder_in']).parent / 'latency.log', 'a') as f:
+        f.write(line)
+
+
+@shared_task(name='loadtest.render', ignore_result=True)
+def fake_render(duration):
+    # Rendu PDF simulé : occupe le CPU
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        pass
+
+
+@shared_task(name='loadtest.email', ignore_result=True)
+def fake_email(sent_at):
+    # Envoi simulé : attente réseau
+    time.sleep(0.01)
+    record_latency('email', sent_at)
+
+
+@shared_task(name='loadtest.maintenance', ignore_result=True)
+def fake_maintenance(sent_at):
+    record_latency('maintenance', sent_at)
+
+
+def use_folder(folder):
+    """Broker "filesystem" : plusieurs process partagent la file sans Redis"""
+    messages = Path(folder) / 'messages'
+    messages.mkdir(parents=True, exist_ok=True)
+    # Les réglages Django (CELERY_BROKER_URL) priment sur app.conf.broker_url
+    app.conf['CELERY_BROKER_URL'] = 'filesystem://'
+    app.conf.broker_transport_options = {
+        'data_folder_in': str(messages),
+        'data_folder_out': str(messages),
+        'control_folder': str(Path(folder) / 'control'),
+        'store_processed': False,
+        'polling_interval': 0.02,
+    }
+
+
+class Command(BenchmarkCommand):
+    help = ("Rafale de rendus PDF puis d'emails : compare la latence des emails et de la maintenance "
+            "avec une seule file et avec les files dédiées de config/celery.py")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=200, help='Taille de la rafale de rendus')
+        parser.add_argument('--emails', type=int, default=20)
+        parser.add_argument('--render-time', type=float, default=0.05, help='Durée CPU d\'un rendu simulé (s)')
+        parser.add_argument('--timeout', type=float, default=120)
+        # Usage interne : process worker lancé par la commande
+        parser.add_argument('--worker', nargs=5, metavar=('FOLDER', 'QUEUES', 'POOL', 'CONCURRENCY', 'PREFETCH'), help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self.run_worker(*options['worker'])
+
+        routes = app.conf.task_routes
+        scenarios = [
+            ('File unique', {kind: 'default' for kind in ('render', 'email', 'maintenance')}, [
+                ('default', 'prefork', 2, 4),
+            ]),
+            ('Files dédiées', {
+                'render': routes[RENDER_LIKE]['queue'],
+                'email': routes[EMAIL_LIKE]['queue'],
+                'maintenance': routes[MAINTENANCE_LIKE]['queue'],
+            }, [
+                (routes[RENDER_LIKE]['queue'], 'prefork', 2, 1),
+                (routes[EMAIL_LIKE]['queue'], 'threads', 4, 4),
+                (f"{routes[MAINTENANCE_LIKE]['queue']},default", 'solo', 1, 1),
+            ]),
+        ]
+
+        with tempfile.TemporaryDirectory() as folder:
+            use_folder(folder)
+            for name, queues, workers in scenarios:
+                latencies = self.run_scenario(folder, queues, workers, options)
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for kind in ('email', 'maintenance'):
+                    values = sorted(latencies.get(kind, []))
+                    if not values:
+                        self.stdout.write(f"  {kind:<12} aucune tâche terminée")
+                        continue
+                    p95 = values[int(len(values) * 0.95) - 1] if len(values) > 1 else values[0]
+                    self.stdout.write(f"  {kind:<12} médiane {statistics.median(values) * 1000:7.0f} ms   "
+                                      f"p95 {p95 * 1000:7.0f} ms   max {values[-1] * 1000:7.0f} ms   ({len(values)})")
+
+    def run_scenario(self, folder, queues, workers, options):
+        log = Path(folder) / 'latency.log'
+        log.unlink(missing_ok=True)
+        for message in (Path(folder) / 'messages').glob('*'):
+            message.unlink()
+
+        processes = [
+            subprocess.Popen(
+                [sys.executable, sys.argv[0], 'queue_load_test', '--i-know', '--worker', folder, worker_queues, pool, str(concurrency), str(prefetch)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            for worker_queues, pool, concurrency, prefetch in workers
+        ]
+        try:
+            # Laisse les workers démarrer avant la rafale
+            time.sleep(3)
+            for _ in range(options['renders']):
+                fake_render.apply_async(args=[options['render_time']], queue=queues['render'], priority=9)
+            fake_maintenance.apply_async(args=[time.time()], queue=queues['maintenance'], priority=0)
+            for _ in range(options['emails']):
+                fake_email.apply_async(args=[time.time()], queue=queues['email'], priority=2)
+
+            expected = options['emails'] + 1
+            deadline = time.time() + options['timeout']
+            while time.time() < deadline:
+                if log.exists() and len(log.read_text().splitlines()) >= expected:
+                    break
+                time.sleep(0.1)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+        latencies = {}
+        if log.exists():
+            for line in log.read_text().splitlines():
+                kind, value = line.split()
+                latencies.setdefault(kind, []).append(float(value))
+        return latencies
+
+    def run_worker(self, folder, queues, pool, concurrency, prefetch):
+        use_folder(folder)
+        app.worker_main([
+            'worker', '-Q', queues, '-P', pool, '-c', concurrency, '--prefetch-multiplier', prefetch,
+            '-O', 'fair', '--without-heartbeat', '--without-gossip', '--without-mingle', '-l', 'WARNING',
+        ])
+
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core.reconciliation import apply_matches, reconcile_statement
+from xml.etree.ElementTree import ParseError
+import time
+
+
+class Command(BaseCommand):
+    help = ("Rapproche un relevé bancaire (CSV, OFX ou CAMT.053) des factures ouvertes ; "
+            "avec --apply, marque payées les factures rapprochées avec certitude")
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Utilisateur propriétaire des factures')
+        parser.add_argument('path', help='Relevé .csv, .ofx ou .xml (CAMT.053)')
+        parser.add_argument('--apply', action='store_true', help='Marque payées les factures rapprochées avec certitude')
+        parser.add_argument('--show', type=int, default=20, help='Nombre de rapprochements affichés par catégorie')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Utilisateur introuvable : {options['username']}")
+        
+        start = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as file:
+                matches, unmatched = reconcile_statement(user, file, options['path'])
+        except OSError as e:
+            raise CommandError(f"Fichier illisible : {e}")
+        except ParseError as e:
+            raise CommandError(f"Relevé XML invalide : {e}")
+        elapsed = time.perf_counter() - start
+        
+        confirmed = [match for match in matches if match['confirmed']]
+        review = [match for match in matches if not match['confirmed']]
+        
+        for label, group in (('Rapprochements sûrs', confirmed), ('À vérifier', review)):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{label} : {len(group)}"))
+            for match in group[:options['show']]:
+                line, invoice = match['line'], match['invoice']
+                self.stdout.write(
+                    f"  ligne {line['line']:>6}  {line['amount']:>10} €  {invoice['number']:<20} "
+                    f"{invoice['client_name'][:25]:<25} {match['rule']}"
+                )
+        self.stdout.write(f"{len(unmatched)} crédit(s) sans facture correspondante ; rapprochement en {elapsed:.2f} s")
+        
+        if options['apply']:
+            count = apply_matches(user, [match['invoice']['id'] for match in confirmed])
+            self.stdout.write(self.style.SUCCESS(f"✅ {count} facture(s) marquée(s) payée(s)"))
+        elif confirmed:
+            self.stdout.write("Relancer avec --apply pour marquer payées les factures rapprochées avec certitude")
@@ -0,0 +1,74 @@
+from django.conf import settings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from core.management.benchmark import BenchmarkCommand
+from core.webhooks import sign
+import hmac
+import json
+import random
+import threading
+import time
+
+
+class Command(BenchmarkCommand):
+    help = 'Serveur HTTP local qui reçoit les webhooks (tests et mesures de débit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--secret', default='', help='Vérifie la signature avec ce secret')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Part des requêtes refusées (500), de 0 à 1')
+        parser.add_argument('--latency', type=float, default=0.0, help='Délai de réponse en secondes')
+
+    def handle(self, *args, **options):
+        stats = {'requests': 0, 'events': 0, 'failed': 0, 'bad_signature': 0}
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, comme la session du worker
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if options['latency']:
+                    time.sleep(options['latency'])
+
+                status = 200
+                if options['secret']:
+                    expected = 'sha256=' + sign(options['secret'], self.headers.get('X-FactureSnap-Timestamp', ''), body)
+                    if not hmac.compare_digest(expected, self.headers.get('X-FactureSnap-Signature', '')):
+                        status = 401
+                if status == 200 and random.random() < options['fail_rate']:
+                    status = 500
+
+                with lock:
+                    stats['requests'] += 1
+                    if status == 200:
+                        stats['events'] += len(json.loads(body).get('events', []))
+                    elif status == 401:
+                        stats['bad_signature'] += 1
+                    else:
+                        stats['failed'] += 1
+
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.stdout.write(f"Webhook stub sur http://127.0.0.1:{options['port']}/ (Ctrl+C pour arrêter)")
+        if not settings.WEBHOOK_ALLOW_PRIVATE_URLS:
+            self.stdout.write(self.style.WARNING("Les webhooks vers 127.0.0.1 sont refusés : lancer le worker avec WEBHOOK_ALLOW_PRIVATE_URLS=True"))
+
+        last_events = 0
+        try:
+            while True:
+                time.sleep(1)
+                with lock:
+                    rate = stats['events'] - last_events
+                    last_events = stats['events']
+                    if rate:
+                        self.stdout.write(f"{stats['requests']} requête(s), {stats['events']} événement(s) (+{rate}/s), "
+                                          f"{stats['failed']} refus, {stats['bad_signature']} signature(s) invalide(s)")
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -1,6 +1,11 @@
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib import messages
+from core import cache
+
+
+# Un essai qui se termine est pris en compte au plus tard après ce délai
+ENTITLEMENT_CACHE_TIMEOUT = 5 * 60
 
 
 class SubscriptionMiddleware:
@@ -30,12 +35,18 @@ class SubscriptionMiddleware:
             if request.user.is_staff or request.user.is_superuser:
                 return self.get_response(request)
             
-            # Vérifie si le profil existe
-            if hasattr(request.user, 'profile'):
-                # Si l'accès n'est pas autorisé ET que ce n'est pas une page autorisée
+            # Droit d'accès gardé en cache : évite de lire le profil à chaque requête
+            can_access = cache.get_or_set(
+                'entitlement', request.user.id,
+                lambda: self.get_entitlement(request.user),
+                timeout=ENTITLEMENT_CACHE_TIMEOUT
+            )
+            
+            # Si l'accès n'est pas autorisé ET que ce n'est pas une page autorisée
+            if not can_access:
                 path_allowed = any(request.path.startswith(path) for path in allowed_paths)
                 
-                if not request.user.profile.can_access_app() and not path_allowed:
+                if not path_allowed:
                     messages.error(
                         request, 
                         '🔒 Votre période d\'essai est terminée. Abonnez-vous pour continuer à utiliser InvoiceSnap.'
@@ -43,4 +54,11 @@ class SubscriptionMiddleware:
                     return redirect('core:upgrade')
         
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+    
+    @staticmethod
+    def get_entitlement(user):
+        """Vérifie l'accès à l'application (sans profil, l'accès n'est pas bloqué)"""
+        if not hasattr(user, 'profile'):
+            return True
+        return user.profile.can_access_app()
\ No newline at end of file
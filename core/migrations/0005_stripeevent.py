@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_userprofile_trial_end_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='ID événement Stripe')),
+                ('event_type', models.CharField(max_length=100, verbose_name="Type d'événement")),
+                ('customer_id', models.CharField(blank=True, db_index=True, max_length=100, verbose_name='ID Client Stripe')),
+                ('payload', models.JSONField(verbose_name="Contenu de l'événement")),
+                ('stripe_created', models.DateTimeField(verbose_name='Date de création chez Stripe')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de réception')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Date de traitement')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Tentatives')),
+                ('last_error', models.TextField(blank=True, verbose_name='Dernière erreur')),
+            ],
+            options={
+                'verbose_name': 'Événement Stripe',
+                'verbose_name_plural': 'Événements Stripe',
+                'ordering': ['stripe_created', 'id'],
+            },
+        ),
+    ]
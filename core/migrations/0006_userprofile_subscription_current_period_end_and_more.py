@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_stripeevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='subscription_current_period_end',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Fin de la période en cours'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='subscription_status',
+            field=models.CharField(blank=True, choices=[('active', 'Actif'), ('trialing', 'Essai Stripe'), ('past_due', 'Paiement en retard'), ('canceled', 'Annulé')], max_length=20, verbose_name="Statut de l'abonnement"),
+        ),
+        migrations.AddConstraint(
+            model_name='userprofile',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_customer_id', ''), _negated=True), fields=('stripe_customer_id',), name='unique_stripe_customer_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='userprofile',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_subscription_id', ''), _negated=True), fields=('stripe_subscription_id',), name='unique_stripe_subscription_id'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_userprofile_subscription_current_period_end_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_archive',
+            field=models.FileField(blank=True, upload_to='invoices/%Y/%m/', verbose_name='PDF archivé'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_archived_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Date d'archivage du PDF"),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_sha256',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Empreinte SHA-256 du PDF'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_invoice_pdf_archive_invoice_pdf_archived_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='invoice_delivery',
+            field=models.CharField(choices=[('attachment', 'PDF en pièce jointe'), ('link', 'Lien de téléchargement sécurisé')], default='attachment', max_length=20, verbose_name='Envoi des factures'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_userprofile_invoice_delivery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['user', 'name'], name='client_user_name_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_client_client_user_name_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/', verbose_name='Fichier importé')),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('done', 'Terminé'), ('failed', 'Échoué')], default='pending', max_length=20, verbose_name='Statut')),
+                ('total_rows', models.PositiveIntegerField(default=0, verbose_name='Lignes lues')),
+                ('imported_count', models.PositiveIntegerField(default=0, verbose_name='Clients importés')),
+                ('error_count', models.PositiveIntegerField(default=0, verbose_name='Lignes en erreur')),
+                ('errors_preview', models.JSONField(blank=True, default=list, verbose_name='Premières erreurs')),
+                ('error_report', models.FileField(blank=True, upload_to='imports/%Y/%m/', verbose_name="Rapport d'erreurs")),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Date de fin')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_imports', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Import de clients',
+                'verbose_name_plural': 'Imports de clients',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
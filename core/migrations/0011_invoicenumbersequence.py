@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_clientimport'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(verbose_name='Année')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Dernier numéro attribué')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_number_sequences', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Séquence de numéros de facture',
+                'verbose_name_plural': 'Séquences de numéros de facture',
+                'unique_together': {('user', 'year')},
+            },
+        ),
+    ]
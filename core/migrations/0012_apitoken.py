@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_invoicenumbersequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Nom')),
+                ('key_prefix', models.CharField(max_length=12, verbose_name='Début du jeton')),
+                ('key_hash', models.CharField(max_length=64, unique=True, verbose_name='Empreinte du jeton')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('last_used_at', models.DateTimeField(blank=True, null=True, verbose_name='Dernière utilisation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Jeton API',
+                'verbose_name_plural': 'Jetons API',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:11
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_apitoken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEndpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, verbose_name='URL')),
+                ('events', models.JSONField(default=list, verbose_name='Événements')),
+                ('secret', models.CharField(max_length=100, verbose_name='Secret de signature')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Actif')),
+                ('consecutive_failures', models.PositiveIntegerField(default=0, verbose_name='Échecs consécutifs')),
+                ('circuit_open_until', models.DateTimeField(blank=True, null=True, verbose_name="Suspendu jusqu'à")),
+                ('last_success_at', models.DateTimeField(blank=True, null=True, verbose_name='Dernier envoi réussi')),
+                ('last_error', models.TextField(blank=True, verbose_name='Dernière erreur')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='webhook_endpoints', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Webhook',
+                'verbose_name_plural': 'Webhooks',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=50, verbose_name="Type d'événement")),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Contenu')),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('delivered', 'Envoyé'), ('failed', 'Abandonné')], default='pending', max_length=20, verbose_name='Statut')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Tentatives')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Prochaine tentative')),
+                ('last_error', models.TextField(blank=True, verbose_name='Dernière erreur')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name="Date d'envoi")),
+                ('endpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='core.webhookendpoint', verbose_name='Webhook')),
+            ],
+            options={
+                'verbose_name': 'Événement webhook',
+                'verbose_name_plural': 'Événements webhook',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['endpoint', 'status', 'next_attempt_at'], name='webhook_event_due_idx')],
+            },
+        ),
+    ]
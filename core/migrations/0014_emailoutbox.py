@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_webhooks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('invoice', 'Facture'), ('reminder', 'Relance')], default='invoice', max_length=20, verbose_name='Type')),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('sent', 'Envoyé'), ('failed', 'Abandonné')], default='pending', max_length=20, verbose_name='Statut')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Tentatives')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Prochaine tentative')),
+                ('last_error', models.TextField(blank=True, verbose_name='Dernière erreur')),
+                ('job_id', models.CharField(blank=True, max_length=32, verbose_name='Envoi groupé')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name="Date d'envoi")),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_emails', to='core.invoice', verbose_name='Facture')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_emails', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Email en file',
+                'verbose_name_plural': 'File des emails',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at', 'user'], name='outbox_due_idx'), models.Index(fields=['user', 'status', 'next_attempt_at'], name='outbox_user_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 12:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_emailoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('opens', models.PositiveIntegerField(default=0, verbose_name='Ouvertures')),
+                ('clicks', models.PositiveIntegerField(default=0, verbose_name='Clics')),
+                ('first_opened_at', models.DateTimeField(blank=True, null=True, verbose_name='Première ouverture')),
+                ('last_opened_at', models.DateTimeField(blank=True, null=True, verbose_name='Dernière ouverture')),
+                ('last_clicked_at', models.DateTimeField(blank=True, null=True, verbose_name='Dernier clic')),
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_stats', to='core.invoice', verbose_name='Facture')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_stats', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': "Suivi d'email",
+                'verbose_name_plural': 'Suivi des emails',
+                'ordering': ['-last_opened_at'],
+            },
+        ),
+    ]
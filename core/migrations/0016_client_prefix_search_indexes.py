@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:00
+
+import core.models
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_deliverystats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='client',
+            name='client_user_name_idx',
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=core.models.PrefixSearchIndex('user', 'name', name='client_user_name_prefix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=core.models.PrefixSearchIndex('user', 'email', name='client_user_email_prefix_idx'),
+        ),
+    ]
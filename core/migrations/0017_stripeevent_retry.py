@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_client_prefix_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Abandonné le'),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Prochain essai'),
+        ),
+    ]
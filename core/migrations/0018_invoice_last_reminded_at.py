@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_stripeevent_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='last_reminded_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Dernière relance'),
+        ),
+    ]
@@ -1,11 +1,46 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator,MinValueValidator
+from django.contrib.postgres.indexes import OpClass
+from django.db.models import F, Q
+from django.db.models.functions import Upper
 from django.utils import timezone
 from decimal import Decimal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.core.serializers.json import DjangoJSONEncoder
 from datetime import timedelta
+import hashlib
+import secrets
+
+
+class PrefixSearchIndex(models.Index):
+    """
+    Index d'une recherche « commence par » sans casse chez un utilisateur :
+    (user, UPPER(champ)). Sous PostgreSQL, istartswith s'écrit
+    UPPER(champ::text) LIKE UPPER('q%') : seul un index sur cette expression,
+    avec la classe d'opérateurs text_pattern_ops, sert un LIKE 'q%'.
+    SQLite (en local) n'a pas de classe d'opérateurs.
+    """
+    
+    def __init__(self, user_field, search_field, *, name):
+        self.user_field = user_field
+        self.search_field = search_field
+        super().__init__(F(user_field), Upper(search_field), name=name)
+    
+    def deconstruct(self):
+        path, _, _ = super().deconstruct()
+        return path, (self.user_field, self.search_field), {'name': self.name}
+    
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            index = models.Index(
+                F(self.user_field), OpClass(Upper(self.search_field), name='text_pattern_ops'), name=self.name,
+            )
+            return index.create_sql(model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
 class Client(models.Model):
     """
     Modèle représentant un client du freelance.
@@ -88,7 +123,13 @@ class Client(models.Model):
         verbose_name_plural = "Clients"
         ordering = ['-created_at']
         # Un user ne peut pas avoir 2 clients avec le même email
+        # (l'index unique sert aussi la recherche par email)
         unique_together = ['user', 'email']
+        indexes = [
+            # Autocomplétion : recherche par début de nom ou d'email (istartswith)
+            PrefixSearchIndex('user', 'name', name='client_user_name_prefix_idx'),
+            PrefixSearchIndex('user', 'email', name='client_user_email_prefix_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.email})"
@@ -99,11 +140,62 @@ class Client(models.Model):
     
 
 
+class InvoiceQuerySet(models.QuerySet):
+    """
+    Actions groupées sur les factures : un seul UPDATE pour toute la sélection
+    au lieu d'un save() par facture.
+    """
+    
+    def mark_as_sent(self):
+        """Marque les factures comme envoyées (hors payées et annulées)"""
+        now = timezone.now()
+        return self.exclude(status__in=['paid', 'cancelled'])._update_status('invoice.sent', status='sent', sent_at=now, updated_at=now)
+    
+    def mark_as_paid(self):
+        """Marque les factures comme payées (hors déjà payées et annulées)"""
+        now = timezone.now()
+        return self.exclude(status__in=['paid', 'cancelled'])._update_status('invoice.paid', status='paid', paid_at=now, updated_at=now)
+    
+    def mark_as_overdue(self):
+        """Passe en retard les factures envoyées dont l'échéance est dépassée"""
+        return self.filter(status='sent', due_date__lt=timezone.now().date())._update_status('invoice.overdue', status='overdue', updated_at=timezone.now())
+    
+    def cancel(self):
+        """Annule les factures (une facture payée n'est pas annulable)"""
+        return self.exclude(status__in=['paid', 'cancelled'])._update_status(None, status='cancelled', updated_at=timezone.now())
+    
+    def unopened(self):
+        """Factures dont aucun email n'a été ouvert ni cliqué (voir core.tracking)"""
+        return self.exclude(delivery_stats__opens__gt=0).exclude(delivery_stats__clicks__gt=0)
+    
+    def _update_status(self, event_type, **fields):
+        from core import cache, webhooks
+        
+        rows = list(self.order_by().values_list('id', 'user_id'))
+        if not rows:
+            return 0
+        invoice_ids = [invoice_id for invoice_id, _ in rows]
+        user_ids = {user_id for _, user_id in rows}
+        
+        # Le webhook est mis en file dans la même transaction que le changement
+        with transaction.atomic():
+            count = self.model.objects.filter(id__in=invoice_ids).update(**fields)
+            if event_type:
+                webhooks.emit(event_type, invoice_ids, user_ids)
+        
+        # update() n'envoie pas post_save : on vide nous-mêmes le cache des stats
+        for user_id in user_ids:
+            cache.delete('stats', user_id)
+        return count
+
+
 class Invoice(models.Model):
     """
     Modèle représentant une facture.
     """
     
+    objects = InvoiceQuerySet.as_manager()
+    
     STATUS_CHOICES = [
         ('draft', 'Brouillon'),
         ('sent', 'Envoyée'),
@@ -217,6 +309,31 @@ class Invoice(models.Model):
         verbose_name="Date de paiement"
     )
     
+    last_reminded_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Dernière relance"
+    )
+    
+    # PDF conservé tel qu'envoyé au client (obligation légale de conservation)
+    pdf_archive = models.FileField(
+        upload_to='invoices/%Y/%m/',
+        blank=True,
+        verbose_name="PDF archivé"
+    )
+    
+    pdf_sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name="Empreinte SHA-256 du PDF"
+    )
+    
+    pdf_archived_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Date d'archivage du PDF"
+    )
+    
     class Meta:
         verbose_name = "Facture"
         verbose_name_plural = "Factures"
@@ -240,15 +357,21 @@ class Invoice(models.Model):
     
     def mark_as_sent(self):
         """Marque la facture comme envoyée"""
+        from core import webhooks
         self.status = 'sent'
         self.sent_at = timezone.now()
-        self.save()
+        with transaction.atomic():
+            self.save()
+            webhooks.emit('invoice.sent', [self.id], [self.user_id])
     
     def mark_as_paid(self):
         """Marque la facture comme payée"""
+        from core import webhooks
         self.status = 'paid'
         self.paid_at = timezone.now()
-        self.save()
+        with transaction.atomic():
+            self.save()
+            webhooks.emit('invoice.paid', [self.id], [self.user_id])
 
 
 class InvoiceItem(models.Model):
@@ -366,6 +489,19 @@ class UserProfile(models.Model):
         verbose_name="Logo"
     )
     
+    # Envoi des factures : PDF joint à l'email, ou lien de téléchargement signé
+    INVOICE_DELIVERY_CHOICES = [
+        ('attachment', 'PDF en pièce jointe'),
+        ('link', 'Lien de téléchargement sécurisé'),
+    ]
+    
+    invoice_delivery = models.CharField(
+        max_length=20,
+        choices=INVOICE_DELIVERY_CHOICES,
+        default='attachment',
+        verbose_name="Envoi des factures"
+    )
+    
     # Informations d'abonnement
     is_premium = models.BooleanField(
         default=False,
@@ -390,6 +526,28 @@ class UserProfile(models.Model):
         verbose_name="ID Abonnement Stripe"
     )
     
+    # Copie locale de l'état de l'abonnement, mise à jour par les webhooks Stripe
+    SUBSCRIPTION_STATUS_CHOICES = [
+        ('active', 'Actif'),
+        ('trialing', 'Essai Stripe'),
+        ('past_due', 'Paiement en retard'),
+        ('canceled', 'Annulé'),
+    ]
+    ACTIVE_SUBSCRIPTION_STATUSES = ('active', 'trialing', 'past_due')
+    
+    subscription_status = models.CharField(
+        max_length=20,
+        choices=SUBSCRIPTION_STATUS_CHOICES,
+        blank=True,
+        verbose_name="Statut de l'abonnement"
+    )
+    
+    subscription_current_period_end = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Fin de la période en cours"
+    )
+    
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Date de création"
@@ -403,6 +561,19 @@ class UserProfile(models.Model):
     class Meta:
         verbose_name = "Profil utilisateur"
         verbose_name_plural = "Profils utilisateurs"
+        # Index uniques partiels : les webhooks retrouvent le profil sans parcourir la table
+        constraints = [
+            models.UniqueConstraint(
+                fields=['stripe_customer_id'],
+                condition=~Q(stripe_customer_id=''),
+                name='unique_stripe_customer_id',
+            ),
+            models.UniqueConstraint(
+                fields=['stripe_subscription_id'],
+                condition=~Q(stripe_subscription_id=''),
+                name='unique_stripe_subscription_id',
+            ),
+        ]
     
     def __str__(self):
         return f"Profil de {self.user.username}"
@@ -445,6 +616,28 @@ class UserProfile(models.Model):
 
 
 
+@receiver([post_save, post_delete], sender='core.Invoice')
+def clear_invoice_stats_cache(sender, instance, **kwargs):
+    """Les stats du dashboard sont recalculées après chaque modification"""
+    from core import cache
+    cache.delete('stats', instance.user_id)
+
+
+@receiver([post_save, post_delete], sender='core.Client')
+@receiver(post_save, sender='core.Invoice')
+def clear_recent_clients_cache(sender, instance, **kwargs):
+    """La liste des clients récents (autocomplétion) suit les clients et les factures"""
+    from core import cache
+    cache.delete('recent-clients', instance.user_id)
+
+
+@receiver(post_save, sender='core.UserProfile')
+def clear_entitlement_cache(sender, instance, **kwargs):
+    """Le droit d'accès est relu après chaque modification du profil"""
+    from core import cache
+    cache.delete('entitlement', instance.user_id)
+
+
 # Trouve cette fonction et modifie-la
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -459,4 +652,606 @@ def create_user_profile(sender, instance, created, **kwargs):
             defaults={
                 'trial_end_date': trial_end
             }
-        )
\ No newline at end of file
+        )
+
+class StripeEvent(models.Model):
+    """
+    Événement Stripe reçu par le webhook, stocké avant traitement.
+    L'ID Stripe est unique : les renvois de Stripe sont ignorés.
+    """
+    
+    event_id = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name="ID événement Stripe"
+    )
+    
+    event_type = models.CharField(
+        max_length=100,
+        verbose_name="Type d'événement"
+    )
+    
+    # Sert à traiter les événements dans l'ordre pour un même client
+    customer_id = models.CharField(
+        max_length=100,
+        blank=True,
+        db_index=True,
+        verbose_name="ID Client Stripe"
+    )
+    
+    payload = models.JSONField(
+        verbose_name="Contenu de l'événement"
+    )
+    
+    stripe_created = models.DateTimeField(
+        verbose_name="Date de création chez Stripe"
+    )
+    
+    received_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de réception"
+    )
+    
+    processed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Date de traitement"
+    )
+    
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Tentatives"
+    )
+    
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Dernière erreur"
+    )
+    
+    # Après un échec : pas de nouvel essai avant cette date
+    next_attempt_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Prochain essai"
+    )
+    
+    # Abandonné après trop d'échecs : les événements suivants du client sont traités
+    failed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Abandonné le"
+    )
+    
+    class Meta:
+        verbose_name = "Événement Stripe"
+        verbose_name_plural = "Événements Stripe"
+        ordering = ['stripe_created', 'id']
+    
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+
+class ClientImport(models.Model):
+    """
+    Import groupé de clients depuis un fichier CSV ou JSON,
+    traité en arrière-plan (voir core.importers).
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échoué'),
+    ]
+    
+    # Nombre d'erreurs gardées pour l'affichage (le rapport complet est un fichier)
+    ERRORS_PREVIEW_SIZE = 50
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='client_imports',
+        verbose_name="Utilisateur"
+    )
+    
+    file = models.FileField(
+        upload_to='imports/%Y/%m/',
+        verbose_name="Fichier importé"
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="Statut"
+    )
+    
+    total_rows = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Lignes lues"
+    )
+    
+    imported_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Clients importés"
+    )
+    
+    error_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Lignes en erreur"
+    )
+    
+    errors_preview = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name="Premières erreurs"
+    )
+    
+    error_report = models.FileField(
+        upload_to='imports/%Y/%m/',
+        blank=True,
+        verbose_name="Rapport d'erreurs"
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de création"
+    )
+    
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Date de fin"
+    )
+    
+    class Meta:
+        verbose_name = "Import de clients"
+        verbose_name_plural = "Imports de clients"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Import {self.id} - {self.user.username} ({self.get_status_display()})"
+    
+    def is_finished(self):
+        return self.status in ['done', 'failed']
+
+
+class InvoiceNumberSequence(models.Model):
+    """
+    Compteur de numéros de facture par utilisateur et par année.
+    Les numéros sont réservés par blocs (une seule écriture pour tout un lot
+    de factures importées).
+    """
+    
+    # L'id utilisateur garde les numéros uniques entre comptes
+    NUMBER_FORMAT = 'INV-{year}-{user_id}-{number:04d}'
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='invoice_number_sequences',
+        verbose_name="Utilisateur"
+    )
+    
+    year = models.PositiveIntegerField(
+        verbose_name="Année"
+    )
+    
+    last_number = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Dernier numéro attribué"
+    )
+    
+    class Meta:
+        verbose_name = "Séquence de numéros de facture"
+        verbose_name_plural = "Séquences de numéros de facture"
+        unique_together = ['user', 'year']
+    
+    def __str__(self):
+        return f"{self.user.username} {self.year} ({self.last_number})"
+    
+    @classmethod
+    def allocate(cls, user, year, count):
+        """Réserve `count` numéros consécutifs et les retourne formatés"""
+        with transaction.atomic():
+            sequence, _ = cls.objects.select_for_update().get_or_create(user=user, year=year)
+            first = sequence.last_number + 1
+            sequence.last_number += count
+            sequence.save(update_fields=['last_number'])
+        
+        return [
+            cls.NUMBER_FORMAT.format(year=year, user_id=user.id, number=number)
+            for number in range(first, first + count)
+        ]
+
+
+class ApiToken(models.Model):
+    """
+    Jeton d'accès à l'API JSON (/api/v1/).
+    Seule l'empreinte SHA-256 du jeton est stockée : le jeton en clair
+    n'est montré qu'une fois, à sa création.
+    """
+    
+    KEY_PREFIX = 'fs_'
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='api_tokens',
+        verbose_name="Utilisateur"
+    )
+    
+    name = models.CharField(
+        max_length=100,
+        verbose_name="Nom"
+    )
+    
+    # Début du jeton, pour le reconnaître dans la liste
+    key_prefix = models.CharField(
+        max_length=12,
+        verbose_name="Début du jeton"
+    )
+    
+    key_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name="Empreinte du jeton"
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de création"
+    )
+    
+    last_used_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Dernière utilisation"
+    )
+    
+    class Meta:
+        verbose_name = "Jeton API"
+        verbose_name_plural = "Jetons API"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.name} ({self.key_prefix}…)"
+    
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+    
+    @classmethod
+    def create_token(cls, user, name):
+        """Crée un jeton ; retourne (jeton, clé en clair)"""
+        key = cls.KEY_PREFIX + secrets.token_urlsafe(32)
+        token = cls.objects.create(user=user, name=name, key_prefix=key[:10], key_hash=cls.hash_key(key))
+        return token, key
+
+
+@receiver(post_delete, sender='core.ApiToken')
+def clear_api_token_cache(sender, instance, **kwargs):
+    """Un jeton révoqué est refusé immédiatement"""
+    from core import cache
+    cache.delete('api-token', instance.key_hash)
+
+
+class WebhookEndpoint(models.Model):
+    """
+    URL appelée par FactureSnap à chaque événement de facture choisi.
+    Les événements passent par la file WebhookEvent (voir core.webhooks).
+    """
+    
+    EVENT_CHOICES = [
+        ('invoice.created', 'Facture créée'),
+        ('invoice.sent', 'Facture envoyée'),
+        ('invoice.paid', 'Facture payée'),
+        ('invoice.overdue', 'Facture en retard'),
+    ]
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='webhook_endpoints',
+        verbose_name="Utilisateur"
+    )
+    
+    url = models.URLField(
+        max_length=500,
+        verbose_name="URL"
+    )
+    
+    events = models.JSONField(
+        default=list,
+        verbose_name="Événements"
+    )
+    
+    # Sert à signer les envois (en-tête X-FactureSnap-Signature)
+    secret = models.CharField(
+        max_length=100,
+        verbose_name="Secret de signature"
+    )
+    
+    is_active = models.BooleanField(
+        default=True,
+        verbose_name="Actif"
+    )
+    
+    # Disjoncteur : après plusieurs échecs de suite, l'URL n'est plus appelée
+    # jusqu'à circuit_open_until
+    consecutive_failures = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Échecs consécutifs"
+    )
+    
+    circuit_open_until = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Suspendu jusqu'à"
+    )
+    
+    last_success_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Dernier envoi réussi"
+    )
+    
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Dernière erreur"
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de création"
+    )
+    
+    class Meta:
+        verbose_name = "Webhook"
+        verbose_name_plural = "Webhooks"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.url} ({self.user.username})"
+    
+    def save(self, *args, **kwargs):
+        if not self.secret:
+            self.secret = 'whsec_' + secrets.token_hex(24)
+        super().save(*args, **kwargs)
+
+
+class WebhookEvent(models.Model):
+    """
+    File d'envoi des webhooks : une ligne par événement et par URL, écrite
+    dans la même transaction que la modification de la facture.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('delivered', 'Envoyé'),
+        ('failed', 'Abandonné'),
+    ]
+    
+    endpoint = models.ForeignKey(
+        WebhookEndpoint,
+        on_delete=models.CASCADE,
+        related_name='deliveries',
+        verbose_name="Webhook"
+    )
+    
+    event_type = models.CharField(
+        max_length=50,
+        verbose_name="Type d'événement"
+    )
+    
+    payload = models.JSONField(
+        encoder=DjangoJSONEncoder,
+        verbose_name="Contenu"
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="Statut"
+    )
+    
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Tentatives"
+    )
+    
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Prochaine tentative"
+    )
+    
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Dernière erreur"
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de création"
+    )
+    
+    delivered_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Date d'envoi"
+    )
+    
+    class Meta:
+        verbose_name = "Événement webhook"
+        verbose_name_plural = "Événements webhook"
+        ordering = ['id']
+        indexes = [
+            # Le worker cherche les événements à envoyer d'une URL
+            models.Index(fields=['endpoint', 'status', 'next_attempt_at'], name='webhook_event_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} → {self.endpoint.url} ({self.get_status_display()})"
+
+
+@receiver([post_save, post_delete], sender='core.WebhookEndpoint')
+def clear_webhook_endpoints_cache(sender, instance, **kwargs):
+    """Les URLs abonnées d'un utilisateur sont relues après chaque modification"""
+    from core import cache
+    cache.delete('webhook-endpoints', instance.user_id)
+
+
+class EmailOutbox(models.Model):
+    """
+    File d'envoi des emails (factures et relances) : une ligne par email,
+    écrite dans la même transaction que le changement de statut de la facture.
+    Vidée par les workers (commande drain_email_outbox ou tâche Celery).
+    """
+    
+    KIND_CHOICES = [
+        ('invoice', 'Facture'),
+        ('reminder', 'Relance'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('sent', 'Envoyé'),
+        ('failed', 'Abandonné'),
+    ]
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='outbox_emails',
+        verbose_name="Utilisateur"
+    )
+    
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='outbox_emails',
+        verbose_name="Facture"
+    )
+    
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        default='invoice',
+        verbose_name="Type"
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="Statut"
+    )
+    
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Tentatives"
+    )
+    
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Prochaine tentative"
+    )
+    
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Dernière erreur"
+    )
+    
+    job_id = models.CharField(
+        max_length=32,
+        blank=True,
+        verbose_name="Envoi groupé"
+    )
+    
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de création"
+    )
+    
+    sent_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Date d'envoi"
+    )
+    
+    class Meta:
+        verbose_name = "Email en file"
+        verbose_name_plural = "File des emails"
+        ordering = ['id']
+        indexes = [
+            # Les workers cherchent les emails à envoyer, tenant par tenant
+            models.Index(fields=['status', 'next_attempt_at', 'user'], name='outbox_due_idx'),
+            models.Index(fields=['user', 'status', 'next_attempt_at'], name='outbox_user_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.invoice_id} ({self.get_status_display()})"
+
+
+class DeliveryStats(models.Model):
+    """
+    Ouvertures et clics des emails d'une facture (pixel et lien de suivi).
+    Les compteurs sont accumulés en mémoire par core.tracking et écrits par
+    lots : les dates sont précises à l'intervalle d'écriture près.
+    """
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='delivery_stats',
+        verbose_name="Utilisateur"
+    )
+    
+    invoice = models.OneToOneField(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='delivery_stats',
+        verbose_name="Facture"
+    )
+    
+    opens = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Ouvertures"
+    )
+    
+    clicks = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Clics"
+    )
+    
+    first_opened_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Première ouverture"
+    )
+    
+    last_opened_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Dernière ouverture"
+    )
+    
+    last_clicked_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Dernier clic"
+    )
+    
+    class Meta:
+        verbose_name = "Suivi d'email"
+        verbose_name_plural = "Suivi des emails"
+        ordering = ['-last_opened_at']
+    
+    def __str__(self):
+        return f"{self.invoice_id} : {self.opens} ouverture(s), {self.clicks} clic(s)"
+    
+    @property
+    def was_opened(self):
+        """Un clic compte comme ouverture (images bloquées par le client mail)"""
+        return self.opens > 0 or self.clicks > 0
@@ -0,0 +1,219 @@
+"""
+File d'envoi des emails (EmailOutbox) : enqueue() écrit une ligne par email
+dans la transaction du changement de statut ; si elle est annulée, l'email
+ne part pas, et s'il est validé, il partira même si un process s'arrête.
+Plusieurs workers peuvent vider la file en parallèle : chacun réserve ses
+lignes avec SELECT ... FOR UPDATE SKIP LOCKED, sans broker. Chaque lot est
+réparti équitablement entre les utilisateurs qui attendent, pour qu'un gros
+envoi groupé ne retarde pas l'email d'un autre utilisateur.
+"""
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from collections import Counter
+from itertools import zip_longest
+from datetime import timedelta
+from .models import EmailOutbox
+from .snapshot import invoice_queryset
+from . import ratelimit
+import random
+import traceback
+
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_TENANT_SHARE = 5
+OUTBOX_MAX_BATCHES_PER_RUN = 20
+OUTBOX_LEASE = 5 * 60
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_BASE = 60
+OUTBOX_BACKOFF_MAX = 60 * 60
+OUTBOX_SMTP_TIMEOUT = 30
+
+
+def enqueue(kind, invoices, job_id=''):
+    """
+    Met en file un email (kind : 'invoice' ou 'reminder') par facture.
+    À appeler dans la transaction du changement de statut.
+    """
+    rows = EmailOutbox.objects.bulk_create(
+        [EmailOutbox(user_id=invoice.user_id, invoice_id=invoice.id, kind=kind, job_id=job_id) for invoice in invoices],
+        batch_size=500,
+    )
+    if rows:
+        from .taskss import schedule_email_outbox
+        ids = [row.id for row in rows]
+        transaction.on_commit(lambda: schedule_email_outbox(ids))
+    return len(rows)
+
+
+def backoff_delay(attempts):
+    """Délai avant la tentative suivante : exponentiel, plafonné, avec une part d'aléa"""
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 10)
+
+
+def claim_batch(limit=OUTBOX_BATCH_SIZE, ids=None):
+    """
+    Réserve un lot d'emails à envoyer. Les utilisateurs qui attendent depuis
+    le plus longtemps passent en premier, chacun a au plus sa part du lot
+    et ne dépasse pas son quota d'envoi (limite 'email' de core.ratelimit).
+    Les emails d'un utilisateur au quota épuisé sont repoussés jusqu'au
+    retour d'un jeton : ils ne prennent plus la place des autres.
+    Les lignes verrouillées par un autre worker sont sautées ; les lignes
+    réservées sont repoussées de OUTBOX_LEASE secondes le temps de l'envoi
+    (un worker arrêté en cours de route ne bloque rien).
+    """
+    while True:
+        now = timezone.now()
+        due = EmailOutbox.objects.filter(status='pending', next_attempt_at__lte=now)
+        if ids is not None:
+            due = due.filter(id__in=ids)
+
+        user_ids = list(
+            due.order_by().values('user_id')
+            .annotate(oldest=Min('next_attempt_at')).order_by('oldest')
+            .values_list('user_id', flat=True)[:limit]
+        )
+        if not user_ids:
+            return []
+        # Un gros envoi n'occupe jamais un lot entier : les autres passent au lot suivant
+        share = max(1, min(limit // len(user_ids), OUTBOX_TENANT_SHARE))
+
+        with transaction.atomic():
+            per_user = []
+            throttled = False
+            for user_id in user_ids:
+                taken = []
+                candidates = (
+                    due.filter(user_id=user_id).select_for_update(skip_locked=True)
+                    .order_by('next_attempt_at', 'id')[:share]
+                )
+                for row in candidates:
+                    wait = ratelimit.retry_after(user_id, 'email')
+                    if wait:
+                        # Quota d'envoi épuisé : le reste attend le retour d'un jeton
+                        due.filter(user_id=user_id).exclude(id__in=[row.id for row in taken]).update(
+                            next_attempt_at=now + timedelta(seconds=wait)
+                        )
+                        throttled = True
+                        break
+                    taken.append(row)
+                per_user.append(taken)
+            
+            # Tour de rôle dans le lot : le premier email de chacun part en premier
+            rows = [row for turn in zip_longest(*per_user) for row in turn if row is not None]
+            if rows:
+                EmailOutbox.objects.filter(id__in=[row.id for row in rows]).update(
+                    next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE)
+                )
+        
+        # Lot vide à cause des quotas : d'autres utilisateurs attendent peut-être
+        if rows or not throttled:
+            return rows
+
+
+def send_batch(rows):
+    """
+    Envoie un lot sur une seule connexion SMTP/API. Retourne (envoyés, en échec)
+    avec, pour chaque échec, le message d'erreur.
+    """
+    from .utils import archive_sent_pdf, build_invoice_email, build_reminder_email
+
+    # Factures, clients, émetteurs et lignes du lot en deux requêtes
+    invoices = invoice_queryset().in_bulk([row.invoice_id for row in rows])
+    sent, failed = [], []
+
+    connection = get_connection(timeout=OUTBOX_SMTP_TIMEOUT)
+    try:
+        connection.open()
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'[:1000]
+        return [], [(row, error) for row in rows]
+
+    try:
+        for row in rows:
+            invoice = invoices.get(row.invoice_id)
+            if invoice is None:
+                failed.append((row, 'Facture introuvable'))
+                continue
+
+            try:
+                if row.kind == 'reminder':
+                    email, pdf_file = build_reminder_email(invoice, connection), None
+                else:
+                    email, pdf_file = build_invoice_email(invoice, connection)
+                if not email.send(fail_silently=False):
+                    raise RuntimeError("Email refusé par le backend")
+            except Exception as e:
+                failed.append((row, f'{type(e).__name__}: {e}'[:1000]))
+                continue
+
+            row.sent_at = timezone.now()
+            sent.append(row)
+
+            if row.kind == 'invoice':
+                try:
+                    archive_sent_pdf(invoice, pdf_file)
+                except Exception:
+                    # L'email est parti : l'archive sera refaite au prochain renvoi
+                    traceback.print_exc()
+    finally:
+        connection.close()
+
+    return sent, failed
+
+
+def record_sent(rows):
+    for row in rows:
+        row.status = 'sent'
+        row.attempts += 1
+        row.last_error = ''
+    EmailOutbox.objects.bulk_update(rows, ['status', 'sent_at', 'attempts', 'last_error'])
+    count_bulk_send(rows, 'sent')
+
+
+def record_failed(failures):
+    now = timezone.now()
+    rows, dead = [], []
+    for row, error in failures:
+        row.attempts += 1
+        row.last_error = error
+        if row.attempts >= OUTBOX_MAX_ATTEMPTS or error == 'Facture introuvable':
+            row.status = 'failed'
+            dead.append(row)
+        else:
+            row.next_attempt_at = now + timedelta(seconds=backoff_delay(row.attempts))
+        rows.append(row)
+    EmailOutbox.objects.bulk_update(rows, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    # Un email abandonné compte comme échec dans le suivi de l'envoi groupé
+    count_bulk_send(dead, 'failed')
+
+
+def count_bulk_send(rows, outcome):
+    """Met à jour l'avancement des envois groupés (voir get_bulk_send_progress)"""
+    from . import cache
+    from .taskss import BULK_SEND_TIMEOUT
+
+    for job_id, count in Counter(row.job_id for row in rows if row.job_id).items():
+        cache.incr('bulk-send', f'{job_id}:{outcome}', count, timeout=BULK_SEND_TIMEOUT)
+
+
+def drain(ids=None, max_batches=OUTBOX_MAX_BATCHES_PER_RUN):
+    """Vide la file (ou seulement les lignes ids) par lots ; retourne le nombre d'emails envoyés"""
+    total = 0
+    for _ in range(max_batches):
+        rows = claim_batch(ids=ids)
+        if not rows:
+            break
+
+        sent, failed = send_batch(rows)
+        if sent:
+            record_sent(sent)
+        if failed:
+            for row, error in failed:
+                print(f"❌ [OUTBOX] Email {row.id} (facture {row.invoice_id}) : {error}")
+            record_failed(failed)
+        total += len(sent)
+    return total
@@ -0,0 +1,172 @@
+"""
+Génération des PDF de factures.
+WeasyPrint est importé au premier rendu seulement : les workers web et les
+commandes manage.py ne paient pas son coût au démarrage.
+Les PDF rendus sont gardés dans le cache partagé, indexés par l'empreinte
+de la facture : toute modification produit une nouvelle clé.
+Une fois envoyée, la facture est archivée telle quelle dans le stockage
+(default_storage) et c'est ce fichier qui est servi ensuite.
+"""
+from django.core.files.base import ContentFile
+from django.template.loader import render_to_string
+from django.utils import timezone
+from . import cache
+from .models import Invoice
+from .snapshot import take_snapshot
+import hashlib
+
+
+PDF_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def preload():
+    """
+    Importe WeasyPrint tout de suite.
+    À appeler au démarrage des workers dédiés au rendu PDF.
+    """
+    import weasyprint  # noqa: F401
+
+
+def html_to_pdf(html_string, **options):
+    """Convertit une page HTML en PDF (bytes)"""
+    from weasyprint import HTML
+    return HTML(string=html_string).write_pdf(**options)
+
+
+def render_invoice_pdf(snapshot, **options):
+    """Génère le PDF d'une facture (InvoiceSnapshot)"""
+    html_string = render_to_string('invoices/invoice_pdf.html', snapshot.template_context())
+    return html_to_pdf(html_string, **options)
+
+
+def _fingerprint(invoice_id, *timestamps):
+    parts = [invoice_id] + [timestamp.isoformat() if timestamp else '' for timestamp in timestamps]
+    return hashlib.sha256(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def invoice_fingerprint(invoice):
+    """
+    Empreinte qui change dès que la facture, ses lignes, son client ou le
+    profil de l'émetteur changent (les lignes recalculent la facture à chaque
+    sauvegarde, donc updated_at de la facture les couvre).
+    """
+    profile = getattr(invoice.user, 'profile', None)
+    return _fingerprint(
+        invoice.pk,
+        invoice.updated_at,
+        invoice.client.updated_at,
+        profile.updated_at if profile else None,
+    )
+
+
+def get_invoice_version(invoice_id, user):
+    """
+    Retourne (empreinte, date de dernière modification) de la facture en une
+    seule requête, sans charger la facture ni rendre le PDF.
+    Pour une facture archivée, c'est le SHA-256 du fichier archivé.
+    Retourne None si la facture n'existe pas pour cet utilisateur.
+    """
+    row = Invoice.objects.filter(id=invoice_id, user=user).values_list(
+        'status', 'pdf_sha256', 'pdf_archived_at',
+        'updated_at', 'client__updated_at', 'user__profile__updated_at'
+    ).first()
+    
+    if row is None:
+        return None
+    
+    status, pdf_sha256, pdf_archived_at, *timestamps = row
+    
+    if pdf_sha256 and status != 'draft':
+        return pdf_sha256, pdf_archived_at
+    
+    last_modified = max(timestamp for timestamp in timestamps if timestamp)
+    return _fingerprint(invoice_id, *timestamps), last_modified
+
+
+def get_invoice_pdf(invoice, **options):
+    """Retourne le PDF de la facture depuis le cache, ou le génère"""
+    snapshot = take_snapshot(invoice)
+    return cache.get_or_set(
+        'pdf', invoice_fingerprint(snapshot.invoice),
+        lambda: render_invoice_pdf(snapshot, **options),
+        timeout=PDF_CACHE_TIMEOUT
+    )
+
+
+def is_archived(invoice):
+    """La facture a été envoyée et son PDF archivé"""
+    return bool(invoice.pdf_archive) and invoice.status != 'draft'
+
+
+def open_archived_pdf(invoice):
+    """
+    Ouvre le PDF archivé en lecture (fichier à fermer par l'appelant).
+    Retourne None si la facture n'est pas archivée ou si le fichier manque.
+    """
+    if not is_archived(invoice):
+        return None
+    
+    try:
+        return invoice.pdf_archive.open('rb')
+    except OSError as e:
+        print(f"❌ PDF archivé introuvable pour la facture {invoice.invoice_number} : {e}")
+        return None
+
+
+def get_sendable_pdf(invoice, **options):
+    """
+    PDF à envoyer au client : le fichier archivé pour un renvoi, sinon le
+    PDF courant (depuis le cache ou généré).
+    """
+    archived = open_archived_pdf(invoice)
+    if archived is not None:
+        with archived:
+            return archived.read()
+    return get_invoice_pdf(invoice, **options)
+
+
+def archive_invoice_pdf(invoice, pdf_file):
+    """
+    Archive le PDF tel qu'il vient d'être envoyé, avec son SHA-256.
+    Une facture déjà archivée n'est jamais réécrite : la ligne est réservée
+    par un UPDATE conditionnel avant d'écrire le fichier, donc deux archivages
+    simultanés (envoi, tâche, lien public) n'écrivent qu'un seul PDF.
+    Retourne True si ce PDF a été archivé.
+    """
+    if invoice.pdf_archive:
+        return False
+    
+    field = invoice.pdf_archive.field
+    name = field.generate_filename(invoice, f'facture_{invoice.invoice_number}.pdf')
+    pdf_sha256 = hashlib.sha256(pdf_file).hexdigest()
+    archived_at = timezone.now()
+    
+    # update() : pas de save() complet, et updated_at reste la date de la dernière modification
+    claimed = Invoice.objects.filter(pk=invoice.pk, pdf_archive='').update(
+        pdf_archive=name, pdf_sha256=pdf_sha256, pdf_archived_at=archived_at,
+    )
+    
+    if claimed != 1:
+        # Archivée entre-temps par un autre process : on garde la sienne
+        invoice.refresh_from_db(fields=['pdf_archive', 'pdf_sha256', 'pdf_archived_at'])
+        return False
+    
+    try:
+        saved_name = field.storage.save(name, ContentFile(pdf_file), max_length=field.max_length)
+    except Exception:
+        # Libère la réservation pour que le prochain essai puisse archiver
+        Invoice.objects.filter(pk=invoice.pk, pdf_archive=name).update(
+            pdf_archive='', pdf_sha256='', pdf_archived_at=None,
+        )
+        raise
+    
+    # Le stockage renomme le fichier si le nom est déjà pris
+    if saved_name != name:
+        Invoice.objects.filter(pk=invoice.pk).update(pdf_archive=saved_name)
+    
+    invoice.pdf_archive = saved_name
+    invoice.pdf_sha256 = pdf_sha256
+    invoice.pdf_archived_at = archived_at
+    
+    print(f"🗄️ PDF archivé pour la facture {invoice.invoice_number} ({pdf_sha256[:12]})")
+    return True
@@ -0,0 +1,74 @@
+"""
+Aperçus PNG des factures : première page et miniature pour les listes.
+WeasyPrint ne produit plus d'images depuis sa version 53 : la première page
+du PDF (archivé ou en cache) est rastérisée avec pdftoppm (poppler-utils),
+puis réduite avec Pillow.
+Les aperçus sont gardés dans le cache partagé, indexés par la version de la
+facture. Sans pdftoppm, aucun aperçu n'est produit et la page de détail
+garde seulement le lien vers le PDF.
+"""
+from io import BytesIO
+from . import cache
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+# Largeur en pixels de chaque taille d'aperçu
+PREVIEW_WIDTHS = {
+    'page': 1000,
+    'thumb': 240,
+}
+
+PREVIEW_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def is_available():
+    """pdftoppm est installé sur cette machine"""
+    return shutil.which('pdftoppm') is not None
+
+
+def render_previews(pdf_file):
+    """Retourne {taille: PNG (bytes)} pour la première page du PDF"""
+    from PIL import Image
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, 'invoice.pdf')
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_file)
+        
+        output_prefix = os.path.join(tmp_dir, 'page')
+        subprocess.run(
+            [
+                'pdftoppm', '-png', '-singlefile', '-f', '1', '-l', '1',
+                '-scale-to-x', str(PREVIEW_WIDTHS['page']), '-scale-to-y', '-1',
+                pdf_path, output_prefix,
+            ],
+            check=True,
+            timeout=30,
+            capture_output=True,
+        )
+        
+        with open(output_prefix + '.png', 'rb') as f:
+            previews = {'page': f.read()}
+    
+    image = Image.open(BytesIO(previews['page']))
+    width = PREVIEW_WIDTHS['thumb']
+    image.thumbnail((width, width * 10))
+    
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    previews['thumb'] = buffer.getvalue()
+    
+    return previews
+
+
+def get_preview(version, size):
+    """Aperçu en cache pour cette version de la facture, ou None"""
+    return cache.get('preview', f'{version}:{size}')
+
+
+def store_previews(version, previews):
+    for size, png in previews.items():
+        cache.set('preview', f'{version}:{size}', png, timeout=PREVIEW_CACHE_TIMEOUT)
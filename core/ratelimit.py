@@ -0,0 +1,53 @@
+"""
+Limites de débit par utilisateur et par action, partagées entre les serveurs
+(seau à jetons dans le cache, voir core.cache.take_token). Un utilisateur
+qui envoie ou télécharge en masse ne bloque ni les workers web ni le quota
+d'envoi des autres. Les pages publiques (lien signé) sont limitées par
+adresse IP.
+"""
+from django.conf import settings
+from django.shortcuts import render
+from . import cache
+import math
+
+
+RATE_LIMITS = {
+    # action : (jetons par minute, rafale)
+    'send': (30, 20),       # envois demandés depuis l'interface
+    'email': (120, 200),    # emails envoyés par la file d'envoi (quota)
+    'pdf': (60, 30),        # rendus et téléchargements de PDF
+    'export': (10, 5),      # exports de fichiers
+    'public-pdf': (60, 60), # PDF par lien signé, par adresse IP (requêtes Range comprises)
+    'api-auth': (10, 20),   # jetons API refusés, par adresse IP
+}
+
+
+def retry_after(user_id, action):
+    """
+    Prend un jeton ; retourne 0 si l'action est permise, sinon l'attente en secondes.
+    user_id peut aussi être une autre clé de seau (voir client_ip).
+    """
+    per_minute, burst = RATE_LIMITS[action]
+    return cache.take_token('rate-limit', f'{action}:{user_id}', per_minute / 60, burst)
+
+
+def client_ip(request):
+    """
+    Adresse IP du visiteur. Derrière TRUSTED_PROXY_COUNT proxies, elle est lue
+    dans X-Forwarded-For, à la position ajoutée par le premier proxy de
+    confiance (les entrées plus à gauche viennent du client et sont ignorées).
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[max(0, len(addresses) - proxies)]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def too_many_requests(request, wait):
+    """Réponse 429 avec l'en-tête Retry-After"""
+    seconds = max(1, math.ceil(wait))
+    response = render(request, 'core/rate_limited.html', {'retry_after': seconds}, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
@@ -0,0 +1,527 @@
+"""
+Rapprochement bancaire : les crédits d'un relevé (CSV, OFX ou CAMT.053)
+sont associés aux factures ouvertes (envoyées ou en retard).
+Les factures ouvertes sont chargées une seule fois et indexées en mémoire
+par montant, par numéro normalisé et par mot du nom du client : chaque
+ligne du relevé ne coûte que quelques recherches dans des dictionnaires,
+sans requête SQL.
+Une ligne est rapprochée :
+  1. par le numéro de facture trouvé dans son libellé (sûr si le montant
+     est exact, à vérifier sinon) ;
+  2. à défaut, par son montant exact, départagé par la ressemblance entre
+     le nom du donneur d'ordre et celui du client.
+Les rapprochements proposés restent côté serveur (cache partagé, sous un
+jeton) : la page de validation les affiche par pages et ne renvoie que les
+cases de la page affichée. Les factures retenues sont marquées payées en
+une mise à jour groupée (InvoiceQuerySet.mark_as_paid).
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from difflib import SequenceMatcher
+from datetime import date
+from django.db import transaction
+from xml.etree import ElementTree
+from . import cache
+from .importers import iter_csv_rows
+from .models import Invoice
+import re
+import unicodedata
+import uuid
+
+
+# Un numéro de facture plus court (ex. "F1") se retrouve par hasard dans les libellés
+MIN_REFERENCE_LENGTH = 4
+# Nombre maximal de morceaux d'un numéro ("INV 2026 12 0001" : 4)
+MAX_REFERENCE_TOKENS = 6
+NAME_SIMILARITY_THRESHOLD = 0.8
+# Le nom du donneur d'ordre n'est comparé qu'aux clients ayant en commun son
+# mot le plus rare ou un mot porté par au plus NAME_BLOCKING_MAX_CLIENTS clients
+NAME_BLOCKING_MAX_CLIENTS = 50
+# SQLite limite le nombre de paramètres d'une requête
+APPLY_BATCH_SIZE = 10000
+# Proposition gardée le temps de la vérification ; lignes par page (bien
+# en dessous de DATA_UPLOAD_MAX_NUMBER_FIELDS)
+PROPOSAL_TIMEOUT = 2 * 60 * 60
+PROPOSAL_PAGE_SIZE = 100
+
+LEGAL_FORMS = {'sa', 'sas', 'sasu', 'sarl', 'eurl', 'sci', 'snc', 'scop', 'ei', 'eirl', 'ltd', 'gmbh', 'inc', 'sprl', 'srl'}
+
+# Dates des relevés (strptime est lent sur 50 000 lignes)
+ISO_DATE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})$')
+FRENCH_DATE = re.compile(r'(\d{2})[/.-](\d{2})[/.-](\d{4})$')
+
+# Colonnes reconnues dans les relevés CSV
+CSV_COLUMNS = {
+    'date': ['date', 'date_operation', 'date_opération', 'date_valeur', 'booking_date'],
+    'amount': ['montant', 'amount', 'montant_eur'],
+    'credit': ['credit', 'crédit'],
+    'debit': ['debit', 'débit'],
+    'reference': ['libelle', 'libellé', 'reference', 'référence', 'label', 'description', 'motif'],
+    'name': ['nom', 'name', 'contrepartie', 'counterparty', 'tiers', 'emetteur', 'émetteur', 'donneur_d_ordre'],
+}
+
+
+# --- Lecture des relevés -----------------------------------------------------
+
+def detect_format(file, name=''):
+    """'csv', 'ofx' ou 'camt' d'après l'extension, sinon d'après le début du fichier"""
+    name = name.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ofx', '.qfx')):
+        return 'ofx'
+
+    head = file.read(512)
+    file.seek(0)
+    if isinstance(head, bytes):
+        head = head.decode('utf-8', 'ignore')
+    head = head.lstrip('﻿ \r\n\t').upper()
+    if head.startswith('OFXHEADER') or '<OFX>' in head:
+        return 'ofx'
+    if head.startswith('<') and ('CAMT.053' in head or '<DOCUMENT' in head or '<?XML' in head):
+        return 'camt'
+    return 'csv'
+
+
+def iter_statement_lines(file, name=''):
+    """
+    Crédits du relevé, un dict par opération :
+    {'line', 'date', 'amount' (Decimal), 'reference', 'name'}.
+    Les débits sont ignorés.
+    """
+    parsers = {'csv': iter_csv_lines, 'ofx': iter_ofx_lines, 'camt': iter_camt_lines}
+    for number, line in enumerate(parsers[detect_format(file, name)](file), start=1):
+        if line['amount'] is not None and line['amount'] > 0:
+            line.setdefault('line', number)
+            yield line
+
+
+def parse_amount(value):
+    """Montant écrit à la française ou à l'anglaise ("1 234,56", "1,234.56", "-12.5")"""
+    value = str(value or '').strip().replace(' ', '').replace(' ', '').replace('€', '')
+    if not value:
+        return None
+    if ',' in value and '.' in value:
+        # Le dernier séparateur est celui des décimales
+        thousands = ',' if value.rfind('.') > value.rfind(',') else '.'
+        value = value.replace(thousands, '')
+    try:
+        return Decimal(value.replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
+
+def parse_statement_date(value):
+    """2026-03-31, 20260331 (OFX) ou 31/03/2026 (aussi 31-03-2026, 31.03.2026)"""
+    value = str(value or '').strip()[:10]
+    match = ISO_DATE.match(value)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = FRENCH_DATE.match(value)
+        if not match:
+            return None
+        day, month, year = match.groups()
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def iter_csv_lines(file):
+    columns = None
+    for number, row in enumerate(iter_csv_rows(file), start=2):
+        if columns is None:
+            columns = {}
+            for column in row:
+                key = (column or '').strip().lower().replace(' ', '_').replace("'", '_')
+                for field, aliases in CSV_COLUMNS.items():
+                    if key in aliases and field not in columns:
+                        columns[field] = column
+
+        def value(field):
+            return row.get(columns[field]) if field in columns else None
+
+        amount = parse_amount(value('amount'))
+        if amount is None and 'credit' in columns:
+            amount = parse_amount(value('credit'))
+            if amount is None and parse_amount(value('debit')):
+                continue
+
+        yield {
+            'line': number,
+            'date': parse_statement_date(value('date')),
+            'amount': amount,
+            'reference': (value('reference') or '').strip(),
+            'name': (value('name') or '').strip(),
+        }
+
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def iter_ofx_lines(file):
+    """OFX 1.x (SGML, balises non fermées) ou 2.x (XML)"""
+    data = file.read()
+    text = data.decode('latin-1') if isinstance(data, bytes) else data
+
+    for match in OFX_TRANSACTION.finditer(text):
+        fields = {key.upper(): value.strip() for key, value in OFX_FIELD.findall(match.group(1))}
+        yield {
+            'date': parse_statement_date(fields.get('DTPOSTED', '')[:8]),
+            'amount': parse_amount(fields.get('TRNAMT')),
+            'reference': ' '.join(filter(None, [fields.get('MEMO'), fields.get('REFNUM'), fields.get('CHECKNUM')])),
+            'name': fields.get('NAME', ''),
+        }
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def find_path(element, *path):
+    """Premier descendant suivant le chemin de noms locaux (espaces de noms ignorés)"""
+    for name in path:
+        element = next((child for child in element if local_name(child.tag) == name), None)
+        if element is None:
+            return None
+    return element
+
+
+def find_text(element, *path):
+    found = find_path(element, *path)
+    return (found.text or '').strip() if found is not None else ''
+
+
+def iter_camt_lines(file):
+    """
+    CAMT.053 (ISO 20022) : une ligne par détail de transaction (TxDtls), ou
+    par écriture (Ntry) si elle n'en a pas. Le fichier est lu écriture par
+    écriture.
+    """
+    for _, element in ElementTree.iterparse(file, events=('end',)):
+        if local_name(element.tag) != 'Ntry':
+            continue
+
+        if find_text(element, 'CdtDbtInd') == 'CRDT':
+            booking_date = parse_statement_date(find_text(element, 'BookgDt', 'Dt') or find_text(element, 'BookgDt', 'DtTm'))
+            entry_amount = parse_amount(find_text(element, 'Amt'))
+            entry_details = find_path(element, 'NtryDtls')
+            details = [] if entry_details is None else [child for child in entry_details if local_name(child.tag) == 'TxDtls']
+
+            for detail in details or [element]:
+                amount = parse_amount(find_text(detail, 'AmtDtls', 'TxAmt', 'Amt') or find_text(detail, 'Amt')) if details else None
+                remittance = find_path(detail, 'RmtInf')
+                references = []
+                if remittance is not None:
+                    references += [(child.text or '').strip() for child in remittance if local_name(child.tag) == 'Ustrd']
+                    for structured in (child for child in remittance if local_name(child.tag) == 'Strd'):
+                        references.append(find_text(structured, 'CdtrRefInf', 'Ref'))
+                references.append(find_text(detail, 'Refs', 'EndToEndId'))
+                references.append(find_text(element, 'AddtlNtryInf'))
+
+                yield {
+                    'date': booking_date,
+                    'amount': amount if amount is not None else entry_amount,
+                    'reference': ' '.join(reference for reference in references if reference and reference != 'NOTPROVIDED'),
+                    'name': find_text(detail, 'RltdPties', 'Dbtr', 'Nm') or find_text(detail, 'RltdPties', 'Dbtr', 'Pty', 'Nm'),
+                }
+
+        # Écriture traitée : libère la mémoire du sous-arbre
+        element.clear()
+
+
+# --- Index des factures ouvertes --------------------------------------------
+
+def normalize_reference(value):
+    return re.sub(r'[^A-Z0-9]', '', strip_accents(value).upper())
+
+
+def strip_accents(value):
+    if value.isascii():
+        return value
+    return ''.join(char for char in unicodedata.normalize('NFKD', value) if not unicodedata.combining(char))
+
+
+def normalize_name(value):
+    """Nom comparable : minuscules, sans accents, ponctuation ni forme juridique"""
+    words = re.findall(r'[a-z0-9]+', strip_accents(value or '').lower())
+    return ' '.join(word for word in words if word not in LEGAL_FORMS)
+
+
+def similar_names(payer, keys):
+    """
+    {clé: ressemblance} des noms de clients `keys` qui ressemblent au donneur
+    d'ordre (au moins NAME_SIMILARITY_THRESHOLD) ; 1 si tous les mots du nom
+    du client sont dans le libellé du donneur d'ordre.
+    """
+    if not payer:
+        return {}
+    payer_tokens = set(payer.split())
+    # Le donneur d'ordre est la séquence b : SequenceMatcher ne l'analyse qu'une fois
+    matcher = SequenceMatcher(None, '', payer)
+    similar = {}
+    for key in keys:
+        if set(key.split()) <= payer_tokens:
+            similar[key] = 1
+            continue
+        matcher.set_seq1(key)
+        # Bornes supérieures rapides avant le calcul exact
+        if matcher.real_quick_ratio() < NAME_SIMILARITY_THRESHOLD or matcher.quick_ratio() < NAME_SIMILARITY_THRESHOLD:
+            continue
+        score = matcher.ratio()
+        if score >= NAME_SIMILARITY_THRESHOLD:
+            similar[key] = score
+    return similar
+
+
+class InvoiceIndex:
+    """
+    Factures ouvertes indexées par montant (puis par client), par numéro
+    normalisé, et noms des clients indexés par mot. Une facture rapprochée
+    est retirée des index (jamais payée deux fois).
+    """
+
+    def __init__(self, invoices):
+        # invoices : tuples (id, invoice_number, total, client_name)
+        self.invoices = {}
+        self.by_amount = defaultdict(lambda: defaultdict(dict))
+        self.by_reference = {}
+        self.reference_tokens = 1
+        self.clients_by_token = defaultdict(set)
+        self._similar = {}
+        client_keys = {}
+
+        for invoice_id, number, total, client_name in invoices:
+            client_key = client_keys.get(client_name)
+            if client_key is None:
+                client_key = client_keys[client_name] = normalize_name(client_name)
+                for token in client_key.split():
+                    self.clients_by_token[token].add(client_key)
+
+            invoice = {
+                'id': invoice_id,
+                'number': number,
+                'total': Decimal(total).quantize(Decimal('0.01')),
+                'client_name': client_name,
+                'client_key': client_key,
+                # Ordre d'échéance : à montant égal, la plus ancienne est proposée
+                'rank': len(self.invoices),
+            }
+            self.invoices[invoice_id] = invoice
+            self.by_amount[invoice['total']][client_key][invoice_id] = invoice
+
+            reference = normalize_reference(number)
+            if len(reference) >= MIN_REFERENCE_LENGTH:
+                self.by_reference[reference] = invoice
+                tokens = len(re.findall(r'[A-Za-z0-9]+', number))
+                self.reference_tokens = min(max(self.reference_tokens, tokens), MAX_REFERENCE_TOKENS)
+
+    @classmethod
+    def for_user(cls, user):
+        rows = (
+            Invoice.objects.filter(user=user, status__in=['sent', 'overdue'])
+            .order_by('due_date', 'id')
+            .values_list('id', 'invoice_number', 'total', 'client__name')
+            .iterator(chunk_size=5000)
+        )
+        return cls(rows)
+
+    def find_by_reference(self, reference):
+        """Facture dont le numéro apparaît dans le libellé (morceaux consécutifs)"""
+        tokens = re.findall(r'[A-Z0-9]+', strip_accents(reference).upper())
+        for start in range(len(tokens)):
+            key = ''
+            for token in tokens[start:start + self.reference_tokens]:
+                key += token
+                invoice = self.by_reference.get(key)
+                if invoice is not None:
+                    return invoice
+        return None
+
+    def candidates_by_amount(self, amount):
+        """Factures de ce montant, groupées par client : {client_key: {id: facture}}"""
+        return self.by_amount.get(amount, {})
+
+    def similar_clients(self, payer):
+        """
+        Clients qui ressemblent au donneur d'ordre ({client_key: ressemblance}),
+        cherchés parmi ceux qui partagent l'un de ses mots rares ; calculé
+        une fois par nom.
+        """
+        scores = self._similar.get(payer)
+        if scores is None:
+            tokens = sorted(
+                (token for token in set(payer.split()) if token in self.clients_by_token),
+                key=lambda token: len(self.clients_by_token[token]),
+            )
+            keys = set().union(*(
+                self.clients_by_token[token] for position, token in enumerate(tokens)
+                if position == 0 or len(self.clients_by_token[token]) <= NAME_BLOCKING_MAX_CLIENTS
+            ))
+            scores = self._similar[payer] = similar_names(payer, keys)
+        return scores
+
+    def remove(self, invoice):
+        self.invoices.pop(invoice['id'], None)
+        # Les groupes vides sont supprimés : un montant sans facture n'a plus de candidats
+        by_client = self.by_amount.get(invoice['total'], {})
+        invoices = by_client.get(invoice['client_key'], {})
+        invoices.pop(invoice['id'], None)
+        if not invoices:
+            by_client.pop(invoice['client_key'], None)
+            if not by_client:
+                self.by_amount.pop(invoice['total'], None)
+        self.by_reference.pop(normalize_reference(invoice['number']), None)
+
+
+# --- Rapprochement -------------------------------------------------------------
+
+def reconcile(lines, index):
+    """
+    Rapproche les lignes du relevé des factures de l'index.
+    Retourne (matches, unmatched) ; chaque match est un dict
+    {'line', 'invoice', 'rule', 'confirmed', 'score'}. Seuls les matches
+    confirmés retirent la facture de l'index.
+    """
+    matches, pending = [], []
+
+    # 1. Numéro de facture dans le libellé : passe en premier, c'est le plus sûr
+    for line in lines:
+        invoice = index.find_by_reference(line['reference']) if line['reference'] else None
+        if invoice is None:
+            pending.append(line)
+            continue
+        confirmed = invoice['total'] == line['amount']
+        if confirmed:
+            index.remove(invoice)
+        matches.append({
+            'line': line, 'invoice': invoice, 'confirmed': confirmed, 'score': 1,
+            'rule': 'Numéro et montant' if confirmed else 'Numéro, montant différent',
+        })
+
+    # 2. Montant exact, départagé par le nom du donneur d'ordre
+    unmatched = []
+    for line in pending:
+        candidates = index.candidates_by_amount(line['amount'])
+        if not candidates:
+            unmatched.append(line)
+            continue
+
+        scores = index.similar_clients(normalize_name(line['name'] or line['reference']))
+        scored = sorted(
+            ((score, candidates[key]) for key, score in scores.items() if key in candidates),
+            key=lambda pair: pair[0], reverse=True,
+        )
+        if scored:
+            score, invoice = scored[0][0], next(iter(scored[0][1].values()))
+        else:
+            # Aucun client ne ressemble : la facture la plus ancienne de ce montant
+            score, invoice = 0, min(
+                (next(iter(invoices.values())) for invoices in candidates.values()),
+                key=lambda invoice: invoice['rank'],
+            )
+
+        # Sûr seulement si une seule facture de ce montant est à un client qui ressemble au donneur d'ordre
+        close = sum(len(invoices) for _, invoices in scored)
+        confirmed = close == 1
+        if confirmed:
+            index.remove(invoice)
+            rule = 'Montant et nom du client'
+        elif close:
+            rule = f'Montant, {close} factures possibles'
+        else:
+            rule = 'Montant seul'
+        matches.append({'line': line, 'invoice': invoice, 'confirmed': confirmed, 'score': round(score, 2), 'rule': rule})
+
+    return matches, unmatched
+
+
+def reconcile_statement(user, file, name=''):
+    """Lit le relevé et le rapproche des factures ouvertes de l'utilisateur"""
+    lines = list(iter_statement_lines(file, name))
+    return reconcile(lines, InvoiceIndex.for_user(user))
+
+
+def apply_matches(user, invoice_ids):
+    """
+    Marque les factures payées en une mise à jour groupée (par lots de
+    APPLY_BATCH_SIZE pour SQLite). Retourne le nombre de factures payées.
+    """
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    count = 0
+    with transaction.atomic():
+        for start in range(0, len(invoice_ids), APPLY_BATCH_SIZE):
+            count += Invoice.objects.filter(
+                user=user, id__in=invoice_ids[start:start + APPLY_BATCH_SIZE]
+            ).mark_as_paid()
+    return count
+
+
+# --- Validation ----------------------------------------------------------------
+
+def save_proposal(user, statement_name, matches, unmatched_count):
+    """
+    Garde les rapprochements proposés dans le cache, les sûrs en premier et
+    déjà retenus. Retourne le jeton de la proposition.
+    """
+    matches = sorted(matches, key=lambda match: not match['confirmed'])
+    token = uuid.uuid4().hex
+    cache.set('reconciliation', token, {
+        'user_id': user.id,
+        'statement_name': statement_name,
+        'unmatched_count': unmatched_count,
+        'confirmed_count': sum(1 for match in matches if match['confirmed']),
+        # Tuples plutôt que dicts : la proposition d'un gros relevé reste compacte
+        'rows': [
+            (
+                match['invoice']['id'], match['invoice']['number'], match['invoice']['client_name'],
+                match['invoice']['total'], match['line']['line'], match['line']['date'], match['line']['amount'],
+                (match['line']['name'] or match['line']['reference'])[:100], match['rule'], match['confirmed'],
+            )
+            for match in matches
+        ],
+        'selected': {match['invoice']['id'] for match in matches if match['confirmed']},
+    }, timeout=PROPOSAL_TIMEOUT)
+    return token
+
+
+def get_proposal(token, user):
+    """Proposition du jeton ; None si elle a expiré ou n'appartient pas à l'utilisateur"""
+    proposal = cache.get('reconciliation', token)
+    if proposal is None or proposal['user_id'] != user.id:
+        return None
+    return proposal
+
+
+def get_page(proposal, page):
+    """Lignes de la page (numérotée à partir de 1), sous forme de dicts pour le template"""
+    start = (page - 1) * PROPOSAL_PAGE_SIZE
+    return [
+        {
+            'invoice_id': invoice_id, 'number': number, 'client_name': client_name, 'total': total,
+            'line': line, 'date': line_date, 'amount': amount, 'label': label, 'rule': rule,
+            'confirmed': confirmed, 'selected': invoice_id in proposal['selected'],
+        }
+        for invoice_id, number, client_name, total, line, line_date, amount, label, rule, confirmed
+        in proposal['rows'][start:start + PROPOSAL_PAGE_SIZE]
+    ]
+
+
+def page_count(proposal):
+    return max(1, -(-len(proposal['rows']) // PROPOSAL_PAGE_SIZE))
+
+
+def update_selection(token, proposal, page, checked_ids):
+    """Remplace la sélection des lignes de la page par les cases cochées"""
+    page_ids = {row['invoice_id'] for row in get_page(proposal, page)}
+    proposal['selected'] = (proposal['selected'] - page_ids) | (page_ids & set(checked_ids))
+    cache.set('reconciliation', token, proposal, timeout=PROPOSAL_TIMEOUT)
+
+
+def apply_proposal(token, proposal, user):
+    """Marque payées les factures retenues et oublie la proposition"""
+    count = apply_matches(user, sorted(proposal['selected']))
+    cache.delete('reconciliation', token)
+    return count
@@ -0,0 +1,91 @@
+"""
+Instantané d'une facture pour ses rendus (PDF, emails, page de détail).
+La facture, son client, l'émetteur, son profil et les lignes sont chargés
+en deux requêtes, toujours les mêmes : select_related pour le client,
+l'utilisateur et son profil, prefetch_related pour les lignes. Les templates
+reçoivent ensuite l'instantané et ne déclenchent plus aucune requête.
+"""
+from dataclasses import dataclass
+from datetime import date
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from .models import Invoice
+from . import tracking
+
+
+def invoice_queryset():
+    """Factures chargées dans la forme attendue par InvoiceSnapshot"""
+    return Invoice.objects.select_related('client', 'user__profile').prefetch_related('items')
+
+
+@dataclass(frozen=True)
+class InvoiceSnapshot:
+    """
+    Facture prête à rendre. Les objets chargés sont partagés par tous les
+    rendus : on les lit, on ne les modifie pas.
+    """
+    invoice: Invoice
+    client: object
+    user: object
+    profile: object
+    items: tuple
+
+    @property
+    def issuer_name(self):
+        return self.user.get_full_name() or self.user.username
+
+    def template_context(self):
+        """Contexte des templates HTML (PDF et page de détail)"""
+        return {
+            'invoice': self.invoice,
+            'client': self.client,
+            'issuer': self.user,
+            'profile': self.profile,
+            'items': self.items,
+        }
+
+    def email_context(self, **extra):
+        """Contexte des emails de facture et de relance"""
+        invoice = self.invoice
+        return {
+            'client_name': self.client.name,
+            'invoice_number': invoice.invoice_number,
+            'issue_date': invoice.issue_date.strftime('%d/%m/%Y'),
+            'due_date': invoice.due_date.strftime('%d/%m/%Y'),
+            'days_overdue': (date.today() - invoice.due_date).days,
+            'subtotal': invoice.subtotal,
+            'tax_rate': invoice.tax_rate,
+            'tax_amount': invoice.tax_amount,
+            'total': invoice.total,
+            'notes': invoice.notes,
+            'freelance_name': self.issuer_name,
+            'freelance_email': self.user.email,
+            'tracking_pixel_url': tracking.get_pixel_url(invoice) if settings.EMAIL_TRACKING else None,
+            **extra,
+        }
+
+
+def take_snapshot(invoice):
+    """
+    Instantané d'une facture déjà chargée. Si elle ne vient pas de
+    invoice_queryset(), seul ce qui manque est chargé (au plus deux requêtes).
+    """
+    if not (Invoice.client.is_cached(invoice) and Invoice.user.is_cached(invoice)
+            and type(invoice.user).profile.is_cached(invoice.user)):
+        invoice = invoice_queryset().get(pk=invoice.pk)
+    elif 'items' not in getattr(invoice, '_prefetched_objects_cache', {}):
+        prefetch_related_objects([invoice], 'items')
+
+    user = invoice.user
+    return InvoiceSnapshot(
+        invoice=invoice,
+        client=invoice.client,
+        user=user,
+        profile=getattr(user, 'profile', None),
+        items=tuple(invoice.items.all()),
+    )
+
+
+def get_snapshot(**filters):
+    """Instantané de la facture correspondant à filters (Invoice.DoesNotExist sinon)"""
+    return take_snapshot(invoice_queryset().get(**filters))
@@ -1,146 +1,307 @@
 from celery import shared_task
 from django.utils import timezone
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
 from .models import Invoice
-from datetime import date
+from . import dispatch
+from datetime import date, timedelta
 
 from django.conf import settings
-from weasyprint import HTML
+from django.db import transaction
 import traceback
-import gc
+import uuid
 
 
-@shared_task
+# Une relance par facture en retard tous les REMINDER_INTERVAL_DAYS jours
+REMINDER_INTERVAL_DAYS = 7
+
+
+@shared_task(ignore_result=True, priority=0)
 def check_overdue_invoices():
     """
     Tâche périodique : vérifie les factures en retard et envoie des relances.
     À exécuter quotidiennement via Celery Beat.
     """
     from core.models import Invoice
-    from datetime import date
+    from django.db.models import Q
     
     print("🔍 [CELERY BEAT] Vérification des factures en retard...")
     
-    # Récupère toutes les factures en retard et impayées
-    overdue_invoices = Invoice.objects.filter(
-        status='unpaid',
-        due_date__lt=date.today()
-    )
+    # Passe en retard les factures envoyées non payées (déclenche le webhook invoice.overdue)
+    Invoice.objects.mark_as_overdue()
     
-    count = 0
-    for invoice in overdue_invoices:
-        # Lance l'envoi de relance en arrière-plan
-        send_reminder_email_task.delay(invoice.id)
-        count += 1
+    # Met en file une relance pour chaque facture en retard, impayée et pas
+    # relancée depuis REMINDER_INTERVAL_DAYS jours
+    from core import outbox
+    
+    today = date.today()
+    last_due = today - timedelta(days=REMINDER_INTERVAL_DAYS)
     
-    print(f"✅ [CELERY BEAT] {count} relance(s) programmée(s)")
+    with transaction.atomic():
+        overdue_invoices = list(
+            Invoice.objects.filter(status='overdue', due_date__lt=today)
+            .filter(Q(last_reminded_at__isnull=True) | Q(last_reminded_at__date__lte=last_due))
+            .select_for_update(skip_locked=True).only('id', 'user_id')
+        )
+        reminded = Invoice.objects.filter(id__in=[invoice.id for invoice in overdue_invoices])
+        reminded.update(last_reminded_at=timezone.now())
+        count = outbox.enqueue('reminder', overdue_invoices)
+    
+    # Compteurs DeliveryStats déjà agrégés : une seule requête
+    unopened = reminded.unopened().count()
+    
+    print(f"✅ [CELERY BEAT] {count} relance(s) programmée(s), dont {unopened} facture(s) jamais ouverte(s)")
     
     return f"{count} relances envoyées"
 
 
 def send_reminder_email(invoice):
     """
-    Lance l'envoi de relance en arrière-plan via Celery.
+    Met la relance en file d'envoi (EmailOutbox).
+    """
+    from core import outbox
+    
+    with transaction.atomic():
+        Invoice.objects.filter(id=invoice.id).update(last_reminded_at=timezone.now())
+        outbox.enqueue('reminder', [invoice])
+    print(f"✅ Relance mise en file pour facture {invoice.invoice_number}")
+    return True
+
+
+# Événement Stripe en échec : nouvel essai après STRIPE_RETRY_BASE * 2^(n-1)
+# secondes (plafonné), abandon après STRIPE_EVENT_MAX_ATTEMPTS tentatives
+STRIPE_EVENT_MAX_ATTEMPTS = 8
+STRIPE_RETRY_BASE = 60
+STRIPE_RETRY_MAX = 6 * 60 * 60
+
+
+def schedule_stripe_events(customer_id, countdown=None):
+    """
+    Lance le traitement des événements Stripe d'un client en arrière-plan
+    (Celery, ou pool de threads local sans broker).
+    """
+    dispatch.submit(process_stripe_events, args=[customer_id], countdown=countdown)
+    print(f"✅ Tâche Stripe lancée pour le client {customer_id or '(aucun)'}")
+
+
+@shared_task(ignore_result=True, priority=1)
+def process_stripe_events(customer_id):
+    """
+    Tâche Celery qui traite les événements Stripe en attente d'un client,
+    dans l'ordre de création chez Stripe. Chaque événement est validé dans
+    sa propre transaction, la ligne verrouillée pour qu'un seul worker
+    traite un client à la fois.
+    En cas d'erreur, l'événement garde sa tentative et son erreur, et le
+    traitement s'arrête là (les suivants attendent, pour rester dans
+    l'ordre) jusqu'au nouvel essai programmé. Après
+    STRIPE_EVENT_MAX_ATTEMPTS échecs, l'événement est abandonné (failed_at)
+    et une alerte est envoyée : la file du client repart.
     """
-    from core.taskss import send_reminder_email_task
+    from core.models import StripeEvent
+    from core.billing import handle_stripe_event
+    
+    count = 0
+    while True:
+        with transaction.atomic():
+            current = StripeEvent.objects.select_for_update().filter(
+                customer_id=customer_id,
+                processed_at__isnull=True,
+                failed_at__isnull=True,
+            ).order_by('stripe_created', 'id').first()
+            
+            if current is None:
+                break
+            
+            now = timezone.now()
+            if current.next_attempt_at and current.next_attempt_at > now:
+                # Nouvel essai déjà programmé pour cet événement
+                break
+            
+            current.attempts += 1
+            try:
+                with transaction.atomic():
+                    handle_stripe_event(current.event_type, current.payload['data']['object'])
+            except Exception as e:
+                print(f"❌ [CELERY] Erreur Stripe ({current.event_id}, tentative {current.attempts}) : {e}")
+                traceback.print_exc()
+                
+                current.last_error = f'{type(e).__name__}: {e}'
+                if current.attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+                    current.failed_at = now
+                    current.save(update_fields=['attempts', 'last_error', 'failed_at'])
+                    transaction.on_commit(lambda event=current: alert_stripe_event_failed(event))
+                    # Événement abandonné : on passe aux suivants
+                    continue
+                
+                delay = min(STRIPE_RETRY_BASE * 2 ** (current.attempts - 1), STRIPE_RETRY_MAX)
+                current.next_attempt_at = now + timedelta(seconds=delay)
+                current.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+                transaction.on_commit(lambda: schedule_stripe_events(customer_id, countdown=delay))
+                break
+            
+            current.processed_at = now
+            current.last_error = ''
+            current.next_attempt_at = None
+            current.save(update_fields=['attempts', 'processed_at', 'last_error', 'next_attempt_at'])
+            count += 1
+    
+    print(f"✅ [CELERY] {count} événement(s) Stripe traité(s) pour le client {customer_id or '(aucun)'}")
+    
+    return f"{count} événements traités"
+
+
+def alert_stripe_event_failed(event):
+    """Prévient les administrateurs (ADMINS) qu'un événement Stripe a été abandonné"""
+    from django.core.mail import mail_admins
+    
+    print(f"🚨 [STRIPE] Événement {event.event_id} ({event.event_type}) abandonné après {event.attempts} tentatives : {event.last_error}")
+    mail_admins(
+        f"Événement Stripe abandonné : {event.event_type}",
+        f"L'événement {event.event_id} du client {event.customer_id or '(aucun)'} a échoué "
+        f"{event.attempts} fois et ne sera plus retraité automatiquement.\n\n"
+        f"Dernière erreur : {event.last_error}\n\n"
+        f"Le rejouer depuis l'admin (Événements Stripe > Rejouer) une fois la cause corrigée.",
+        fail_silently=True,
+    )
+
+
+@shared_task(ignore_result=True, priority=1)
+def retry_stripe_events():
+    """
+    Tâche périodique : relance le traitement des clients qui ont des
+    événements Stripe en attente dont l'heure est venue (nouvel essai perdu,
+    worker arrêté pendant un traitement...).
+    """
+    from core.models import StripeEvent
+    from django.db.models import Q
+    
+    customer_ids = list(
+        StripeEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+        .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now()))
+        .order_by().values_list('customer_id', flat=True).distinct()
+    )
+    for customer_id in customer_ids:
+        schedule_stripe_events(customer_id)
+    return f"{len(customer_ids)} client(s) relancé(s)"
+
+
+
+# Délai avant le pré-rendu : des modifications rapprochées ne sont rendues qu'une fois
+PDF_PRERENDER_DELAY = 10
+
+
+def schedule_pdf_prerender(invoice):
+    """
+    Programme, après le commit, le rendu du PDF en arrière-plan pour que le
+    téléchargement ou l'envoi qui suit trouve le PDF déjà en cache.
+    Chaque appel remplace le précédent : seul le dernier rendu programmé a lieu.
+    """
+    from core import cache
+    
+    token = uuid.uuid4().hex
+    cache.set('pdf-prerender', invoice.pk, token, timeout=PDF_PRERENDER_DELAY * 6)
+    
+    def enqueue():
+        # Rendu spéculatif : abandonné si le pool local est plein, le PDF sera rendu à la demande
+        dispatch.submit(prerender_invoice_pdf, args=[invoice.pk, token], countdown=PDF_PRERENDER_DELAY, speculative=True)
+    
+    transaction.on_commit(enqueue)
+
+
+@shared_task(ignore_result=True, priority=9)
+def prerender_invoice_pdf(invoice_id, token):
+    """
+    Tâche Celery de faible priorité : rend le PDF d'une facture dans le cache.
+    Ignorée si une modification plus récente a programmé un autre rendu.
+    """
+    from core import cache
+    from core.models import Invoice
+    from core.snapshot import invoice_queryset
+    from core.pdf import get_invoice_pdf, is_archived
+    
+    latest_token = cache.get('pdf-prerender', invoice_id)
+    if latest_token is not None and latest_token != token:
+        return
     
     try:
-        send_reminder_email_task.delay(invoice.id)
-        print(f"✅ Tâche de relance lancée pour facture {invoice.invoice_number}")
-        return True
-    except Exception as e:
-        print(f"❌ Erreur lors du lancement de la tâche : {e}")
-        return False
+        invoice = invoice_queryset().get(id=invoice_id)
+    except Invoice.DoesNotExist:
+        return
+    
+    # Facture envoyée entre-temps : c'est le PDF archivé qui sera servi
+    if is_archived(invoice):
+        return
+    
+    get_invoice_pdf(invoice)
+    print(f"✅ [CELERY] PDF pré-rendu pour facture {invoice.invoice_number}")
+
+
+
+def schedule_invoice_preview(invoice_id, version):
+    """
+    Lance la génération des aperçus PNG d'une facture en arrière-plan.
+    Une seule génération est programmée par version de la facture.
+    """
+    from core import cache
+    
+    if not cache.add('preview-pending', version, True, timeout=5 * 60):
+        return
+    
+    # Aperçu abandonné si le pool local est plein : la page garde le lien vers le PDF
+    if not dispatch.submit(render_invoice_preview, args=[invoice_id], speculative=True):
+        cache.delete('preview-pending', version)
 
 
-@shared_task
-def send_invoice_async(invoice_id):
+@shared_task(ignore_result=True, priority=8)
+def render_invoice_preview(invoice_id):
     """
-    Tâche asynchrone pour envoyer une facture par email.
-    Utilisée pour ne pas bloquer l'interface utilisateur.
+    Tâche Celery : génère les aperçus PNG (page et miniature) d'une facture
+    à partir de son PDF archivé ou en cache.
     """
+    from core import preview
+    from core.models import Invoice
+    from core.snapshot import invoice_queryset
+    from core.pdf import get_invoice_version, get_sendable_pdf
+    
+    if not preview.is_available():
+        print("⚠️ [CELERY] pdftoppm introuvable : aperçus désactivés")
+        return
+    
     try:
-        invoice = Invoice.objects.get(id=invoice_id)
-        from .utils import send_invoice_email
-        return send_invoice_email(invoice)
+        invoice = invoice_queryset().get(id=invoice_id)
     except Invoice.DoesNotExist:
-        return False
+        return
+    
+    version, _ = get_invoice_version(invoice.id, invoice.user)
+    previews = preview.render_previews(get_sendable_pdf(invoice))
+    preview.store_previews(version, previews)
     
+    print(f"✅ [CELERY] Aperçus générés pour facture {invoice.invoice_number}")
 
 
 
+def schedule_pdf_archive(invoice):
+    """
+    Lance l'archivage du PDF en arrière-plan (envoi par lien : l'email part
+    sans attendre le rendu).
+    """
+    dispatch.submit(archive_invoice_pdf_task, args=[invoice.id])
 
 
-@shared_task(bind=True, max_retries=3)
-def send_invoice_email_task(self, invoice_id):
+@shared_task(bind=True, max_retries=3, ignore_result=True, priority=4)
+def archive_invoice_pdf_task(self, invoice_id):
     """
-    Tâche Celery pour envoyer une facture par email en arrière-plan.
+    Tâche Celery : rend et archive le PDF d'une facture envoyée par lien.
     """
     from core.models import Invoice
+    from core.snapshot import invoice_queryset
+    from core.pdf import get_invoice_pdf, archive_invoice_pdf
     
     try:
-        print(f"📧 [CELERY] Début envoi email pour facture ID={invoice_id}")
-        
-        # Récupère la facture
-        invoice = Invoice.objects.get(id=invoice_id)
+        invoice = invoice_queryset().get(id=invoice_id)
         
-        # Génère le PDF
-        html_string = render_to_string('invoices/invoice_pdf.html', {'invoice': invoice})
-        
-        gc.collect()
-        from weasyprint import HTML, CSS
-        pdf_file = HTML(string=html_string).write_pdf(
-            optimize_images=True,  # Optimise les images
-            uncompressed_pdf=False  # Compresse le PDF
-        )
-        del html_string
+        if not invoice.pdf_archive:
+            archive_invoice_pdf(invoice, get_invoice_pdf(invoice))
         
-        print(f"✅ [CELERY] PDF généré")
-        
-        # Prépare l'email HTML
-        email_html = render_to_string('emails/invoice_email.html', {
-            'client_name': invoice.client.name,
-            'invoice_number': invoice.invoice_number,
-            'issue_date': invoice.issue_date.strftime('%d/%m/%Y'),
-            'due_date': invoice.due_date.strftime('%d/%m/%Y'),
-            'subtotal': invoice.subtotal,
-            'tax_rate': invoice.tax_rate,
-            'tax_amount': invoice.tax_amount,
-            'total': invoice.total,
-            'notes': invoice.notes,
-            'freelance_name': invoice.user.get_full_name() or invoice.user.username,
-            'freelance_email': invoice.user.email,
-        })
-        
-        # Crée l'email
-        subject = f'Facture {invoice.invoice_number} - {invoice.client.name}'
-        
-        email = EmailMessage(
-            subject=subject,
-            body=email_html,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[invoice.client.email],
-            reply_to=[invoice.user.email],
-        )
-        
-        email.content_subtype = 'html'
-        
-        # Attache le PDF
-        email.attach(
-            f'facture_{invoice.invoice_number}.pdf',
-            pdf_file,
-            'application/pdf'
-        )
-        
-        print(f"📤 [CELERY] Envoi email...")
-        
-        # Envoie l'email
-        email.send(fail_silently=False)
-        
-        print(f"✅ [CELERY] Email envoyé avec succès pour facture {invoice.invoice_number}")
-        
-        return f"Email envoyé pour facture {invoice.invoice_number}"
+        return f"PDF archivé pour facture {invoice.invoice_number}"
         
     except Invoice.DoesNotExist:
         print(f"❌ [CELERY] Facture {invoice_id} introuvable")
@@ -150,64 +311,145 @@ def send_invoice_email_task(self, invoice_id):
         print(f"❌ [CELERY] Erreur : {e}")
         traceback.print_exc()
         
-        # Réessaie jusqu'à 3 fois avec délai exponentiel
         raise self.retry(exc=e, countdown=60 * (2 ** self.request.retries))
 
 
-@shared_task(bind=True, max_retries=3)
-def send_reminder_email_task(self, invoice_id):
+
+BULK_SEND_TIMEOUT = 24 * 60 * 60
+
+
+def schedule_bulk_send(user, invoice_ids):
     """
-    Tâche Celery pour envoyer un email de relance en arrière-plan.
+    Met en file d'envoi (EmailOutbox) les emails des factures et les marque
+    envoyées, dans une même transaction. Retourne l'identifiant du suivi
+    (voir get_bulk_send_progress), mis à jour par les workers de la file.
     """
-    from core.models import Invoice
-    from datetime import date
+    from core import cache, outbox
+    
+    job_id = uuid.uuid4().hex
+    cache.set('bulk-send', job_id, {'user_id': user.id, 'total': len(invoice_ids)}, timeout=BULK_SEND_TIMEOUT)
+    
+    invoices = Invoice.objects.filter(id__in=invoice_ids)
+    with transaction.atomic():
+        queued = outbox.enqueue('invoice', invoices.only('id', 'user_id'), job_id=job_id)
+        invoices.mark_as_sent()
+    
+    # Factures supprimées entre-temps
+    missing = len(invoice_ids) - queued
+    if missing:
+        cache.incr('bulk-send', f'{job_id}:failed', missing, timeout=BULK_SEND_TIMEOUT)
+    
+    return job_id
+
+
+def get_bulk_send_progress(job_id, user):
+    """
+    Avancement d'un envoi groupé : total, envoyées, échecs et terminé.
+    None si le suivi a expiré ou n'appartient pas à l'utilisateur.
+    """
+    from core import cache
+    
+    job = cache.get('bulk-send', job_id)
+    if job is None or job['user_id'] != user.id:
+        return None
+    
+    sent = cache.get('bulk-send', f'{job_id}:sent', 0)
+    failed = cache.get('bulk-send', f'{job_id}:failed', 0)
+    return {
+        'total': job['total'],
+        'sent': sent,
+        'failed': failed,
+        'done': sent + failed >= job['total'],
+    }
+
+
+def schedule_client_import(client_import):
+    """
+    Lance l'import de clients en arrière-plan, après le commit de l'import.
+    """
+    transaction.on_commit(lambda: dispatch.submit(import_clients_task, args=[client_import.id]))
+
+
+@shared_task(ignore_result=True, priority=6)
+def import_clients_task(import_id):
+    """
+    Tâche Celery : importe les clients d'un fichier CSV/JSON (voir core.importers).
+    """
+    from core.models import ClientImport
+    from core.importers import run_client_import
     
     try:
-        print(f"⚠️ [CELERY] Début envoi relance pour facture ID={invoice_id}")
-        
-        # Récupère la facture
-        invoice = Invoice.objects.get(id=invoice_id)
-        
-        # Calcule le nombre de jours de retard
-        days_overdue = (date.today() - invoice.due_date).days
-        
-        # Prépare l'email HTML
-        email_html = render_to_string('emails/reminder_email.html', {
-            'client_name': invoice.client.name,
-            'invoice_number': invoice.invoice_number,
-            'issue_date': invoice.issue_date.strftime('%d/%m/%Y'),
-            'due_date': invoice.due_date.strftime('%d/%m/%Y'),
-            'days_overdue': days_overdue,
-            'total': invoice.total,
-            'freelance_name': invoice.user.get_full_name() or invoice.user.username,
-            'freelance_email': invoice.user.email,
-        })
-        
-        # Crée l'email
-        subject = f'⚠️ Relance - Facture {invoice.invoice_number} en attente de paiement'
-        
-        email = EmailMessage(
-            subject=subject,
-            body=email_html,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[invoice.client.email],
-            reply_to=[invoice.user.email],
-        )
-        
-        email.content_subtype = 'html'
-        email.send(fail_silently=False)
-        
-        print(f"✅ [CELERY] Relance envoyée pour facture {invoice.invoice_number}")
-        
-        return f"Relance envoyée pour facture {invoice.invoice_number}"
-        
-    except Invoice.DoesNotExist:
-        print(f"❌ [CELERY] Facture {invoice_id} introuvable")
-        return f"Facture {invoice_id} introuvable"
-        
+        client_import = ClientImport.objects.select_related('user').get(id=import_id, status='pending')
+    except ClientImport.DoesNotExist:
+        return
+    
+    try:
+        run_client_import(client_import)
     except Exception as e:
-        print(f"❌ [CELERY] Erreur : {e}")
+        print(f"❌ [CELERY] Import {import_id} échoué : {e}")
         traceback.print_exc()
-        
-        # Réessaie jusqu'à 3 fois
-        raise self.retry(exc=e, countdown=60 * (2 ** self.request.retries))
\ No newline at end of file
+        ClientImport.objects.filter(id=import_id).update(status='failed', finished_at=timezone.now())
+
+
+
+WEBHOOK_COALESCE_DELAY = 2
+
+
+def schedule_webhook_delivery():
+    """
+    Lance l'envoi des webhooks en attente, après un court délai pour regrouper
+    les événements proches dans un même lot.
+    """
+    from core import cache
+    
+    if not cache.add('webhook-delivery-pending', 'all', True, timeout=WEBHOOK_COALESCE_DELAY):
+        return
+    
+    dispatch.submit(deliver_webhooks, countdown=WEBHOOK_COALESCE_DELAY)
+
+
+@shared_task(ignore_result=True, priority=4)
+def deliver_webhooks():
+    """
+    Tâche Celery (et beat toutes les minutes) : envoie les webhooks en attente,
+    y compris les nouvelles tentatives arrivées à échéance.
+    """
+    from core.webhooks import deliver_pending
+    
+    delivered = deliver_pending()
+    if delivered:
+        print(f"✅ [CELERY] {delivered} événement(s) webhook envoyé(s)")
+
+
+def schedule_email_outbox(outbox_ids):
+    """
+    Après le commit : envoie ces emails en arrière-plan, sauf si des workers
+    drain_email_outbox vident déjà la file (EMAIL_OUTBOX_WORKERS).
+    """
+    if settings.EMAIL_OUTBOX_WORKERS:
+        return
+    
+    dispatch.submit(drain_email_outbox, args=[outbox_ids])
+
+
+@shared_task(ignore_result=True, priority=2)
+def drain_email_outbox(outbox_ids=None):
+    """
+    Tâche Celery (et beat toutes les minutes) : vide la file d'envoi des
+    emails, y compris les nouvelles tentatives arrivées à échéance.
+    """
+    from core.models import EmailOutbox
+    from core.outbox import drain
+    from django.db.models import Min
+    
+    sent = drain(ids=outbox_ids)
+    if sent:
+        print(f"✅ [CELERY] {sent} email(s) envoyé(s)")
+    
+    # Emails encore en attente (quota atteint, nouvel essai) : on repasse à
+    # l'échéance, même sans beat (pool de threads local)
+    if outbox_ids:
+        next_attempt = EmailOutbox.objects.filter(id__in=outbox_ids, status='pending').aggregate(next=Min('next_attempt_at'))['next']
+        if next_attempt is not None:
+            countdown = max(1, (next_attempt - timezone.now()).total_seconds())
+            dispatch.submit(drain_email_outbox, args=[outbox_ids], countdown=countdown)
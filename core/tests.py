@@ -1,3 +1,1635 @@
-from django.test import TestCase
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import fakeredis
+import redis
+from datetime import date, timedelta
+from celery import shared_task
+from decimal import Decimal
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command, load_command_class
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from core import billing, cache as app_cache, dispatch, email_backend, email_templates, importers, links, outbox, pdf, preview, ratelimit, reconciliation, taskss, tracking, warmup, webhooks
+from core.decorators import rate_limited
+from core.forms import WebhookEndpointForm
+from core.models import ApiToken, Client, ClientImport, DeliveryStats, EmailOutbox, Invoice, InvoiceItem, InvoiceNumberSequence, StripeEvent, UserProfile, WebhookEndpoint, WebhookEvent
+from core.utils import build_invoice_email
 
-# Create your tests here.
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_URLS=False)
+class WebhookURLTests(TestCase):
+    """Les URLs de webhook ne peuvent pas viser le réseau du serveur"""
+
+    def test_internal_addresses_are_refused(self):
+        for url in [
+            'http://127.0.0.1:8000/', 'http://localhost/', 'http://10.0.0.5/', 'http://192.168.1.1/',
+            'http://169.254.169.254/latest/meta-data/', 'http://[::1]/', 'http://[::ffff:127.0.0.1]/',
+            'http://0.0.0.0/', 'http://100.64.0.1/',
+        ]:
+            with self.subTest(url=url), self.assertRaises(webhooks.UnsafeWebhookURL):
+                webhooks.check_url(url)
+
+    def test_public_address_is_pinned(self):
+        self.assertEqual(webhooks.check_url('https://8.8.8.8/hook'), '8.8.8.8')
+
+    def test_form_refuses_metadata_endpoint(self):
+        form = WebhookEndpointForm(data={'url': 'https://169.254.169.254/', 'events': ['invoice.paid']})
+        self.assertFalse(form.is_valid())
+        self.assertIn('url', form.errors)
+
+    def test_delivery_rechecks_the_address(self):
+        # URL enregistrée avant le contrôle (ou via l'admin) : l'envoi est refusé
+        user = User.objects.create_user('bob')
+        endpoint = WebhookEndpoint.objects.create(user=user, url='http://127.0.0.1:9/', events=['invoice.paid'], secret='s')
+        self.assertIn('Adresse interne', webhooks.post_batch(endpoint, []))
+
+
+@override_settings(ADMINS=[('FactureSnap', 'admin@example.com')])
+class StripeEventProcessingTests(TestCase):
+    """Chaque événement Stripe est validé seul ; un échec bloque la suite jusqu'au nouvel essai"""
+
+    def setUp(self):
+        self.events = [
+            StripeEvent.objects.create(
+                event_id=f'evt_{n}', event_type='customer.subscription.updated', customer_id='cus_1',
+                payload={'data': {'object': {'n': n}}}, stripe_created=timezone.now() + timedelta(seconds=n),
+            )
+            for n in range(3)
+        ]
+
+    def run_events(self, failing):
+        def handle(event_type, data_object):
+            if data_object['n'] in failing:
+                raise RuntimeError('boom')
+
+        with mock.patch('core.billing.handle_stripe_event', side_effect=handle), \
+                mock.patch('core.taskss.schedule_stripe_events') as schedule, \
+                self.captureOnCommitCallbacks(execute=True):
+            taskss.process_stripe_events('cus_1')
+        for event in self.events:
+            event.refresh_from_db()
+        return schedule
+
+    def test_failure_keeps_earlier_events_and_stops(self):
+        schedule = self.run_events(failing={1})
+
+        first, failed, last = self.events
+        self.assertIsNotNone(first.processed_at)
+        self.assertIsNone(failed.processed_at)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('boom', failed.last_error)
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        # Les suivants attendent, pour rester dans l'ordre
+        self.assertIsNone(last.processed_at)
+        self.assertEqual(last.attempts, 0)
+        schedule.assert_called_once_with('cus_1', countdown=taskss.STRIPE_RETRY_BASE)
+
+    def test_retry_waits_for_backoff(self):
+        self.run_events(failing={1})
+        self.run_events(failing=set())
+        self.assertIsNone(self.events[1].processed_at)
+
+        StripeEvent.objects.filter(pk=self.events[1].pk).update(next_attempt_at=timezone.now())
+        self.run_events(failing=set())
+        self.assertTrue(all(event.processed_at for event in self.events))
+
+    def test_dead_letter_after_max_attempts(self):
+        StripeEvent.objects.filter(pk=self.events[1].pk).update(attempts=taskss.STRIPE_EVENT_MAX_ATTEMPTS - 1)
+        self.run_events(failing={1})
+
+        first, failed, last = self.events
+        self.assertIsNotNone(failed.failed_at)
+        self.assertIsNone(failed.processed_at)
+        # La file du client repart
+        self.assertIsNotNone(last.processed_at)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('evt_1', mail.outbox[0].body)
+
+    def test_periodic_retry_picks_due_customers(self):
+        StripeEvent.objects.filter(pk=self.events[0].pk).update(processed_at=timezone.now())
+        StripeEvent.objects.create(
+            event_id='evt_later', event_type='invoice.paid', customer_id='cus_2', payload={},
+            stripe_created=timezone.now(), next_attempt_at=timezone.now() + timedelta(hours=1),
+        )
+        with mock.patch('core.taskss.schedule_stripe_events') as schedule:
+            taskss.retry_stripe_events()
+        schedule.assert_called_once_with('cus_1')
+
+
+def make_invoice(user, invoice_number='F-2026-001', status='sent'):
+    """Facture envoyée à un client ACME, sans lignes"""
+    client = Client.objects.create(
+        user=user, name='ACME', email='compta@acme.fr',
+        address='1 rue de la Paix', postal_code='75002', city='Paris',
+    )
+    return Invoice.objects.create(
+        user=user, client=client, invoice_number=invoice_number,
+        status=status, due_date=date.today() + timedelta(days=30), tax_rate=Decimal('20.00'),
+    )
+
+
+@override_settings(EMAIL_TRACKING=False)
+class InvoiceRenderQueryTests(TestCase):
+    """
+    Les rendus d'une facture (page de détail, PDF, email) font un nombre de
+    requêtes fixe, quel que soit le nombre de lignes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.invoice = make_invoice(self.user)
+        self.add_items(3)
+        self.client.force_login(self.user)
+
+    def add_items(self, count):
+        for n in range(count):
+            InvoiceItem.objects.create(invoice=self.invoice, description=f'Prestation {n}', quantity=1, unit_price=100)
+
+    def get(self, path):
+        return self.client.get(path, HTTP_HOST='localhost')
+
+    def assert_constant_queries(self, render, expected):
+        # Même nombre de requêtes avec 3 lignes qu'avec 13
+        for _ in range(2):
+            cache.clear()
+            with self.assertNumQueries(expected):
+                render()
+            self.add_items(10)
+
+    def test_detail_page(self):
+        # session, utilisateur, accès, facture + client + profil, lignes
+        def render():
+            self.assertEqual(self.get(f'/app/invoice/{self.invoice.pk}/').status_code, 200)
+        self.assert_constant_queries(render, 5)
+
+    def test_pdf(self):
+        # session, utilisateur, accès, version (ETag), facture + client + profil, lignes
+        def render():
+            self.assertEqual(self.get(f'/app/invoice/{self.invoice.pk}/pdf/').status_code, 200)
+        with mock.patch('core.pdf.html_to_pdf', return_value=b'%PDF-1.7') as html_to_pdf:
+            self.assert_constant_queries(render, 6)
+        self.assertEqual(html_to_pdf.call_count, 2)
+
+    def test_invoice_email(self):
+        # facture + client + profil, lignes
+        def render():
+            email, pdf_file = build_invoice_email(Invoice(pk=self.invoice.pk))
+            self.assertEqual(email.to, ['compta@acme.fr'])
+        with mock.patch('core.pdf.html_to_pdf', return_value=b'%PDF-1.7'):
+            self.assert_constant_queries(render, 2)
+
+
+class StripeStub:
+    """
+    Remplace le module stripe renvoyé par core.billing.get_stripe() :
+    aucun appel réseau, et chaque appel reste consultable.
+    """
+
+    class SignatureVerificationError(Exception):
+        pass
+
+    def __init__(self, event=None):
+        self.event = event
+        self.error = mock.Mock(SignatureVerificationError=self.SignatureVerificationError)
+        self.Webhook = mock.Mock()
+        self.Webhook.construct_event.side_effect = self.construct_event
+        self.Subscription = mock.Mock()
+        self.checkout = mock.Mock()
+
+    def construct_event(self, payload, sig_header, secret):
+        if sig_header != 'valid':
+            raise self.SignatureVerificationError('bad signature')
+        return self.event
+
+
+class StripeBillingTests(TestCase):
+    """Webhooks et abonnement, avec Stripe remplacé au niveau de core.billing.get_stripe()"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('carol', 'carol@example.com', 'secret')
+        self.client.force_login(self.user)
+
+    def stripe_event(self, event_id, event_type, data_object):
+        return {
+            'id': event_id, 'type': event_type, 'created': int(timezone.now().timestamp()),
+            'data': {'object': data_object},
+        }
+
+    def post_webhook(self, event, signature='valid'):
+        stub = StripeStub(event)
+        with mock.patch('core.billing.get_stripe', return_value=stub), \
+                mock.patch('core.views.schedule_stripe_events') as schedule, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/stripe/webhook/', data=json.dumps(event), content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=signature, HTTP_HOST='localhost',
+            )
+        return response, schedule
+
+    def test_bad_signature_is_rejected(self):
+        event = self.stripe_event('evt_bad', 'invoice.paid', {'customer': 'cus_1'})
+        response, schedule = self.post_webhook(event, signature='forged')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+        schedule.assert_not_called()
+
+    def test_webhook_is_recorded_once_then_applied_locally(self):
+        checkout = self.stripe_event('evt_checkout', 'checkout.session.completed', {
+            'customer': 'cus_42', 'subscription': 'sub_42', 'metadata': {'user_id': str(self.user.pk)},
+        })
+        response, schedule = self.post_webhook(checkout)
+        self.assertEqual(response.status_code, 200)
+        schedule.assert_called_once_with('cus_42')
+
+        # Renvoi par Stripe : ignoré
+        response, schedule = self.post_webhook(checkout)
+        self.assertEqual(response.status_code, 200)
+        schedule.assert_not_called()
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+        period_end = int((timezone.now() + timedelta(days=30)).timestamp())
+        self.post_webhook(self.stripe_event('evt_update', 'customer.subscription.updated', {
+            'id': 'sub_42', 'customer': 'cus_42', 'status': 'past_due', 'current_period_end': period_end,
+        }))
+
+        # Le worker applique les événements sans appeler Stripe
+        with mock.patch('core.billing.get_stripe') as get_stripe:
+            taskss.process_stripe_events('cus_42')
+        get_stripe.assert_not_called()
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertTrue(profile.is_premium)
+        self.assertEqual(profile.stripe_subscription_id, 'sub_42')
+        self.assertEqual(profile.subscription_status, 'past_due')
+        self.assertEqual(int(profile.subscription_current_period_end.timestamp()), period_end)
+
+    def test_payment_success_reads_local_state(self):
+        UserProfile.objects.filter(user=self.user).update(is_premium=True, subscription_status='active')
+        with mock.patch('core.billing.get_stripe') as get_stripe:
+            response = self.client.get('/app/payment-success/?session_id=cs_test', HTTP_HOST='localhost')
+        get_stripe.assert_not_called()
+        self.assertTrue(response.context['is_active'])
+
+    def test_cancel_subscription_calls_stripe(self):
+        UserProfile.objects.filter(user=self.user).update(
+            is_premium=True, subscription_status='active', stripe_subscription_id='sub_7',
+        )
+        stub = StripeStub()
+        with mock.patch('core.billing.get_stripe', return_value=stub):
+            self.client.get('/app/cancel-subscription/', HTTP_HOST='localhost')
+        stub.Subscription.delete.assert_called_once_with('sub_7')
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertFalse(profile.is_premium)
+        self.assertEqual(profile.stripe_subscription_id, '')
+
+    def test_renewal_clears_cached_entitlement(self):
+        UserProfile.objects.filter(user=self.user).update(
+            stripe_customer_id='cus_9', is_premium=False, subscription_status='past_due',
+        )
+        app_cache.set('entitlement', self.user.pk, False)
+        billing.handle_payment_succeeded({'customer': 'cus_9'})
+        self.assertIsNone(app_cache.get('entitlement', self.user.pk))
+        self.assertTrue(UserProfile.objects.get(user=self.user).is_premium)
+
+    def test_stripe_identifiers_are_unique_when_set(self):
+        other = User.objects.create_user('dave')
+        # Les identifiants vides ne sont pas concernés
+        UserProfile.objects.filter(user__in=[self.user, other]).update(stripe_customer_id='')
+        UserProfile.objects.filter(user=self.user).update(stripe_customer_id='cus_1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserProfile.objects.filter(user=other).update(stripe_customer_id='cus_1')
+
+
+class ImportTimeTests(SimpleTestCase):
+    """
+    Démarrage d'un worker web (URLconf, vues, tâches), mesuré avec
+    python -X importtime dans un process neuf.
+    """
+
+    # Les dépendances lourdes sont chargées au premier usage (core.pdf, core.billing)
+    LAZY_MODULES = ('weasyprint', 'stripe')
+    # Environ 0,5 s sur un poste de dev : la marge absorbe les machines de CI lentes
+    IMPORT_TIME_BUDGET_MS = 1500
+
+    def import_times(self):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import django; django.setup(); import config.urls, core.views, core.taskss'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'},
+            capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        # "import time: self [us] | cumulative | imported package"
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, _, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(self_us)
+        return times
+
+    def test_web_startup_budget(self):
+        times = self.import_times()
+
+        for module in self.LAZY_MODULES:
+            with self.subTest(module=module):
+                self.assertFalse(module in times, f'{module} importé au démarrage')
+
+        total_ms = sum(times.values()) / 1000
+        self.assertLess(total_ms, self.IMPORT_TIME_BUDGET_MS, f'{total_ms:.0f} ms d\'imports au démarrage')
+
+
+FAKE_REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://fake-redis:6379/0',
+        'KEY_PREFIX': 'facturesnap',
+        'VERSION': 1,
+        'OPTIONS': {'connection_class': fakeredis.FakeConnection},
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'facturesnap-local-tests',
+        'KEY_PREFIX': 'facturesnap',
+        'VERSION': 1,
+    },
+}
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES)
+class SharedCacheTests(TestCase):
+    """core.cache et les limites de débit, sur un Redis simulé par fakeredis"""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['local'].clear()
+
+    def redis_keys(self):
+        return {key.decode() for key in caches['default']._cache.get_client().keys('*')}
+
+    def test_keys_are_namespaced_and_versioned(self):
+        app_cache.set('stats', 7, {'total': 3})
+        self.assertEqual(self.redis_keys(), {'facturesnap:1:stats:7'})
+        self.assertEqual(app_cache.get('stats', 7), {'total': 3})
+
+    def test_get_or_set_computes_once(self):
+        compute = mock.Mock(return_value=b'%PDF')
+        for _ in range(3):
+            self.assertEqual(app_cache.get_or_set('pdf', 'abc', compute), b'%PDF')
+        compute.assert_called_once()
+
+    def test_falls_back_to_local_cache_when_redis_is_down(self):
+        with mock.patch.object(caches['default'], 'get', side_effect=redis.ConnectionError('down')), \
+                mock.patch.object(caches['default'], 'set', side_effect=redis.ConnectionError('down')):
+            app_cache.set('entitlement', 1, True)
+            self.assertTrue(app_cache.get('entitlement', 1))
+        self.assertTrue(caches['local'].get('entitlement:1'))
+        self.assertEqual(self.redis_keys(), set())
+
+    def test_rate_limit_is_shared_and_per_user(self):
+        per_minute, burst = ratelimit.RATE_LIMITS['export']
+        waits = [ratelimit.retry_after(1, 'export') for _ in range(burst + 1)]
+        self.assertEqual(waits[:burst], [0] * burst)
+        self.assertGreater(waits[-1], 0)
+        self.assertLessEqual(waits[-1], 60 / per_minute)
+        # Le compteur est dans Redis : un autre worker voit le même seau
+        self.assertIn('facturesnap:1:rate-limit:export:1', self.redis_keys())
+        # Les autres utilisateurs ne sont pas concernés
+        self.assertEqual(ratelimit.retry_after(2, 'export'), 0)
+
+    def test_rate_limited_view_answers_429(self):
+        view = rate_limited('export')(lambda request: HttpResponse('ok'))
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user('erin')
+        statuses = [view(request).status_code for _ in range(ratelimit.RATE_LIMITS['export'][1] + 1)]
+        self.assertEqual(statuses[-2:], [200, 429])
+
+    def test_sessions_are_cached(self):
+        user = User.objects.create_user('frank')
+        self.client.force_login(user)
+        session_key = self.client.session.session_key
+        self.assertIn(f'facturesnap:1:django.contrib.sessions.cached_db{session_key}', self.redis_keys())
+
+
+class PdfArchiveTests(TestCase):
+    """Une facture n'est archivée qu'une fois, même par deux process en même temps"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.media_root = media_root
+        self.invoice = make_invoice(User.objects.create_user('grace'))
+
+    def archived_files(self):
+        return [name for _, _, files in os.walk(self.media_root) for name in files]
+
+    def test_concurrent_archive_writes_once(self):
+        # Deux process ont chargé la facture avant tout archivage
+        first = Invoice.objects.get(pk=self.invoice.pk)
+        second = Invoice.objects.get(pk=self.invoice.pk)
+
+        self.assertTrue(pdf.archive_invoice_pdf(first, b'%PDF first'))
+        self.assertFalse(pdf.archive_invoice_pdf(second, b'%PDF second'))
+
+        self.assertEqual(len(self.archived_files()), 1)
+        self.assertEqual(second.pdf_archive.name, first.pdf_archive.name)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_sha256, hashlib.sha256(b'%PDF first').hexdigest())
+        with self.invoice.pdf_archive.open('rb') as archived:
+            self.assertEqual(archived.read(), b'%PDF first')
+
+    def test_failed_write_releases_the_claim(self):
+        storage = Invoice.pdf_archive.field.storage
+        with mock.patch.object(storage, 'save', side_effect=OSError('disk full')), self.assertRaises(OSError):
+            pdf.archive_invoice_pdf(Invoice.objects.get(pk=self.invoice.pk), b'%PDF')
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_archive.name, '')
+        self.assertTrue(pdf.archive_invoice_pdf(self.invoice, b'%PDF'))
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES, TRUSTED_PROXY_COUNT=1)
+class PublicInvoicePdfTests(TestCase):
+    """Le lien public du PDF est limité par adresse IP"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.invoice = make_invoice(User.objects.create_user('heidi'))
+        self.path = links.get_invoice_url(self.invoice).removeprefix(settings.SITE_URL)
+        self.enterContext(mock.patch('core.pdf.archive_invoice_pdf'))
+        self.enterContext(mock.patch('core.pdf.get_invoice_pdf', return_value=b'%PDF'))
+
+    def get(self, forwarded_for):
+        return self.client.get(self.path, HTTP_HOST='localhost', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    def test_rate_limited_per_ip(self):
+        per_minute, burst = ratelimit.RATE_LIMITS['public-pdf']
+        statuses = [self.get('203.0.113.7').status_code for _ in range(burst + 1)]
+        self.assertEqual(statuses[:burst], [200] * burst)
+        self.assertEqual(statuses[-1], 429)
+        # Un autre visiteur n'est pas bloqué
+        self.assertEqual(self.get('198.51.100.1').status_code, 200)
+        # L'adresse ajoutée par le client lui-même est ignorée
+        self.assertEqual(self.get('198.51.100.1, 203.0.113.7').status_code, 429)
+
+
+class InvoiceImportTests(TestCase):
+    """Import de factures par lots"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('ivan')
+        self.invoice = make_invoice(self.user)
+        self.client_email = self.invoice.client.email
+
+    def add_invoice(self, invoice_number):
+        Invoice.objects.create(user=self.user, client=self.invoice.client, invoice_number=invoice_number,
+                               due_date=self.invoice.due_date, tax_rate=Decimal('20.00'))
+
+    def records(self, count):
+        return [
+            {'client_email': self.client_email, 'due_date': date.today().isoformat(),
+             'items': [{'description': 'Audit', 'quantity': '1', 'unit_price': '100'}]}
+            for _ in range(count)
+        ]
+
+    def test_failed_batch_rolls_back_the_number_sequence(self):
+        with mock.patch.object(InvoiceItem.objects, 'bulk_create', side_effect=IntegrityError('boom')), \
+                self.assertRaises(IntegrityError):
+            importers.import_invoices(self.user, self.records(3))
+
+        self.assertFalse(InvoiceNumberSequence.objects.filter(user=self.user).exists())
+        self.assertEqual(Invoice.objects.filter(user=self.user).count(), 1)
+
+        # Le lot suivant reprend au premier numéro : pas de trou
+        result = importers.import_invoices(self.user, self.records(2))
+        year, user_id = date.today().year, self.user.id
+        self.assertEqual(result['created'], [f'INV-{year}-{user_id}-0001', f'INV-{year}-{user_id}-0002'])
+
+
+    def test_allocated_numbers_skip_existing_invoices(self):
+        year, user_id = date.today().year, self.user.id
+        # Numéro du compteur saisi à la main
+        self.add_invoice(f'INV-{year}-{user_id}-0002')
+        records = self.records(3)
+        # ... et un autre fourni dans le même fichier
+        records.append({**records[0], 'invoice_number': f'INV-{year}-{user_id}-0004'})
+
+        result = importers.import_invoices(self.user, records)
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['created'], [
+            f'INV-{year}-{user_id}-0001', f'INV-{year}-{user_id}-0003',
+            f'INV-{year}-{user_id}-0005', f'INV-{year}-{user_id}-0004',
+        ])
+
+    def test_number_taken_meanwhile_is_reported_per_record(self):
+        records = self.records(2)
+        records[0]['invoice_number'] = 'F-RACE'
+        allocate = InvoiceNumberSequence.allocate
+
+        def allocate_after_concurrent_insert(*args):
+            # Facture créée ailleurs après la vérification des numéros fournis
+            self.add_invoice('F-RACE')
+            return allocate(*args)
+
+        with mock.patch.object(InvoiceNumberSequence, 'allocate', side_effect=allocate_after_concurrent_insert):
+            result = importers.import_invoices(self.user, records)
+
+        year, user_id = date.today().year, self.user.id
+        self.assertEqual(result['created'], [f'INV-{year}-{user_id}-0001'])
+        self.assertEqual(result['errors'], [
+            {'index': 0, 'invoice_number': 'F-RACE', 'error': 'Ce numéro de facture existe déjà.'},
+        ])
+        self.assertEqual(InvoiceItem.objects.filter(invoice__invoice_number=f'INV-{year}-{user_id}-0001').count(), 1)
+
+class BenchmarkCommandTests(SimpleTestCase):
+    """Les commandes de mesure refusent de tourner hors DEBUG sans --i-know"""
+
+    COMMANDS = ['benchmark_fairness', 'benchmark_reconciliation', 'benchmark_smtp', 'queue_load_test', 'webhook_stub']
+
+    def test_refused_without_debug(self):
+        for name in self.COMMANDS:
+            with self.subTest(command=name), self.assertRaisesMessage(CommandError, '--i-know'):
+                call_command(name)
+
+    def test_allowed_with_i_know(self):
+        for name in self.COMMANDS:
+            command = load_command_class('core', name)
+            with self.subTest(command=name), mock.patch.object(type(command), 'handle', return_value=None) as handle:
+                call_command(command, i_know=True)
+                handle.assert_called_once()
+
+
+class WarmUpTests(SimpleTestCase):
+    """Le préchauffage est fait au démarrage des process web et Celery, pas dans AppConfig.ready()"""
+
+    @override_settings(TEMPLATE_WARMUP=True)
+    def test_celery_worker_warms_up(self):
+        from config.celery import warm_up_templates
+        with mock.patch('core.warmup.warm_up') as warm_up:
+            warm_up_templates()
+        warm_up.assert_called_once()
+
+    @override_settings(TEMPLATE_WARMUP=False)
+    def test_disabled_by_setting(self):
+        with mock.patch('core.warmup.warm_up') as warm_up:
+            warmup.warm_up_if_enabled()
+        warm_up.assert_not_called()
+
+    def test_management_commands_skip_warm_up(self):
+        result = subprocess.run(
+            [sys.executable, '-c',
+             'import django; from unittest import mock; '
+             'patch = mock.patch("core.warmup.warm_up", side_effect=SystemExit("warm_up")); patch.start(); '
+             'django.setup()'],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings', 'TEMPLATE_WARMUP': 'True'},
+            capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+
+class InvoicePreviewTests(TestCase):
+    """Miniatures de la liste des factures"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('judy', 'judy@example.com', 'secret')
+        self.invoice = make_invoice(self.user)
+        self.client.force_login(self.user)
+        self.thumb_url = f'/app/invoice/{self.invoice.pk}/preview/thumb.png'
+
+    def test_dashboard_lazy_loads_thumbnails(self):
+        response = self.client.get('/app/', HTTP_HOST='localhost')
+        self.assertContains(response, f'src="{self.thumb_url}" alt="" loading="lazy"')
+
+    def test_missing_thumbnail_is_scheduled_then_served(self):
+        with mock.patch('core.views.schedule_invoice_preview') as schedule:
+            response = self.client.get(self.thumb_url, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 404)
+        version = pdf.get_invoice_version(self.invoice.pk, self.user)[0]
+        schedule.assert_called_once_with(self.invoice.pk, version)
+
+        preview.store_previews(version, {'page': b'page', 'thumb': b'thumb'})
+        response = self.client.get(self.thumb_url, HTTP_HOST='localhost')
+        self.assertEqual(response.content, b'thumb')
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+
+class ApiTests(TestCase):
+    """API JSON v1 : authentification par jeton et modifications par lot"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('kate')
+        self.token, self.key = ApiToken.create_token(self.user, 'tests')
+
+    def api(self, method, path, data=None, key=None):
+        return self.client.generic(
+            method, f'/api/v1/{path}', json.dumps(data) if data is not None else '',
+            content_type='application/json', HTTP_HOST='localhost',
+            HTTP_AUTHORIZATION=f'Bearer {key or self.key}',
+        )
+
+    def create_client(self, email):
+        return Client.objects.create(user=self.user, name=email, email=email,
+                                     address='1 rue du Test', postal_code='75001', city='Paris')
+
+    def test_unknown_token_is_not_cached(self):
+        key = 'fs_later-created-token'
+        self.assertEqual(self.api('GET', 'clients/', key=key).status_code, 401)
+
+        ApiToken.objects.create(user=self.user, name='later', key_prefix=key[:10], key_hash=ApiToken.hash_key(key))
+        self.assertEqual(self.api('GET', 'clients/', key=key).status_code, 200)
+
+    def test_refused_tokens_are_rate_limited_per_ip(self):
+        per_minute, burst = ratelimit.RATE_LIMITS['api-auth']
+        statuses = [self.api('GET', 'clients/', key=f'fs_wrong-{n}').status_code for n in range(burst + 1)]
+        self.assertEqual(statuses[:burst], [401] * burst)
+        self.assertEqual(statuses[-1], 429)
+        # Un jeton valide passe toujours
+        self.assertEqual(self.api('GET', 'clients/').status_code, 200)
+
+    def test_clients_can_swap_emails_in_one_batch(self):
+        first, second = self.create_client('a@example.com'), self.create_client('b@example.com')
+        response = self.api('PATCH', 'clients/', {'clients': [
+            {'id': first.id, 'email': 'b@example.com'},
+            {'id': second.id, 'email': 'a@example.com'},
+        ]})
+        self.assertEqual(response.status_code, 200, response.content)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.email, second.email), ('b@example.com', 'a@example.com'))
+
+    def test_email_of_a_client_outside_the_batch_is_refused(self):
+        first, _ = self.create_client('a@example.com'), self.create_client('b@example.com')
+        response = self.api('PATCH', 'clients/', {'clients': [{'id': first.id, 'email': 'B@example.com'}]})
+        self.assertEqual(response.status_code, 400)
+        first.refresh_from_db()
+        self.assertEqual(first.email, 'a@example.com')
+
+
+    def test_created_invoice_skips_a_number_already_used(self):
+        year, user_id = date.today().year, self.user.id
+        make_invoice(self.user, invoice_number=f'INV-{year}-{user_id}-0001')
+        response = self.api('POST', 'invoices/', {'invoices': [{
+            'client_email': 'compta@acme.fr', 'due_date': date.today().isoformat(),
+            'items': [{'description': 'Audit', 'quantity': '1', 'unit_price': '100'}],
+        }]})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([invoice['invoice_number'] for invoice in response.json()['results']],
+                         [f'INV-{year}-{user_id}-0002'])
+
+class ClientImportTests(TestCase):
+    """Import de clients en arrière-plan"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.user = User.objects.create_user('leo')
+
+    def run_import(self, rows, created_meanwhile=()):
+        lines = ['nom,email,adresse,code postal,ville'] + [f'{name},{email},1 rue du Test,75001,Paris' for name, email in rows]
+        client_import = ClientImport.objects.create(
+            user=self.user, file=SimpleUploadedFile('clients.csv', '\n'.join(lines).encode()),
+        )
+
+        iter_rows = importers.iter_rows
+
+        def rows_with_concurrent_clients(client_import):
+            # Clients créés à la main une fois l'import lancé
+            rows, first_line = iter_rows(client_import)
+            for email in created_meanwhile:
+                Client.objects.create(user=self.user, name='Manuel', email=email,
+                                      address='2 rue du Test', postal_code='75002', city='Paris')
+            return rows, first_line
+
+        with mock.patch('core.importers.iter_rows', side_effect=rows_with_concurrent_clients):
+            importers.run_client_import(client_import)
+        client_import.refresh_from_db()
+        return client_import
+
+    def test_counts_only_inserted_clients(self):
+        client_import = self.run_import(
+            [('ACME', 'compta@acme.fr'), ('Globex', 'hello@globex.fr'), ('Initech', 'ap@initech.fr')],
+            created_meanwhile=['HELLO@globex.fr'],
+        )
+
+        self.assertEqual(client_import.status, 'done')
+        self.assertEqual(client_import.total_rows, 3)
+        self.assertEqual(client_import.imported_count, 2)
+        self.assertEqual(client_import.error_count, 1)
+        self.assertEqual(client_import.errors_preview, [
+            {'line': 3, 'email': 'hello@globex.fr', 'error': 'Un client avec cet email existe déjà.'},
+        ])
+        self.assertEqual(Client.objects.filter(user=self.user).count(), 3)
+
+
+class ClientAutocompleteTests(TestCase):
+    """Autocomplétion des clients et champ client du formulaire de facture"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('mia')
+        self.client.force_login(self.user)
+
+    def create_client(self, name, email, user=None):
+        return Client.objects.create(user=user or self.user, name=name, email=email,
+                                     address='1 rue du Test', postal_code='75001', city='Paris')
+
+    def search(self, query=''):
+        response = self.client.get('/app/clients/autocomplete/', {'q': query}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return [result['name'] for result in response.json()['results']]
+
+    def test_matches_name_or_email_prefix(self):
+        self.create_client('Acme', 'compta@acme.fr')
+        self.create_client('Globex', 'acme-partner@globex.fr')
+        self.create_client('Initech', 'ap@initech.fr')
+        self.assertEqual(self.search('ac'), ['Acme', 'Globex'])
+        self.assertEqual(self.search('ACME'), ['Acme', 'Globex'])
+        self.assertEqual(self.search('tech'), [])
+
+    def test_other_accounts_are_not_searched(self):
+        self.create_client('Acme', 'compta@acme.fr', user=User.objects.create_user('noah'))
+        self.assertEqual(self.search('acme'), [])
+        self.assertEqual(self.search(), [])
+
+    def test_recent_clients_are_cached_until_a_client_changes(self):
+        self.create_client('Acme', 'compta@acme.fr')
+        self.assertEqual(self.search(), ['Acme'])
+        # Seul l'utilisateur est relu
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search(), ['Acme'])
+
+        self.create_client('Globex', 'hello@globex.fr')
+        self.assertEqual(self.search(), ['Globex', 'Acme'])
+
+    def post_invoice(self, client_value):
+        return self.client.post('/app/invoice/create/', {
+            'client': client_value, 'invoice_number': 'F-1', 'issue_date': date.today().isoformat(),
+            'due_date': (date.today() + timedelta(days=30)).isoformat(), 'tax_rate': '20.00',
+            'items-TOTAL_FORMS': '0', 'items-INITIAL_FORMS': '0',
+        }, HTTP_HOST='localhost')
+
+    def test_invalid_client_value_redisplays_the_form(self):
+        foreign = self.create_client('Acme', 'compta@acme.fr', user=User.objects.create_user('noah'))
+        for value in ['abc', str(foreign.pk)]:
+            with self.subTest(value=value):
+                response = self.post_invoice(value)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('client', response.context['form'].errors)
+                self.assertNotContains(response, 'Acme')
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_selected_client_is_the_only_option_rendered(self):
+        acme = self.create_client('Acme', 'compta@acme.fr')
+        self.create_client('Globex', 'hello@globex.fr')
+        response = self.post_invoice(f'{acme.pk}')
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.get(f'/app/invoice/{Invoice.objects.get().pk}/edit/', HTTP_HOST='localhost')
+        self.assertContains(response, f'<option value="{acme.pk}" selected>')
+        self.assertNotContains(response, 'Globex')
+
+
+class OverdueReminderTests(TestCase):
+    """Relances des factures en retard (tâche quotidienne)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('nina')
+        self.invoice = make_invoice(self.user)
+        Invoice.objects.filter(pk=self.invoice.pk).update(due_date=date.today() - timedelta(days=1))
+
+    def run_check(self):
+        with mock.patch('core.taskss.schedule_email_outbox'), self.captureOnCommitCallbacks(execute=True):
+            taskss.check_overdue_invoices()
+        return list(EmailOutbox.objects.filter(kind='reminder').values_list('invoice_id', flat=True))
+
+    def test_overdue_invoice_is_reminded_once_per_interval(self):
+        self.assertEqual(self.run_check(), [self.invoice.pk])
+        self.assertEqual(Invoice.objects.get(pk=self.invoice.pk).status, 'overdue')
+
+        # Le lendemain : pas de nouvelle relance
+        self.assertEqual(self.run_check(), [self.invoice.pk])
+
+        reminded_at = timezone.now() - timedelta(days=taskss.REMINDER_INTERVAL_DAYS)
+        Invoice.objects.filter(pk=self.invoice.pk).update(last_reminded_at=reminded_at)
+        self.assertEqual(self.run_check(), [self.invoice.pk, self.invoice.pk])
+
+    def test_paid_invoice_is_not_reminded(self):
+        Invoice.objects.filter(pk=self.invoice.pk).mark_as_paid()
+        self.assertEqual(self.run_check(), [])
+
+
+class OutboxTests(TestCase):
+    """File d'envoi des emails (core.outbox)"""
+
+    def setUp(self):
+        cache.clear()
+
+    def queue(self, username, count, age=0):
+        """`count` emails en attente depuis `age` secondes pour un nouvel utilisateur"""
+        user = User.objects.create_user(username)
+        invoice = make_invoice(user, invoice_number=f'F-{username}')
+        since = timezone.now() - timedelta(seconds=age)
+        EmailOutbox.objects.bulk_create(
+            [EmailOutbox(user=user, invoice=invoice, next_attempt_at=since) for _ in range(count)]
+        )
+        return user
+
+    def test_throttled_users_do_not_hold_their_place(self):
+        # Les deux plus anciens ont épuisé leur quota
+        throttled = [self.queue('olga', 20, age=300), self.queue('paul', 20, age=200)]
+        waiting = self.queue('quinn', 3, age=100)
+
+        def retry_after(user_id, action):
+            return 30 if user_id in [user.id for user in throttled] else 0
+
+        with mock.patch('core.ratelimit.retry_after', side_effect=retry_after):
+            rows = outbox.claim_batch(limit=2)
+            self.assertEqual({row.user_id for row in rows}, {waiting.id})
+            self.assertEqual(len(rows), 2)
+
+        # Leurs emails reviennent quand le quota le permet
+        for user in throttled:
+            next_attempts = EmailOutbox.objects.filter(user=user).values_list('next_attempt_at', flat=True)
+            self.assertTrue(all(at > timezone.now() + timedelta(seconds=25) for at in next_attempts))
+
+    def test_enqueued_emails_are_scheduled_on_commit_only(self):
+        user = self.queue('rita', 0)
+        invoice = Invoice.objects.get(user=user)
+        with mock.patch('core.taskss.schedule_email_outbox') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    outbox.enqueue('invoice', [invoice])
+                    raise RuntimeError('rollback')
+            schedule.assert_not_called()
+            self.assertFalse(EmailOutbox.objects.exists())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    outbox.enqueue('invoice', [invoice])
+            schedule.assert_called_once_with([EmailOutbox.objects.get().id])
+
+    def test_claimed_rows_are_leased(self):
+        self.queue('sam', 2)
+        rows = outbox.claim_batch()
+        self.assertEqual(len(rows), 2)
+        # Un autre worker ne reprend pas les emails réservés...
+        self.assertEqual(outbox.claim_batch(), [])
+
+        # ... sauf si l'envoi n'a pas abouti avant la fin du bail
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(len(outbox.claim_batch()), 2)
+
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_claim_skips_locked_rows(self):
+        self.queue('sam', 2)
+        with CaptureQueriesContext(connection) as queries:
+            outbox.claim_batch()
+        self.assertTrue(any('SKIP LOCKED' in query['sql'] for query in queries))
+
+    def test_batch_is_shared_in_turns(self):
+        bulk = self.queue('tom', 10, age=60)
+        single = self.queue('uma', 3)
+        rows = outbox.claim_batch(limit=6)
+        self.assertEqual([row.user_id for row in rows], [bulk.id, single.id] * 3)
+
+    def test_failures_back_off_then_are_dead_lettered(self):
+        self.queue('vic', 1)
+        row = EmailOutbox.objects.get()
+
+        before = timezone.now()
+        outbox.record_failed([(row, 'SMTPServerDisconnected: boom')])
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts, row.last_error), ('pending', 1, 'SMTPServerDisconnected: boom'))
+        delay = (row.next_attempt_at - before).total_seconds()
+        self.assertTrue(outbox.OUTBOX_BACKOFF_BASE <= delay <= outbox.OUTBOX_BACKOFF_BASE * 1.2)
+
+        self.assertGreater(outbox.backoff_delay(3), outbox.backoff_delay(2) * 1.5)
+        self.assertLessEqual(outbox.backoff_delay(50), outbox.OUTBOX_BACKOFF_MAX * 1.1)
+
+        for _ in range(outbox.OUTBOX_MAX_ATTEMPTS - 1):
+            outbox.record_failed([(row, 'SMTPServerDisconnected: boom')])
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('failed', outbox.OUTBOX_MAX_ATTEMPTS))
+        # Un email abandonné n'est plus réservé
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.claim_batch(), [])
+
+    @override_settings(EMAIL_TRACKING=False)
+    def test_drain_sends_and_records(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        user = self.queue('wes', 2)
+        with mock.patch('core.pdf.html_to_pdf', return_value=b'%PDF-1.7'):
+            self.assertEqual(outbox.drain(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ['compta@acme.fr'])
+        self.assertEqual(
+            list(EmailOutbox.objects.filter(user=user).values_list('status', 'attempts')),
+            [('sent', 1), ('sent', 1)],
+        )
+
+
+class RecordingSMTPHandler:
+    """Serveur SMTP local (aiosmtpd) : garde chaque message avec la connexion qui l'a livré"""
+
+    def __init__(self):
+        self.peers = []
+        self.noops = 0
+
+    async def handle_NOOP(self, server, session, envelope, arg):
+        self.noops += 1
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.peers.append(session.peer)
+        return '250 Message accepted for delivery'
+
+
+class PooledSMTPBackendTests(SimpleTestCase):
+    """Pool de connexions SMTP, contre un vrai serveur SMTP local"""
+
+    def setUp(self):
+        from aiosmtpd.controller import Controller
+
+        self.Controller = Controller
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.handler = RecordingSMTPHandler()
+        self.start_server()
+        self.addCleanup(self.stop_server)
+        self.addCleanup(self.clear_pool)
+
+    def start_server(self):
+        self.server = self.Controller(self.handler, hostname='127.0.0.1', port=self.port)
+        self.server.start()
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def clear_pool(self):
+        with email_backend._smtp_pool_lock:
+            for idle in email_backend._smtp_pool.values():
+                for connection, _ in idle:
+                    email_backend._quit_quietly(connection)
+            email_backend._smtp_pool.clear()
+
+    def send(self, count=1):
+        backend = get_connection(
+            'core.email_backend.PooledSMTPBackend', host='127.0.0.1', port=self.port,
+            username='', password='', use_tls=False, use_ssl=False, timeout=5,
+        )
+        messages = [EmailMessage('Facture', 'Bonjour', 'factures@example.com', ['client@example.com']) for _ in range(count)]
+        self.assertEqual(backend.send_messages(messages), count)
+
+    def test_connection_is_reused_across_calls(self):
+        self.send(2)
+        self.send()
+        self.assertEqual(len(self.handler.peers), 3)
+        self.assertEqual(len(set(self.handler.peers)), 1)
+        self.assertEqual(self.handler.noops, 0)
+
+    def test_idle_connection_is_checked_with_noop(self):
+        self.send()
+        with mock.patch.object(email_backend, 'SMTP_POOL_NOOP_AFTER', -1):
+            self.send()
+        self.assertEqual(self.handler.noops, 1)
+        self.assertEqual(len(set(self.handler.peers)), 1)
+
+    def test_connection_idle_too_long_is_discarded(self):
+        self.send()
+        with mock.patch.object(email_backend, 'SMTP_POOL_IDLE_TIMEOUT', -1):
+            self.send()
+        self.assertEqual(self.handler.noops, 0)
+        self.assertEqual(len(set(self.handler.peers)), 2)
+
+    def test_reconnects_after_server_restart(self):
+        self.send()
+        self.stop_server()
+        self.start_server()
+        # La connexion du pool est morte sans que le client le sache
+        self.send()
+        self.assertEqual(len(self.handler.peers), 2)
+        self.assertEqual(len(set(self.handler.peers)), 2)
+
+
+class WebhookStubHandler(BaseHTTPRequestHandler):
+    """Récepteur de webhooks local : garde chaque POST, répond avec server.status"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+        self.send_response(self.server.status)
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_URLS=True)
+class WebhookDeliveryTests(TestCase):
+    """Envoi des webhooks vers un récepteur HTTP local"""
+
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookStubHandler)
+        self.server.requests = []
+        self.server.status = 200
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        user = User.objects.create_user('xena')
+        self.invoice = make_invoice(user)
+        self.endpoint = WebhookEndpoint.objects.create(
+            user=user, url=f'http://127.0.0.1:{self.server.server_port}/hook',
+            events=['invoice.paid'], secret='whsec_test',
+        )
+
+    def add_events(self, count):
+        WebhookEvent.objects.bulk_create([
+            WebhookEvent(endpoint=self.endpoint, event_type='invoice.paid',
+                         payload={'id': self.invoice.id, 'n': n}, next_attempt_at=timezone.now())
+            for n in range(count)
+        ])
+
+    def make_due(self):
+        WebhookEvent.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+
+    def test_pending_events_are_batched_per_endpoint(self):
+        self.add_events(7)
+        with mock.patch.object(webhooks, 'WEBHOOK_BATCH_SIZE', 3):
+            self.assertEqual(webhooks.deliver_pending(), 7)
+
+        batches = [json.loads(body)['events'] for _, body in self.server.requests]
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual([event['data']['n'] for batch in batches for event in batch], list(range(7)))
+        self.assertFalse(WebhookEvent.objects.exclude(status='delivered').exists())
+
+    def test_batch_is_signed(self):
+        self.add_events(2)
+        webhooks.deliver_pending()
+
+        headers, body = self.server.requests[0]
+        timestamp = headers['X-FactureSnap-Timestamp']
+        expected = hmac.new(b'whsec_test', f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+        self.assertEqual(headers['X-FactureSnap-Signature'], f'sha256={expected}')
+        self.assertEqual(webhooks.sign('whsec_test', timestamp, body), expected)
+
+    def test_failures_back_off_then_give_up(self):
+        self.server.status = 500
+        self.add_events(1)
+
+        before = timezone.now()
+        self.assertEqual(webhooks.deliver_pending(), 0)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertTrue(event.last_error.startswith('HTTP 500'))
+        delay = (event.next_attempt_at - before).total_seconds()
+        self.assertTrue(webhooks.WEBHOOK_BACKOFF_BASE <= delay <= webhooks.WEBHOOK_BACKOFF_BASE * 1.2)
+
+        # Pas de nouvel essai avant l'échéance
+        webhooks.deliver_pending()
+        self.assertEqual(len(self.server.requests), 1)
+
+        for _ in range(webhooks.WEBHOOK_MAX_ATTEMPTS - 1):
+            self.make_due()
+            WebhookEndpoint.objects.update(circuit_open_until=None)
+            webhooks.deliver_pending()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', webhooks.WEBHOOK_MAX_ATTEMPTS))
+        self.assertEqual(len(self.server.requests), webhooks.WEBHOOK_MAX_ATTEMPTS)
+
+    def test_circuit_opens_after_repeated_failures_then_resets(self):
+        self.server.status = 503
+        self.add_events(1)
+        WebhookEndpoint.objects.update(consecutive_failures=webhooks.CIRCUIT_FAILURE_THRESHOLD - 1)
+
+        webhooks.deliver_pending()
+        self.endpoint.refresh_from_db()
+        self.assertEqual(self.endpoint.consecutive_failures, webhooks.CIRCUIT_FAILURE_THRESHOLD)
+        cooldown = (self.endpoint.circuit_open_until - timezone.now()).total_seconds()
+        self.assertAlmostEqual(cooldown, webhooks.CIRCUIT_COOLDOWN, delta=5)
+
+        # URL suspendue : rien n'est envoyé, même pour un événement dû
+        self.make_due()
+        webhooks.deliver_pending()
+        self.assertEqual(len(self.server.requests), 1)
+
+        # Fin de la suspension : un envoi réussi referme le disjoncteur
+        self.server.status = 200
+        WebhookEndpoint.objects.update(circuit_open_until=timezone.now())
+        self.assertEqual(webhooks.deliver_pending(), 1)
+        self.endpoint.refresh_from_db()
+        self.assertEqual((self.endpoint.consecutive_failures, self.endpoint.circuit_open_until), (0, None))
+
+
+# Tâches de test pour le pool local : chaque exécution est notée dans dispatch_runs
+dispatch_runs = []
+
+
+@shared_task(name='core.tests.record_thread')
+def record_thread(label):
+    dispatch_runs.append((label, threading.current_thread().name))
+
+
+@shared_task(name='core.tests.wait_for', ignore_result=True)
+def wait_for(event_id):
+    DispatchTests.events[event_id].wait(5)
+
+
+@shared_task(bind=True, name='core.tests.retry_twice', max_retries=3, default_retry_delay=0)
+def retry_twice(self):
+    dispatch_runs.append(('retry', self.request.retries))
+    if self.request.retries < 2:
+        raise self.retry()
+
+
+@override_settings(CELERY_BROKER_URL='', TASK_POOL_WORKERS=1, TASK_POOL_QUEUE=0)
+class DispatchTests(SimpleTestCase):
+    """Pool de threads local, utilisé quand aucun broker Celery n'est configuré"""
+
+    events = {}
+
+    def setUp(self):
+        dispatch_runs.clear()
+        # Pool neuf pour chaque test (un thread, aucune place en attente)
+        self.enterContext(mock.patch.multiple(dispatch, _executor=None, _slots=None))
+        self.addCleanup(lambda: dispatch._executor and dispatch._executor.shutdown(wait=True))
+
+    def wait_until(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail(f'Tâche non exécutée : {dispatch_runs}')
+
+    def occupy_pool(self):
+        """Bloque l'unique thread du pool jusqu'au nettoyage du test"""
+        event = self.events[self.id()] = threading.Event()
+        self.addCleanup(event.set)
+        self.assertTrue(dispatch.submit(wait_for, args=[self.id()]))
+
+    def test_task_runs_in_the_pool_without_broker(self):
+        self.assertTrue(dispatch.submit(record_thread, args=['pool']))
+        self.wait_until(lambda: dispatch_runs)
+        label, thread_name = dispatch_runs[0]
+        self.assertEqual(label, 'pool')
+        self.assertTrue(thread_name.startswith('task'))
+
+    def test_full_pool_runs_the_task_in_the_caller(self):
+        self.occupy_pool()
+        self.assertTrue(dispatch.submit(record_thread, args=['inline']))
+        # Exécutée avant le retour de submit(), dans le thread appelant
+        self.assertEqual(dispatch_runs, [('inline', threading.current_thread().name)])
+
+    def test_full_pool_drops_speculative_tasks(self):
+        self.occupy_pool()
+        self.assertFalse(dispatch.submit(record_thread, args=['speculative'], speculative=True))
+        self.assertEqual(dispatch_runs, [])
+
+    def test_retry_reschedules_with_the_next_retry_count(self):
+        dispatch.submit(retry_twice)
+        self.wait_until(lambda: len(dispatch_runs) == 3)
+        self.assertEqual(dispatch_runs, [('retry', 0), ('retry', 1), ('retry', 2)])
+
+
+class TrackingTests(TestCase):
+    """Compteurs d'ouvertures et de clics, accumulés en mémoire puis écrits par lots"""
+
+    def setUp(self):
+        self.enterContext(mock.patch.multiple(tracking, _buffer={}, _flusher=mock.Mock()))
+        self.user = User.objects.create_user('yann')
+        first = make_invoice(self.user)
+        self.invoices = [first, Invoice.objects.create(
+            user=self.user, client=first.client, invoice_number='F-2026-002',
+            due_date=first.due_date, tax_rate=Decimal('20.00'),
+        )]
+
+    def record(self, invoice, kind, at):
+        with mock.patch('time.time', return_value=at.timestamp()):
+            tracking.record(invoice.id, kind)
+
+    def stats(self, invoice):
+        return DeliveryStats.objects.get(invoice=invoice)
+
+    def test_each_invoice_keeps_its_own_dates(self):
+        start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        first, second = self.invoices
+        # Même nombre de visites : les compteurs sont écrits ensemble, pas les dates
+        self.record(first, 'open', start)
+        self.record(second, 'open', start + timedelta(minutes=10))
+        self.record(first, 'click', start + timedelta(minutes=1))
+        self.record(second, 'click', start + timedelta(minutes=20))
+        self.assertEqual(tracking.flush(), 2)
+
+        self.assertEqual(
+            [(s.opens, s.clicks, s.first_opened_at, s.last_opened_at, s.last_clicked_at) for s in map(self.stats, self.invoices)],
+            [(1, 1, start, start, start + timedelta(minutes=1)),
+             (1, 1, start + timedelta(minutes=10), start + timedelta(minutes=10), start + timedelta(minutes=20))],
+        )
+
+        # Écriture suivante : les compteurs s'ajoutent, la première ouverture reste
+        self.record(first, 'open', start + timedelta(minutes=30))
+        self.assertEqual(tracking.flush(), 1)
+        stats = self.stats(first)
+        self.assertEqual((stats.opens, stats.clicks), (2, 1))
+        self.assertEqual((stats.first_opened_at, stats.last_opened_at), (start, start + timedelta(minutes=30)))
+        self.assertEqual(self.stats(second).last_opened_at, start + timedelta(minutes=10))
+
+    def test_counters_are_kept_when_the_database_is_down(self):
+        start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        invoice = self.invoices[0]
+        self.record(invoice, 'open', start)
+        with mock.patch('core.tracking.write_stats', side_effect=OperationalError('database is down')):
+            self.assertEqual(tracking.flush(), 0)
+        self.assertFalse(DeliveryStats.objects.exists())
+
+        # Les visites arrivées entre-temps s'ajoutent au tampon remis en place
+        self.record(invoice, 'open', start + timedelta(minutes=5))
+        self.assertEqual(tracking.flush(), 1)
+        stats = self.stats(invoice)
+        self.assertEqual(stats.opens, 2)
+        self.assertEqual((stats.first_opened_at, stats.last_opened_at), (start, start + timedelta(minutes=5)))
+
+    def test_deleted_invoice_is_ignored(self):
+        invoice = self.invoices[1]
+        self.record(invoice, 'click', timezone.now())
+        invoice.delete()
+        self.assertEqual(tracking.flush(), 0)
+        self.assertFalse(DeliveryStats.objects.exists())
+        self.assertEqual(tracking._buffer, {})
+
+
+class InvoicePdfConditionalTests(TestCase):
+    """Le PDF d'une facture répond aux requêtes conditionnelles (ETag, Last-Modified)"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('zoe')
+        self.invoice = make_invoice(self.user, status='draft')
+        self.client.force_login(self.user)
+        self.html_to_pdf = self.enterContext(mock.patch('core.pdf.html_to_pdf', return_value=b'%PDF-1.7'))
+
+    def get(self, **headers):
+        return self.client.get(f'/app/invoice/{self.invoice.pk}/pdf/', HTTP_HOST='localhost', **headers)
+
+    def test_pdf_carries_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_unchanged_invoice_gets_304_without_rendering(self):
+        response = self.get()
+        self.html_to_pdf.reset_mock()
+
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.html_to_pdf.assert_not_called()
+
+    def test_edited_invoice_gets_a_new_pdf(self):
+        etag = self.get()['ETag']
+        Invoice.objects.filter(pk=self.invoice.pk).update(notes='Payable à 30 jours', updated_at=timezone.now() + timedelta(seconds=1))
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class PdfPrerenderTests(TestCase):
+    """Pré-rendu des PDF après modification : seul le dernier rendu programmé a lieu"""
+
+    def setUp(self):
+        cache.clear()
+        self.invoice = make_invoice(User.objects.create_user('adam'), status='draft')
+
+    def schedule(self):
+        with mock.patch('core.dispatch.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            taskss.schedule_pdf_prerender(self.invoice)
+        submit.assert_called_once()
+        self.assertTrue(submit.call_args.kwargs['speculative'])
+        return submit.call_args.kwargs['args'][1]
+
+    def prerender(self, token):
+        with mock.patch('core.pdf.get_invoice_pdf') as get_invoice_pdf:
+            taskss.prerender_invoice_pdf(self.invoice.pk, token)
+        return get_invoice_pdf.called
+
+    def test_only_the_latest_edit_is_rendered(self):
+        first = self.schedule()
+        second = self.schedule()
+        self.assertNotEqual(first, second)
+        self.assertFalse(self.prerender(first))
+        self.assertTrue(self.prerender(second))
+
+    def test_archived_invoice_is_not_rendered(self):
+        token = self.schedule()
+        # Envoyée entre-temps : le PDF archivé sera servi
+        Invoice.objects.filter(pk=self.invoice.pk).update(status='sent', pdf_archive='invoices/facture.pdf')
+        self.assertFalse(self.prerender(token))
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_URLS=True)
+class InvoiceBulkActionTests(TestCase):
+    """Actions groupées du dashboard : un UPDATE par action, limité aux factures de l'utilisateur"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('bea')
+        draft = make_invoice(self.user, invoice_number='F-1', status='draft')
+        self.invoices = {'draft': draft}
+        for status in ['sent', 'paid']:
+            self.invoices[status] = Invoice.objects.create(
+                user=self.user, client=draft.client, invoice_number=f'F-{status}', status=status,
+                due_date=draft.due_date, tax_rate=Decimal('20.00'),
+            )
+        self.foreign = make_invoice(User.objects.create_user('carl'), invoice_number='F-carl', status='draft')
+        WebhookEndpoint.objects.create(user=self.user, url='http://127.0.0.1:9/', events=['invoice.sent', 'invoice.paid'], secret='s')
+        self.client.force_login(self.user)
+
+    def post(self, action, invoices):
+        app_cache.set('stats', self.user.id, {'total': 0})
+        with mock.patch('core.taskss.schedule_webhook_delivery'), mock.patch('core.taskss.schedule_email_outbox'), \
+                self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/app/invoices/bulk/', {
+                'action': action, 'invoice_ids': [invoice.pk for invoice in invoices] + [self.foreign.pk],
+            }, HTTP_HOST='localhost')
+
+    def statuses(self):
+        return dict(Invoice.objects.values_list('invoice_number', 'status'))
+
+    def webhook_events(self):
+        return sorted(WebhookEvent.objects.values_list('event_type', 'payload__invoice_number'))
+
+    def assert_stats_cleared(self):
+        self.assertIsNone(app_cache.get('stats', self.user.id))
+
+    def test_mark_paid(self):
+        self.assertRedirects(self.post('mark_paid', self.invoices.values()), '/app/', fetch_redirect_response=False)
+        self.assertEqual(self.statuses(), {'F-1': 'paid', 'F-sent': 'paid', 'F-paid': 'paid', 'F-carl': 'draft'})
+        self.assertIsNotNone(Invoice.objects.get(invoice_number='F-1').paid_at)
+        # Facture déjà payée : pas de nouvel événement
+        self.assertEqual(self.webhook_events(), [('invoice.paid', 'F-1'), ('invoice.paid', 'F-sent')])
+        self.assert_stats_cleared()
+
+    def test_mark_sent(self):
+        self.post('mark_sent', self.invoices.values())
+        self.assertEqual(self.statuses(), {'F-1': 'sent', 'F-sent': 'sent', 'F-paid': 'paid', 'F-carl': 'draft'})
+        self.assertEqual(self.webhook_events(), [('invoice.sent', 'F-1'), ('invoice.sent', 'F-sent')])
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assert_stats_cleared()
+
+    def test_cancel(self):
+        self.post('cancel', self.invoices.values())
+        self.assertEqual(self.statuses(), {'F-1': 'cancelled', 'F-sent': 'cancelled', 'F-paid': 'paid', 'F-carl': 'draft'})
+        self.assertEqual(self.webhook_events(), [])
+        self.assert_stats_cleared()
+
+    def test_delete(self):
+        self.post('delete', [self.invoices['draft'], self.invoices['sent']])
+        self.assertEqual(self.statuses(), {'F-paid': 'paid', 'F-carl': 'draft'})
+        self.assert_stats_cleared()
+
+    def test_send_queues_emails_and_tracks_progress(self):
+        response = self.post('send', [self.invoices['draft'], self.invoices['sent']])
+        job_id = response.url.rstrip('/').rsplit('/', 1)[1]
+        self.assertEqual(response.url, f'/app/invoices/bulk/send/{job_id}/')
+
+        self.assertEqual(sorted(EmailOutbox.objects.values_list('invoice__invoice_number', 'job_id')),
+                         [('F-1', job_id), ('F-sent', job_id)])
+        self.assertEqual(self.statuses(), {'F-1': 'sent', 'F-sent': 'sent', 'F-paid': 'paid', 'F-carl': 'draft'})
+        self.assertEqual(self.webhook_events(), [('invoice.sent', 'F-1'), ('invoice.sent', 'F-sent')])
+        self.assert_stats_cleared()
+
+        progress = self.client.get(response.url, HTTP_HOST='localhost')
+        self.assertEqual(progress.context['progress'], {'total': 2, 'sent': 0, 'failed': 0, 'done': False})
+
+        # Le suivi n'est visible que par son auteur
+        self.client.force_login(User.objects.get(username='carl'))
+        self.assertEqual(self.client.get(response.url, HTTP_HOST='localhost').status_code, 404)
+
+
+class EmailTemplateTests(SimpleTestCase):
+    """Templates d'emails précompilés (CSS en ligne, version texte)"""
+
+    CONTEXT = {
+        'client_name': 'ACME', 'invoice_number': 'F-2026-001', 'issue_date': '01/10/2026', 'due_date': '31/10/2026',
+        'subtotal': '100.00', 'tax_rate': '20.00', 'tax_amount': '20.00', 'total': '120.00',
+        'notes': '', 'freelance_name': 'Léa Martin', 'freelance_email': 'lea@example.com',
+        'invoice_url': 'https://example.com/f.pdf', 'tracking_pixel_url': None,
+    }
+    INLINED = '<div class="invoice-number" style="font-size: 24px; font-weight: bold; color: #2563eb; margin-bottom: 10px">'
+
+    def setUp(self):
+        self.enterContext(mock.patch.dict(email_templates._compiled, clear=True))
+        self.base_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.templates_root = self.base_dir / 'templates'
+
+    def test_build_writes_inlined_html_and_text(self):
+        # Écrit dans <BASE_DIR>/templates/emails/compiled/
+        with override_settings(BASE_DIR=self.base_dir):
+            call_command('build_email_templates', stdout=io.StringIO())
+        compiled_dir = self.templates_root / email_templates.COMPILED_DIR
+
+        self.assertEqual(
+            sorted(path.name for path in compiled_dir.iterdir()),
+            ['invoice_email.html', 'invoice_email.txt', 'reminder_email.html', 'reminder_email.txt'],
+        )
+        html = (compiled_dir / 'invoice_email.html').read_text()
+        self.assertIn(self.INLINED, html)
+        self.assertNotIn('<style>', html)
+        self.assertIn('{{ invoice_number }}', html)
+        text = (compiled_dir / 'invoice_email.txt').read_text()
+        self.assertTrue(text.startswith('{% autoescape off %}'))
+
+        # Les envois lisent les fichiers compilés
+        (compiled_dir / 'invoice_email.html').write_text(html + '<!-- compilé -->')
+        templates = [{**settings.TEMPLATES[0], 'DIRS': [self.templates_root, *settings.TEMPLATES[0]['DIRS']]}]
+        with override_settings(TEMPLATES=templates):
+            html, text = email_templates.render_email('invoice_email', self.CONTEXT)
+        self.assertIn('<!-- compilé -->', html)
+        self.assertIn('Bonjour ACME,', text)
+        self.assertIn('Total TTC : 120.00€', text)
+        self.assertIn('Télécharger la facture (PDF) : https://example.com/f.pdf', text)
+        self.assertNotIn('<', text)
+
+    def test_missing_compiled_template_is_compiled_in_memory(self):
+        stdout = io.StringIO()
+        with mock.patch.object(email_templates, 'COMPILED_DIR', 'emails/not-built'), contextlib.redirect_stdout(stdout):
+            html, text = email_templates.render_email('reminder_email', self.CONTEXT)
+            # Une seule compilation par process
+            email_templates.render_email('reminder_email', self.CONTEXT)
+
+        self.assertEqual(stdout.getvalue().count('non précompilé'), 1)
+        self.assertIn('F-2026-001', html)
+        self.assertIn('style="', html)
+        self.assertIn('F-2026-001', text)
+
+
+class BankReconciliationTests(TestCase):
+    """Rapprochement d'un relevé bancaire avec les factures ouvertes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('dina')
+        self.clients = {}
+        self.invoices = {}
+
+    def add_invoice(self, number, client_name, total, status='sent', days=30, user=None):
+        user = user or self.user
+        client = self.clients.get((user.pk, client_name))
+        if client is None:
+            client = self.clients[(user.pk, client_name)] = Client.objects.create(
+                user=user, name=client_name, email=f'{len(self.clients)}@example.com',
+                address='1 rue du Test', postal_code='75001', city='Paris',
+            )
+        invoice = Invoice.objects.create(
+            user=user, client=client, invoice_number=number, status=status,
+            due_date=date.today() + timedelta(days=days), tax_rate=Decimal('20.00'),
+        )
+        Invoice.objects.filter(pk=invoice.pk).update(total=Decimal(total))
+        self.invoices[number] = invoice
+        return invoice
+
+    def statement(self, *lines):
+        rows = ['date;montant;libelle;nom'] + [f'2026-10-01;{amount};{reference};{name}' for amount, reference, name in lines]
+        return io.BytesIO('\n'.join(rows).encode())
+
+    def reconcile(self, *lines):
+        matches, unmatched = reconciliation.reconcile_statement(self.user, self.statement(*lines), 'releve.csv')
+        return [(match['invoice']['number'], match['confirmed'], match['rule']) for match in matches], unmatched
+
+    def test_reference_in_the_label(self):
+        self.add_invoice('INV-2026-0042', 'ACME SAS', '120.00')
+        self.add_invoice('INV-2026-0043', 'ACME SAS', '80.00')
+        matches, unmatched = self.reconcile(
+            ('120,00', 'VIR FACTURE INV 2026 0042', 'ACME'),
+            ('75,00', 'Paiement inv-2026-0043', 'ACME'),
+            ('-50,00', 'Frais INV-2026-0043', 'Banque'),
+        )
+        self.assertEqual(matches, [
+            ('INV-2026-0042', True, 'Numéro et montant'),
+            ('INV-2026-0043', False, 'Numéro, montant différent'),
+        ])
+        self.assertEqual(unmatched, [])
+
+    def test_amount_and_payer_name(self):
+        self.add_invoice('F-A', 'ACME SAS', '250.00')
+        self.add_invoice('F-G', 'Globex', '250.00')
+        matches, unmatched = self.reconcile(('250.00', 'Virement', 'SARL Acme'), ('999.00', 'Virement', 'Acme'))
+        self.assertEqual(matches, [('F-A', True, 'Montant et nom du client')])
+        self.assertEqual([line['amount'] for line in unmatched], [Decimal('999.00')])
+
+    def test_ambiguous_amounts_are_left_for_review(self):
+        self.add_invoice('F-1', 'ACME SAS', '99.00', days=10)
+        self.add_invoice('F-2', 'ACME SAS', '99.00', days=20)
+        self.add_invoice('F-3', 'Initech', '45.00', days=5)
+        self.add_invoice('F-4', 'Globex', '45.00', days=1)
+        matches, _ = self.reconcile(('99.00', 'Virement', 'ACME'), ('45.00', 'Virement', 'Inconnu'))
+        self.assertEqual(matches, [
+            ('F-1', False, 'Montant, 2 factures possibles'),
+            # Aucun nom ne ressemble : la plus ancienne échéance
+            ('F-4', False, 'Montant seul'),
+        ])
+
+    def test_only_open_invoices_of_the_user_are_matched(self):
+        self.add_invoice('F-DRAFT', 'ACME SAS', '10.00', status='draft')
+        self.add_invoice('F-PAID', 'ACME SAS', '10.00', status='paid')
+        self.add_invoice('F-OTHER', 'ACME SAS', '10.00', user=User.objects.create_user('eli'))
+        matches, unmatched = self.reconcile(('10.00', 'F-OTHER', 'ACME'))
+        self.assertEqual((matches, len(unmatched)), ([], 1))
+
+    def test_apply_matches(self):
+        first, second = self.add_invoice('F-1', 'ACME SAS', '10.00'), self.add_invoice('F-2', 'ACME SAS', '20.00', status='overdue')
+        paid = self.add_invoice('F-3', 'ACME SAS', '30.00', status='paid')
+        foreign = self.add_invoice('F-4', 'ACME SAS', '40.00', user=User.objects.create_user('eli'))
+        with self.captureOnCommitCallbacks(execute=True):
+            count = reconciliation.apply_matches(self.user, [first.id, second.id, first.id, paid.id, foreign.id])
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            dict(Invoice.objects.values_list('invoice_number', 'status')),
+            {'F-1': 'paid', 'F-2': 'paid', 'F-3': 'paid', 'F-4': 'sent'},
+        )
+
+    def test_review_is_paged_and_kept_on_the_server(self):
+        for n in range(3):
+            self.add_invoice(f'INV-2026-000{n}', 'ACME SAS', '100.00')
+        self.add_invoice('F-REVIEW', 'Globex', '55.00')
+        self.client.force_login(self.user)
+        self.enterContext(mock.patch.object(reconciliation, 'PROPOSAL_PAGE_SIZE', 2))
+
+        upload = SimpleUploadedFile('releve.csv', self.statement(
+            *[('100.00', f'INV-2026-000{n}', 'ACME') for n in range(3)], ('55.00', 'Virement', 'Inconnu'),
+        ).getvalue())
+        response = self.client.post('/app/invoices/reconciliation/', {'file': upload}, HTTP_HOST='localhost')
+        token = response.url.split('token=')[1]
+
+        page = self.client.get(response.url, HTTP_HOST='localhost')
+        self.assertEqual((page.context['page'], page.context['pages'], page.context['selected_count']), (1, 2, 3))
+        self.assertEqual([(row['number'], row['selected']) for row in page.context['matches']],
+                         [('INV-2026-0000', True), ('INV-2026-0001', True)])
+
+        # Page 1 : une facture décochée, puis page suivante
+        first = self.invoices['INV-2026-0000']
+        response = self.client.post('/app/invoices/reconciliation/', {
+            'token': token, 'page': '1', 'invoice_ids': [first.id], 'goto': '2',
+        }, HTTP_HOST='localhost')
+        page = self.client.get(response.url, HTTP_HOST='localhost')
+        self.assertEqual([(row['number'], row['selected']) for row in page.context['matches']],
+                         [('INV-2026-0002', True), ('F-REVIEW', False)])
+
+        # Un autre utilisateur ne peut pas utiliser le jeton
+        self.client.force_login(User.objects.create_user('eli'))
+        self.assertRedirects(self.client.get(response.url, HTTP_HOST='localhost'), '/app/invoices/reconciliation/',
+                             fetch_redirect_response=False)
+        self.client.force_login(self.user)
+
+        # Page 2 : la facture à vérifier est cochée, puis validation
+        review = self.invoices['F-REVIEW']
+        self.client.post('/app/invoices/reconciliation/', {
+            'token': token, 'page': '2', 'invoice_ids': [self.invoices['INV-2026-0002'].id, review.id], 'action': 'apply',
+        }, HTTP_HOST='localhost')
+        self.assertEqual(
+            sorted(Invoice.objects.filter(status='paid').values_list('invoice_number', flat=True)),
+            ['F-REVIEW', 'INV-2026-0000', 'INV-2026-0002'],
+        )
+        self.assertIsNone(reconciliation.get_proposal(token, self.user))
@@ -0,0 +1,185 @@
+"""
+Suivi des emails de facture : un pixel (ouverture) et un lien de
+redirection (clic) par facture. Une visite ne fait qu'incrémenter un
+compteur en mémoire, sans requête SQL ni accès au cache partagé : la
+réponse part aussitôt. Chaque process écrit ses compteurs dans
+DeliveryStats toutes les TRACKING_FLUSH_INTERVAL secondes, par lots (un
+UPDATE par groupe de factures ayant reçu le même nombre de visites, puis
+les dates de visite de chaque facture), et une dernière fois à son arrêt.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+import atexit
+import base64
+import threading
+import time
+import traceback
+
+
+TRACKING_FLUSH_INTERVAL = 10
+TRACKING_UPDATE_CHUNK = 500
+
+SALT = 'core.tracking'
+
+# GIF transparent de 1x1 pixel
+PIXEL = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+_buffer = {}
+_lock = threading.Lock()
+_flusher = None
+
+
+def make_token(invoice_id):
+    return signing.TimestampSigner(salt=SALT).sign(str(invoice_id))
+
+
+def read_token(token, max_age=None):
+    """Retourne l'ID de la facture, ou None si le jeton est invalide ou expiré"""
+    try:
+        return int(signing.TimestampSigner(salt=SALT).unsign(token, max_age=max_age))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def get_pixel_url(invoice):
+    return settings.SITE_URL + reverse('track_open', args=[make_token(invoice.pk)])
+
+
+def get_click_url(invoice):
+    """Lien de suivi qui redirige vers le PDF de la facture (links.get_invoice_url)"""
+    return settings.SITE_URL + reverse('track_click', args=[make_token(invoice.pk)])
+
+
+def track_invoice_url(invoice, invoice_url):
+    """Lien du PDF à mettre dans l'email : passe par le lien de suivi si le suivi est actif"""
+    if invoice_url and settings.EMAIL_TRACKING:
+        return get_click_url(invoice)
+    return invoice_url
+
+
+def record(invoice_id, kind):
+    """Compte une ouverture ('open') ou un clic ('click') ; aucune écriture en base ici"""
+    now = time.time()
+    with _lock:
+        hits = _buffer.get(invoice_id)
+        if hits is None:
+            hits = _buffer[invoice_id] = {'opens': 0, 'clicks': 0, 'first_open': None, 'last_open': None, 'last_click': None}
+        if kind == 'open':
+            hits['opens'] += 1
+            hits['first_open'] = hits['first_open'] or now
+            hits['last_open'] = now
+        else:
+            hits['clicks'] += 1
+            hits['last_click'] = now
+
+        if _flusher is None:
+            start_flusher()
+
+
+def start_flusher():
+    """Thread d'écriture du process, lancé à la première visite"""
+    global _flusher
+    _flusher = threading.Thread(target=flush_loop, name='tracking-flush', daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+
+
+def flush_loop():
+    while True:
+        time.sleep(TRACKING_FLUSH_INTERVAL)
+        flush()
+        # Thread dédié : sa connexion à la base n'est pas gardée entre deux écritures
+        connection.close()
+
+
+def flush():
+    """Écrit les compteurs accumulés ; retourne le nombre de factures mises à jour"""
+    global _buffer
+    with _lock:
+        buffer, _buffer = _buffer, {}
+    if not buffer:
+        return 0
+
+    try:
+        return write_stats(buffer)
+    except Exception as e:
+        # Base indisponible : les compteurs sont remis dans le tampon pour la prochaine écriture
+        print(f"❌ [TRACKING] Écriture des compteurs impossible : {e}")
+        traceback.print_exc()
+        with _lock:
+            for invoice_id, hits in buffer.items():
+                merge(_buffer.setdefault(invoice_id, {**hits, 'opens': 0, 'clicks': 0}), hits)
+        return 0
+
+
+def merge(into, hits):
+    into['opens'] += hits['opens']
+    into['clicks'] += hits['clicks']
+    into['first_open'] = min(filter(None, [into['first_open'], hits['first_open']]), default=None)
+    into['last_open'] = max(filter(None, [into['last_open'], hits['last_open']]), default=None)
+    into['last_click'] = max(filter(None, [into['last_click'], hits['last_click']]), default=None)
+
+
+def write_stats(buffer):
+    """
+    Ajoute les compteurs du tampon à DeliveryStats : une lecture, une
+    insertion groupée des lignes manquantes, un UPDATE par groupe de
+    factures ayant les mêmes nombres d'ouvertures et de clics, puis les
+    dates de chaque facture (un UPDATE ... CASE par tranche).
+    """
+    from .models import DeliveryStats, Invoice
+
+    # Jeton encore valide pour une facture supprimée depuis : ignoré
+    owners = dict(Invoice.objects.filter(id__in=list(buffer)).values_list('id', 'user_id'))
+
+    groups = defaultdict(list)
+    for invoice_id, hits in buffer.items():
+        if invoice_id in owners:
+            groups[(hits['opens'], hits['clicks'])].append(invoice_id)
+
+    with transaction.atomic():
+        DeliveryStats.objects.bulk_create(
+            [DeliveryStats(invoice_id=invoice_id, user_id=user_id) for invoice_id, user_id in owners.items()],
+            ignore_conflicts=True,
+        )
+
+        for (opens, clicks), ids in groups.items():
+            fields = {}
+            if opens:
+                fields['opens'] = F('opens') + opens
+            if clicks:
+                fields['clicks'] = F('clicks') + clicks
+            DeliveryStats.objects.filter(invoice_id__in=ids).update(**fields)
+
+        ids = list(owners)
+        for start in range(0, len(ids), TRACKING_UPDATE_CHUNK):
+            chunk = {invoice_id: buffer[invoice_id] for invoice_id in ids[start:start + TRACKING_UPDATE_CHUNK]}
+            opened = {invoice_id: hits for invoice_id, hits in chunk.items() if hits['opens']}
+            clicked = {invoice_id: hits for invoice_id, hits in chunk.items() if hits['clicks']}
+            fields = {}
+            if opened:
+                fields['first_opened_at'] = Coalesce('first_opened_at', per_invoice(opened, 'first_open', 'first_opened_at'))
+                fields['last_opened_at'] = per_invoice(opened, 'last_open', 'last_opened_at')
+            if clicked:
+                fields['last_clicked_at'] = per_invoice(clicked, 'last_click', 'last_clicked_at')
+            DeliveryStats.objects.filter(invoice_id__in=list(chunk)).update(**fields)
+
+    return len(owners)
+
+
+def per_invoice(hits_by_invoice, key, field):
+    """Valeur propre à chaque facture (CASE invoice_id WHEN ...), la valeur en base pour les autres"""
+    return Case(
+        *[When(invoice_id=invoice_id, then=as_datetime(hits[key])) for invoice_id, hits in hits_by_invoice.items()],
+        default=F(field), output_field=DateTimeField(),
+    )
+
+
+def as_datetime(timestamp):
+    return Value(datetime.fromtimestamp(timestamp, tz=dt_timezone.utc), output_field=DateTimeField())
@@ -11,19 +11,32 @@ urlpatterns = [
     path('invoice/<int:invoice_id>/', views.invoice_detail, name='invoice_detail'),
     path('invoice/<int:invoice_id>/edit/', views.invoice_edit, name='invoice_edit'),
     path('invoice/<int:invoice_id>/pdf/', views.generate_invoice_pdf, name='invoice_pdf'),
+    path('invoice/<int:invoice_id>/preview/<str:size>.png', views.invoice_preview, name='invoice_preview'),
     path('invoice/<int:invoice_id>/mark-paid/', views.invoice_mark_paid, name='invoice_mark_paid'),
     path('invoice/<int:invoice_id>/mark-sent/', views.invoice_mark_sent, name='invoice_mark_sent'),
     path('invoice/<int:invoice_id>/send-email/', views.invoice_send_email, name='invoice_send_email'),
     path('invoice/<int:invoice_id>/delete/', views.invoice_delete, name='invoice_delete'),
+    path('invoices/bulk/', views.invoice_bulk_action, name='invoice_bulk_action'),
+    path('invoices/import/', views.invoice_import, name='invoice_import'),
+    path('invoices/reconciliation/', views.bank_reconciliation, name='bank_reconciliation'),
+    path('invoices/bulk/send/<str:job_id>/', views.bulk_send_progress, name='bulk_send_progress'),
     
     # Clients
     path('clients/', views.client_list, name='client_list'),
     path('clients/create/', views.client_create, name='client_create'),
+    path('clients/autocomplete/', views.client_autocomplete, name='client_autocomplete'),
+    path('clients/import/', views.client_import, name='client_import'),
+    path('clients/import/<int:import_id>/', views.client_import_detail, name='client_import_detail'),
+    path('clients/import/<int:import_id>/report.csv', views.client_import_report, name='client_import_report'),
     path('clients/<int:client_id>/', views.client_detail, name='client_detail'),
     path('clients/<int:client_id>/edit/', views.client_edit, name='client_edit'),
     
     # Settings & Upgrade
     path('settings/', views.user_settings, name='settings'),
+    path('settings/api-tokens/', views.api_token_create, name='api_token_create'),
+    path('settings/api-tokens/<int:token_id>/delete/', views.api_token_delete, name='api_token_delete'),
+    path('settings/webhooks/', views.webhook_create, name='webhook_create'),
+    path('settings/webhooks/<int:endpoint_id>/delete/', views.webhook_delete, name='webhook_delete'),
     path('upgrade/', views.upgrade_to_premium, name='upgrade'),
     path('clients/<int:client_id>/delete/', views.client_delete, name='client_delete'),
     path('create-checkout-session/', views.create_checkout_session, name='create_checkout'),
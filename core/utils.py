@@ -1,73 +1,87 @@
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.core.mail import EmailMultiAlternatives
+from .email_templates import render_email
+from .pdf import get_sendable_pdf, archive_invoice_pdf
+from .links import get_invoice_url
 from .models import Invoice
+from .snapshot import take_snapshot
+from .tracking import track_invoice_url
 from django.conf import settings
-import traceback
 
-def send_invoice_email(invoice):
+def get_delivery_url(invoice):
     """
-    Envoie la facture par email au client avec le PDF en pièce jointe.
-    Envoi SYNCHRONE avec timeout pour éviter les blocages.
-    Retourne True si succès, False sinon.
+    Lien de téléchargement signé si l'émetteur a choisi l'envoi par lien,
+    None pour l'envoi en pièce jointe.
     """
-    try:
-        print(f"📧 Envoi email pour facture {invoice.invoice_number}")
-        
-        # Génère le PDF
-        html_string = render_to_string('invoices/invoice_pdf.html', {'invoice': invoice})
-        pdf_file = HTML(string=html_string).write_pdf()
-        
-        # Prépare l'email HTML
-        email_html = render_to_string('emails/invoice_email.html', {
-            'client_name': invoice.client.name,
-            'invoice_number': invoice.invoice_number,
-            'issue_date': invoice.issue_date.strftime('%d/%m/%Y'),
-            'due_date': invoice.due_date.strftime('%d/%m/%Y'),
-            'subtotal': invoice.subtotal,
-            'tax_rate': invoice.tax_rate,
-            'tax_amount': invoice.tax_amount,
-            'total': invoice.total,
-            'notes': invoice.notes,
-            'freelance_name': invoice.user.get_full_name() or invoice.user.username,
-            'freelance_email': invoice.user.email,
-        })
-        
-        # Crée l'email
-        subject = f'Facture {invoice.invoice_number} - {invoice.client.name}'
-        
-        # Crée une connexion avec timeout
-        from django.core.mail import get_connection
-        connection = get_connection(
-            timeout=30  # 30 secondes max
-        )
-        
-        email = EmailMessage(
-            subject=subject,
-            body=email_html,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[invoice.client.email],
-            reply_to=[invoice.user.email],
-            connection=connection
-        )
-        
-        email.content_subtype = 'html'
-        
-        # Attache le PDF
+    profile = getattr(invoice.user, 'profile', None)
+    if profile is not None and profile.invoice_delivery == 'link':
+        return get_invoice_url(invoice)
+    return None
+
+
+def build_invoice_email(invoice, connection=None):
+    """
+    Prépare l'email d'une facture. Retourne (email, pdf_file) ; pdf_file est
+    None en mode "lien" (rien à joindre).
+    """
+    snapshot = take_snapshot(invoice)
+    invoice = snapshot.invoice
+    
+    # Mode "lien" : pas de PDF à générer ni à joindre
+    invoice_url = get_delivery_url(invoice)
+    
+    # PDF archivé pour un renvoi, sinon PDF courant
+    pdf_file = None if invoice_url else get_sendable_pdf(invoice)
+    
+    # Prépare l'email HTML (template précompilé) et sa version texte
+    email_html, email_text = render_email('invoice_email', snapshot.email_context(
+        invoice_url=track_invoice_url(invoice, invoice_url)
+    ))
+    
+    email = EmailMultiAlternatives(
+        subject=f'Facture {invoice.invoice_number} - {snapshot.client.name}',
+        body=email_text,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[snapshot.client.email],
+        reply_to=[snapshot.user.email],
+        connection=connection
+    )
+    
+    email.attach_alternative(email_html, 'text/html')
+    
+    # Attache le PDF
+    if pdf_file is not None:
         email.attach(
             f'facture_{invoice.invoice_number}.pdf',
             pdf_file,
             'application/pdf'
         )
-        
-        # Envoie l'email
-        email.send(fail_silently=False)
-        
-        print(f"✅ Email envoyé avec succès pour facture {invoice.invoice_number}")
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Erreur lors de l'envoi de l'email : {e}")
-        traceback.print_exc()
-        return False
\ No newline at end of file
+    
+    return email, pdf_file
+
+
+def build_reminder_email(invoice, connection=None):
+    """Prépare l'email de relance d'une facture en retard"""
+    snapshot = take_snapshot(invoice)
+    
+    email_html, email_text = render_email('reminder_email', snapshot.email_context())
+    
+    email = EmailMultiAlternatives(
+        subject=f'⚠️ Relance - Facture {snapshot.invoice.invoice_number} en attente de paiement',
+        body=email_text,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[snapshot.client.email],
+        reply_to=[snapshot.user.email],
+        connection=connection
+    )
+    
+    email.attach_alternative(email_html, 'text/html')
+    return email
+
+
+def archive_sent_pdf(invoice, pdf_file):
+    """Conserve le PDF exactement tel qu'envoyé (ou le prépare en mode lien)"""
+    if pdf_file is not None:
+        archive_invoice_pdf(invoice, pdf_file)
+    else:
+        from .taskss import schedule_pdf_archive
+        schedule_pdf_archive(invoice)
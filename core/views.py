@@ -1,30 +1,50 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse,JsonResponse
+from django.http import HttpResponse,JsonResponse, Http404, FileResponse
 from django.contrib.auth.decorators import login_required
 from django.template.loader import render_to_string
 from django.contrib import messages
-from weasyprint import HTML
-from .models import Invoice, Client,UserProfile
-from django.db.models import Count, Q
+from .models import Invoice, Client,UserProfile, StripeEvent, ClientImport, ApiToken, WebhookEndpoint
+from django.db.models import Count, Q, Max, F
 from django.utils import timezone
-from .forms import InvoiceForm, InvoiceItemFormSet, ClientForm,UserForm, UserProfileForm
-from .utils import send_invoice_email
+from .forms import InvoiceForm, InvoiceItemFormSet, ClientForm,UserForm, UserProfileForm, ClientImportForm, WebhookEndpointForm, BankStatementForm
+from .taskss import schedule_stripe_events, schedule_pdf_prerender, schedule_invoice_preview, schedule_bulk_send, get_bulk_send_progress, schedule_client_import
+from . import billing, cache, links, outbox, pdf, preview, ratelimit, reconciliation, tracking, webhooks
+from .importers import import_invoices, iter_invoice_records
+from .http import ranged_file_response
+from .snapshot import invoice_queryset, take_snapshot
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.views import LoginView
 from .forms import SignUpForm, LoginForm
 from django.urls import reverse
-import stripe
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
 import json
-from core.decorators import admin_required
+import csv
+from itertools import islice
+from xml.etree.ElementTree import ParseError
+from core.decorators import admin_required, rate_limited
 from django.utils import timezone
-from datetime import timedelta
+from datetime import timedelta, datetime, timezone as dt_timezone
 from django.contrib.auth.models import User
+from django.db import transaction
 import os
-stripe.api_key = settings.STRIPE_SECRET_KEY
 from django.urls import reverse_lazy
 
+STATS_CACHE_TIMEOUT = 60 * 60
+
+
+def get_invoice_stats(user):
+    """Compte les factures de l'utilisateur par statut"""
+    return Invoice.objects.filter(user=user).aggregate(
+        total=Count('id'),
+        paid=Count('id', filter=Q(status='paid')),
+        sent=Count('id', filter=Q(status='sent')),
+        overdue=Count('id', filter=Q(status='overdue')),
+    )
+
+
 @login_required
 def dashboard(request):
     """Dashboard principal avec liste des factures"""
@@ -37,13 +57,8 @@ def dashboard(request):
     if status_filter:
         invoices = invoices.filter(status=status_filter)
     
-    # Calcul des stats
-    stats = {
-        'total': Invoice.objects.filter(user=request.user).count(),
-        'paid': Invoice.objects.filter(user=request.user, status='paid').count(),
-        'sent': Invoice.objects.filter(user=request.user, status='sent').count(),
-        'overdue': Invoice.objects.filter(user=request.user, status='overdue').count(),
-    }
+    # Calcul des stats (une seule requête, gardée en cache jusqu'à la prochaine modification)
+    stats = cache.get_or_set('stats', request.user.id, lambda: get_invoice_stats(request.user), timeout=STATS_CACHE_TIMEOUT)
     
     context = {
         'invoices': invoices,
@@ -53,26 +68,148 @@ def dashboard(request):
     return render(request, 'core/dashboard.html', context)
 
 
+def get_invoice_pdf_version(request, invoice_id):
+    """Version de la facture, calculée une fois par requête (ETag et Last-Modified)"""
+    if not hasattr(request, '_invoice_pdf_version'):
+        request._invoice_pdf_version = pdf.get_invoice_version(invoice_id, request.user)
+    return request._invoice_pdf_version
+
+
+def invoice_pdf_etag(request, invoice_id, **kwargs):
+    version = get_invoice_pdf_version(request, invoice_id)
+    return version[0] if version else None
+
+
+def invoice_pdf_last_modified(request, invoice_id, **kwargs):
+    version = get_invoice_pdf_version(request, invoice_id)
+    return version[1] if version else None
+
+
 @login_required
+@condition(etag_func=invoice_pdf_etag, last_modified_func=invoice_pdf_last_modified)
+@rate_limited('pdf')
 def generate_invoice_pdf(request, invoice_id):
-    """Génère un PDF pour une facture donnée"""
-    invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
+    """
+    Génère un PDF pour une facture donnée.
+    Si le navigateur a déjà la version à jour, @condition répond 304 sans rendu.
+    """
+    invoice = get_object_or_404(invoice_queryset(), id=invoice_id, user=request.user)
+    filename = f'facture_{invoice.invoice_number}.pdf'
+    
+    # Facture envoyée : on sert le PDF archivé, sans nouveau rendu
+    archived = pdf.open_archived_pdf(invoice)
+    
+    if archived is not None:
+        response = ranged_file_response(
+            request, archived, archived.size, filename,
+            'application/pdf', etag=invoice.pdf_sha256
+        )
+    else:
+        pdf_file = pdf.get_invoice_pdf(invoice)
+        response = HttpResponse(pdf_file, content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    
+    # Le navigateur peut garder le PDF, mais doit revalider (ETag) à chaque ouverture
+    patch_cache_control(response, private=True, no_cache=True)
+    
+    return response
+
+
+@rate_limited('public-pdf', by_ip=True)
+def public_invoice_pdf(request, token):
+    """
+    PDF d'une facture, accessible sans compte via le lien signé envoyé au client.
+    Sert le PDF archivé ; s'il n'est pas encore archivé, il l'est maintenant.
+    Limité par adresse IP : chaque rendu coûte un worker.
+    """
+    invoice_id = links.read_invoice_token(token)
+    if invoice_id is None:
+        raise Http404
+    
+    invoice = get_object_or_404(invoice_queryset(), id=invoice_id)
+    filename = f'facture_{invoice.invoice_number}.pdf'
     
-    html_string = render_to_string('invoices/invoice_pdf.html', {'invoice': invoice})
-    html = HTML(string=html_string)
-    pdf = html.write_pdf()
+    # L'archivage en arrière-plan n'a pas encore eu lieu
+    if not invoice.pdf_archive and invoice.status != 'draft':
+        pdf.archive_invoice_pdf(invoice, pdf.get_invoice_pdf(invoice))
     
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename="facture_{invoice.invoice_number}.pdf"'
+    archived = pdf.open_archived_pdf(invoice)
+    
+    if archived is not None:
+        response = ranged_file_response(
+            request, archived, archived.size, filename,
+            'application/pdf', etag=invoice.pdf_sha256
+        )
+    else:
+        response = HttpResponse(pdf.get_invoice_pdf(invoice), content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    
+    patch_cache_control(response, private=True, no_cache=True)
+    response['X-Robots-Tag'] = 'noindex'
     
     return response
 
 
+def track_open(request, token):
+    """
+    Pixel d'ouverture des emails de facture. Compté en mémoire (core.tracking),
+    sans écriture en base pendant la requête.
+    """
+    invoice_id = tracking.read_token(token)
+    if invoice_id is not None:
+        tracking.record(invoice_id, 'open')
+    
+    response = HttpResponse(tracking.PIXEL, content_type='image/gif')
+    # Chaque ouverture doit revenir jusqu'ici
+    patch_cache_control(response, private=True, no_store=True, max_age=0)
+    return response
+
+
+def track_click(request, token):
+    """Lien de suivi des emails de facture : compte le clic puis redirige vers le PDF"""
+    # Même durée de validité que le lien de téléchargement qu'il remplace
+    invoice_id = tracking.read_token(token, max_age=settings.INVOICE_LINK_MAX_AGE)
+    if invoice_id is None:
+        raise Http404
+    
+    tracking.record(invoice_id, 'click')
+    # Lien signé calculé à partir de l'ID seul : aucune requête SQL
+    response = redirect(links.get_invoice_url(Invoice(pk=invoice_id)))
+    patch_cache_control(response, private=True, no_store=True, max_age=0)
+    return response
+
+
+@login_required
+@condition(etag_func=invoice_pdf_etag, last_modified_func=invoice_pdf_last_modified)
+def invoice_preview(request, invoice_id, size):
+    """
+    Aperçu PNG de la facture (size = 'page' ou 'thumb').
+    S'il n'est pas encore prêt, sa génération est lancée et on répond 404 :
+    la page affiche alors seulement le lien vers le PDF.
+    """
+    version = get_invoice_pdf_version(request, invoice_id)
+    if version is None or size not in preview.PREVIEW_WIDTHS:
+        raise Http404
+    
+    png = preview.get_preview(version[0], size)
+    if png is None:
+        schedule_invoice_preview(invoice_id, version[0])
+        raise Http404
+    
+    response = HttpResponse(png, content_type='image/png')
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @login_required
 def invoice_detail(request, invoice_id):
     """Affiche les détails d'une facture"""
-    invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
-    return render(request, 'core/invoice_detail.html', {'invoice': invoice})
+    # Suivi d'ouverture lu dans la même requête (LEFT JOIN)
+    invoice = get_object_or_404(invoice_queryset().select_related('delivery_stats'), id=invoice_id, user=request.user)
+    return render(request, 'core/invoice_detail.html', {
+        **take_snapshot(invoice).template_context(),
+        'delivery_stats': getattr(invoice, 'delivery_stats', None),
+    })
 
 
 @login_required
@@ -100,34 +237,31 @@ def invoice_create(request):
             status = request.POST.get('status', 'draft')
             invoice.status = status
             
-            invoice.save()
-            
-            # Sauvegarde les lignes de facture
-            formset.instance = invoice
-            formset.save()
-            
-            # Recalcule les totaux
-            invoice.calculate_totals()
-            
-            # Si "Enregistrer et marquer comme envoyée" → envoie l'email
-            if status == 'sent':
-                from .utils import send_invoice_email
+            with transaction.atomic():
+                invoice.save()
+                
+                # Sauvegarde les lignes de facture
+                formset.instance = invoice
+                formset.save()
+                
+                # Recalcule les totaux
+                invoice.calculate_totals()
+                
+                webhooks.emit('invoice.created', [invoice.id], [request.user.id])
                 
-                if send_invoice_email(invoice):
+                # Si "Enregistrer et marquer comme envoyée" → email mis en file d'envoi
+                if status == 'sent':
                     invoice.mark_as_sent()
-                    messages.success(
-                        request, 
-                        f'✅ Facture {invoice.invoice_number} créée et envoyée par email à {invoice.client.email} !'
-                    )
-                else:
-                    # L'email n'a pas pu être envoyé, garde en brouillon
-                    invoice.status = 'draft'
-                    invoice.save()
-                    messages.warning(
-                        request, 
-                        f'⚠️ Facture {invoice.invoice_number} créée mais l\'email n\'a pas pu être envoyé. Vérifiez votre configuration email.'
-                    )
+                    outbox.enqueue('invoice', [invoice])
+            
+            if status == 'sent':
+                messages.success(
+                    request, 
+                    f'✅ Facture {invoice.invoice_number} créée et envoyée par email à {invoice.client.email} !'
+                )
             else:
+                # Le PDF sera sans doute téléchargé ou envoyé juste après
+                schedule_pdf_prerender(invoice)
                 messages.success(request, f'✅ Facture {invoice.invoice_number} enregistrée comme brouillon.')
             
             return redirect('core:dashboard')
@@ -151,6 +285,39 @@ def client_list(request):
     )
     return render(request, 'core/client_list.html', {'clients': clients})
 
+CLIENT_AUTOCOMPLETE_LIMIT = 20
+RECENT_CLIENTS_COUNT = 10
+RECENT_CLIENTS_TIMEOUT = 60 * 60
+
+
+def get_recent_clients(user):
+    """Clients les plus récemment facturés (puis les plus récents), pour le champ vide"""
+    return list(
+        Client.objects.filter(user=user)
+        .annotate(last_invoice_at=Max('invoices__created_at'))
+        .order_by(F('last_invoice_at').desc(nulls_last=True), '-created_at')
+        .values('id', 'name', 'email')[:RECENT_CLIENTS_COUNT]
+    )
+
+
+@login_required
+def client_autocomplete(request):
+    """Recherche de clients par début de nom ou d'email (JSON)"""
+    query = request.GET.get('q', '').strip()
+    
+    if not query:
+        results = cache.get_or_set('recent-clients', request.user.id, lambda: get_recent_clients(request.user), timeout=RECENT_CLIENTS_TIMEOUT)
+    else:
+        results = list(
+            Client.objects.filter(user=request.user)
+            .filter(Q(name__istartswith=query) | Q(email__istartswith=query))
+            .order_by('name')
+            .values('id', 'name', 'email')[:CLIENT_AUTOCOMPLETE_LIMIT]
+        )
+    
+    return JsonResponse({'results': results})
+
+
 @login_required
 def client_create(request):
     """Crée un nouveau client"""
@@ -167,6 +334,46 @@ def client_create(request):
     
     return render(request, 'core/client_form.html', {'form': form, 'title': 'Nouveau client'})
 
+@login_required
+def client_import(request):
+    """Importe des clients depuis un fichier CSV ou JSON (en arrière-plan)"""
+    if request.method == 'POST':
+        form = ClientImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            with transaction.atomic():
+                client_import = ClientImport.objects.create(user=request.user, file=form.cleaned_data['file'])
+                schedule_client_import(client_import)
+            return redirect('core:client_import_detail', import_id=client_import.id)
+    else:
+        form = ClientImportForm()
+    
+    imports = ClientImport.objects.filter(user=request.user)[:5]
+    return render(request, 'core/client_import.html', {'form': form, 'imports': imports})
+
+
+@login_required
+def client_import_detail(request, import_id):
+    """Suivi d'un import de clients (la page se recharge jusqu'à la fin)"""
+    client_import = get_object_or_404(ClientImport, id=import_id, user=request.user)
+    return render(request, 'core/client_import_detail.html', {'client_import': client_import})
+
+
+@login_required
+@rate_limited('export')
+def client_import_report(request, import_id):
+    """Télécharge le rapport des lignes refusées"""
+    client_import = get_object_or_404(ClientImport, id=import_id, user=request.user)
+    if not client_import.error_report:
+        raise Http404("Aucun rapport d'erreurs")
+    
+    return FileResponse(
+        client_import.error_report.open('rb'),
+        as_attachment=True,
+        filename=f'import_{client_import.id}_erreurs.csv',
+        content_type='text/csv',
+    )
+
+
 @login_required
 def client_edit(request, client_id):
     """Modifie un client"""
@@ -202,27 +409,27 @@ def invoice_edit(request, invoice_id):
         
         if form.is_valid() and formset.is_valid():
             old_status = invoice.status
-            invoice = form.save()
-            formset.save()
-            invoice.calculate_totals()
-            
-            # Si passage de brouillon à envoyée → envoie l'email
             new_status = request.POST.get('status')
-            if new_status == 'sent' and old_status == 'draft':
-                from .utils import send_invoice_email
+            send = new_status == 'sent' and old_status == 'draft'
+            
+            with transaction.atomic():
+                invoice = form.save()
+                formset.save()
+                invoice.calculate_totals()
                 
-                if send_invoice_email(invoice):
+                # Si passage de brouillon à envoyée → email mis en file d'envoi
+                if send:
                     invoice.mark_as_sent()
-                    messages.success(
-                        request, 
-                        f'✅ Facture {invoice.invoice_number} mise à jour et envoyée par email à {invoice.client.email} !'
-                    )
-                else:
-                    messages.warning(
-                        request, 
-                        f'⚠️ Facture {invoice.invoice_number} mise à jour mais l\'email n\'a pas pu être envoyé.'
-                    )
+                    outbox.enqueue('invoice', [invoice])
+            
+            if send:
+                messages.success(
+                    request, 
+                    f'✅ Facture {invoice.invoice_number} mise à jour et envoyée par email à {invoice.client.email} !'
+                )
             else:
+                # Le PDF sera sans doute téléchargé ou envoyé juste après
+                schedule_pdf_prerender(invoice)
                 messages.success(request, f'✅ Facture {invoice.invoice_number} mise à jour !')
             
             return redirect('core:dashboard')
@@ -240,28 +447,28 @@ def invoice_edit(request, invoice_id):
     return render(request, 'core/invoice_form.html', context)
 
 @login_required
+@rate_limited('send')
 def invoice_mark_sent(request, invoice_id):
     """Marque une facture comme envoyée ET l'envoie par email"""
     invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
     
-    # Envoie l'email
-    if send_invoice_email(invoice):
+    # Le statut change et l'email part en file d'envoi, ensemble
+    with transaction.atomic():
         invoice.mark_as_sent()
-        messages.success(request, f'Facture {invoice.invoice_number} envoyée par email à {invoice.client.email} !')
-    else:
-        messages.error(request, f'Erreur lors de l\'envoi de l\'email. Vérifiez votre configuration email.')
+        outbox.enqueue('invoice', [invoice])
+    messages.success(request, f'Facture {invoice.invoice_number} envoyée par email à {invoice.client.email} !')
     
     return redirect('core:invoice_detail', invoice_id=invoice.id)
 
 @login_required
+@rate_limited('send')
 def invoice_send_email(request, invoice_id):
     """Envoie la facture par email sans changer le statut"""
     invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
     
-    if send_invoice_email(invoice):
-        messages.success(request, f'Facture {invoice.invoice_number} envoyée par email à {invoice.client.email} !')
-    else:
-        messages.error(request, 'Erreur lors de l\'envoi de l\'email. Vérifiez votre configuration.')
+    with transaction.atomic():
+        outbox.enqueue('invoice', [invoice])
+    messages.success(request, f'Facture {invoice.invoice_number} envoyée par email à {invoice.client.email} !')
     
     return redirect('core:invoice_detail', invoice_id=invoice.id)
 
@@ -275,6 +482,174 @@ def invoice_delete(request, invoice_id):
     return redirect('core:dashboard')
 
 
+INVOICE_IMPORT_MAX_PER_REQUEST = 1000
+
+
+@login_required
+def invoice_import(request):
+    """
+    Création de factures en masse (JSON) : corps JSON {"invoices": [...]}
+    ou fichier CSV/JSON envoyé dans le champ `file`.
+    Au-delà de INVOICE_IMPORT_MAX_PER_REQUEST factures, utiliser la commande
+    `manage.py import_invoices`.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+    
+    try:
+        if request.content_type == 'application/json':
+            body = json.loads(request.body)
+            records = body.get('invoices', []) if isinstance(body, dict) else body
+        elif 'file' in request.FILES:
+            upload = request.FILES['file']
+            records = iter_invoice_records(upload.file, upload.name)
+        else:
+            return JsonResponse({'error': 'Aucune facture envoyée'}, status=400)
+        
+        records = list(islice(records, INVOICE_IMPORT_MAX_PER_REQUEST + 1))
+    except (ValueError, csv.Error) as e:
+        return JsonResponse({'error': f'Fichier illisible : {e}'}, status=400)
+    
+    if len(records) > INVOICE_IMPORT_MAX_PER_REQUEST:
+        return JsonResponse({'error': f'{INVOICE_IMPORT_MAX_PER_REQUEST} factures maximum par requête'}, status=413)
+    
+    result = import_invoices(request.user, records)
+    status = 400 if result['errors'] and not result['created'] else 200
+    return JsonResponse(result, status=status)
+
+
+@login_required
+def bank_reconciliation(request):
+    """
+    Rapprochement bancaire : le relevé envoyé est rapproché des factures
+    ouvertes (voir core.reconciliation). La proposition reste sur le serveur,
+    sous un jeton ; elle est vérifiée page par page, puis les factures
+    retenues sont marquées payées en une mise à jour groupée.
+    """
+    token = request.POST.get('token') or request.GET.get('token')
+    if token:
+        return bank_reconciliation_review(request, token)
+    
+    if request.method == 'POST':
+        form = BankStatementForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                matches, unmatched = reconciliation.reconcile_statement(request.user, upload.file, upload.name)
+            except (ValueError, csv.Error, ParseError) as e:
+                form.add_error('file', f'Relevé illisible : {e}')
+            else:
+                token = reconciliation.save_proposal(request.user, upload.name, matches, len(unmatched))
+                return redirect(f"{reverse('core:bank_reconciliation')}?token={token}")
+    else:
+        form = BankStatementForm()
+    
+    return render(request, 'core/bank_reconciliation.html', {'form': form})
+
+
+def bank_reconciliation_review(request, token):
+    """Une page de la proposition : les cases envoyées remplacent la sélection de cette page"""
+    proposal = reconciliation.get_proposal(token, request.user)
+    if proposal is None:
+        messages.error(request, 'Ce rapprochement a expiré : envoyez à nouveau le relevé.')
+        return redirect('core:bank_reconciliation')
+    
+    pages = reconciliation.page_count(proposal)
+    try:
+        page = min(max(int(request.POST.get('page') or request.GET.get('page') or 1), 1), pages)
+    except ValueError:
+        page = 1
+    
+    if request.method == 'POST':
+        checked = [int(i) for i in request.POST.getlist('invoice_ids') if i.isdigit()]
+        reconciliation.update_selection(token, proposal, page, checked)
+        
+        if request.POST.get('action') == 'apply':
+            if not proposal['selected']:
+                messages.error(request, 'Aucune facture sélectionnée.')
+                return redirect(f"{reverse('core:bank_reconciliation')}?token={token}&page={page}")
+            count = reconciliation.apply_proposal(token, proposal, request.user)
+            messages.success(request, f'{count} facture(s) marquée(s) comme payée(s).')
+            return redirect('core:dashboard')
+        
+        # Changement de page : la sélection de la page quittée est gardée
+        goto = request.POST.get('goto', '')
+        page = int(goto) if goto.isdigit() else page
+        return redirect(f"{reverse('core:bank_reconciliation')}?token={token}&page={page}")
+    
+    return render(request, 'core/bank_reconciliation.html', {
+        'form': BankStatementForm(),
+        'token': token,
+        'statement_name': proposal['statement_name'],
+        'matches': reconciliation.get_page(proposal, page),
+        'match_count': len(proposal['rows']),
+        'confirmed_count': proposal['confirmed_count'],
+        'review_count': len(proposal['rows']) - proposal['confirmed_count'],
+        'unmatched_count': proposal['unmatched_count'],
+        'selected_count': len(proposal['selected']),
+        'page': page,
+        'pages': pages,
+        'previous_page': page - 1 if page > 1 else None,
+        'next_page': page + 1 if page < pages else None,
+    })
+
+
+@login_required
+def invoice_bulk_action(request):
+    """Applique une action aux factures cochées sur le dashboard"""
+    if request.method != 'POST':
+        return redirect('core:dashboard')
+    
+    action = request.POST.get('action')
+    invoice_ids = [i for i in request.POST.getlist('invoice_ids') if i.isdigit()]
+    
+    if not invoice_ids:
+        messages.error(request, 'Aucune facture sélectionnée.')
+        return redirect('core:dashboard')
+    
+    # Seules les factures de l'utilisateur sont concernées
+    invoices = Invoice.objects.filter(user=request.user, id__in=invoice_ids)
+    
+    if action == 'mark_paid':
+        count = invoices.mark_as_paid()
+        messages.success(request, f'{count} facture(s) marquée(s) comme payée(s).')
+    elif action == 'mark_sent':
+        count = invoices.mark_as_sent()
+        messages.success(request, f'{count} facture(s) marquée(s) comme envoyée(s).')
+    elif action == 'cancel':
+        count = invoices.cancel()
+        messages.success(request, f'{count} facture(s) annulée(s).')
+    elif action == 'delete':
+        count = invoices.delete()[1].get(Invoice._meta.label, 0)
+        messages.success(request, f'{count} facture(s) supprimée(s).')
+    elif action == 'send':
+        ids = list(invoices.exclude(status='cancelled').values_list('id', flat=True))
+        if not ids:
+            messages.error(request, 'Aucune facture à envoyer.')
+            return redirect('core:dashboard')
+        
+        # Les emails eux-mêmes sont limités par la file d'envoi (quota 'email')
+        wait = ratelimit.retry_after(request.user.id, 'send')
+        if wait:
+            return ratelimit.too_many_requests(request, wait)
+        job_id = schedule_bulk_send(request.user, ids)
+        return redirect('core:bulk_send_progress', job_id=job_id)
+    else:
+        messages.error(request, 'Action inconnue.')
+    
+    return redirect('core:dashboard')
+
+
+@login_required
+def bulk_send_progress(request, job_id):
+    """Suivi d'un envoi groupé (la page se recharge jusqu'à la fin)"""
+    progress = get_bulk_send_progress(job_id, request.user)
+    if progress is None:
+        raise Http404("Envoi introuvable")
+    
+    return render(request, 'core/bulk_send_progress.html', {'progress': progress})
+
+
 
 @login_required
 def user_settings(request):
@@ -304,11 +679,60 @@ def user_settings(request):
     context = {
         'user_form': user_form,
         'profile_form': profile_form,
+        'api_tokens': request.user.api_tokens.all(),
+        'webhook_endpoints': request.user.webhook_endpoints.all(),
+        'webhook_form': WebhookEndpointForm(),
     }
     
     return render(request, 'core/settings.html', context)
 
 
+@login_required
+def api_token_create(request):
+    """Crée un jeton API ; la clé n'est affichée qu'une seule fois"""
+    if request.method == 'POST':
+        name = request.POST.get('name', '').strip()[:100] or 'Jeton API'
+        token, key = ApiToken.create_token(request.user, name)
+        messages.success(request, f'Jeton « {token.name} » créé. Copiez-le maintenant, il ne sera plus affiché : {key}')
+    return redirect('core:settings')
+
+
+@login_required
+def api_token_delete(request, token_id):
+    """Révoque un jeton API"""
+    if request.method == 'POST':
+        token = get_object_or_404(ApiToken, id=token_id, user=request.user)
+        token.delete()
+        messages.success(request, f'Jeton « {token.name} » révoqué.')
+    return redirect('core:settings')
+
+
+@login_required
+def webhook_create(request):
+    """Ajoute une URL de webhook"""
+    if request.method == 'POST':
+        form = WebhookEndpointForm(request.POST)
+        if form.is_valid():
+            endpoint = form.save(commit=False)
+            endpoint.user = request.user
+            endpoint.save()
+            messages.success(request, f'Webhook ajouté. Secret de signature : {endpoint.secret}')
+        else:
+            for errors in form.errors.values():
+                messages.error(request, errors[0])
+    return redirect('core:settings')
+
+
+@login_required
+def webhook_delete(request, endpoint_id):
+    """Supprime une URL de webhook et ses événements en attente"""
+    if request.method == 'POST':
+        endpoint = get_object_or_404(WebhookEndpoint, id=endpoint_id, user=request.user)
+        endpoint.delete()
+        messages.success(request, 'Webhook supprimé.')
+    return redirect('core:settings')
+
+
 @login_required
 def upgrade_to_premium(request):
     """Page pour passer à Premium (on implémentera Stripe après)"""
@@ -424,7 +848,7 @@ def create_checkout_session(request):
     """Crée une session de paiement Stripe Checkout"""
     
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = billing.get_stripe().checkout.Session.create(
             customer_email=request.user.email,
             payment_method_types=['card'],
             line_items=[{
@@ -448,27 +872,17 @@ def create_checkout_session(request):
 
 @login_required
 def payment_success(request):
-    """Page affichée après un paiement réussi"""
-    session_id = request.GET.get('session_id')
+    """
+    Page affichée après un paiement réussi.
+    L'activation est faite par le webhook Stripe : on lit seulement l'état local.
+    """
+    profile = request.user.profile
+    is_active = profile.is_premium and profile.subscription_status in UserProfile.ACTIVE_SUBSCRIPTION_STATUSES
     
-    if session_id:
-        try:
-            # Récupère la session Stripe
-            session = stripe.checkout.Session.retrieve(session_id)
-            
-            # Active le compte premium
-            profile = request.user.profile
-            profile.is_premium = True
-            profile.stripe_customer_id = session.customer
-            profile.stripe_subscription_id = session.subscription
-            profile.save()
-            
-            messages.success(request, '🎉 Félicitations ! Votre compte Premium est maintenant actif !')
-            
-        except Exception as e:
-            messages.error(request, f'Erreur lors de la validation du paiement : {str(e)}')
+    if is_active:
+        messages.success(request, '🎉 Félicitations ! Votre compte Premium est maintenant actif !')
     
-    return render(request, 'core/payment_success.html')
+    return render(request, 'core/payment_success.html', {'is_active': is_active})
 
 
 @csrf_exempt
@@ -477,6 +891,8 @@ def stripe_webhook(request):
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     
+    stripe = billing.get_stripe()
+    
     try:
         event = stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
@@ -486,69 +902,27 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400)
     
-    # Gère les différents types d'événements
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        handle_checkout_session(session)
-    
-    elif event['type'] == 'customer.subscription.deleted':
-        subscription = event['data']['object']
-        handle_subscription_cancelled(subscription)
+    # Enregistre l'événement avant tout traitement : l'ID Stripe est unique,
+    # donc les renvois et doublons sont ignorés sans autre travail
+    data_object = event['data']['object']
+    stripe_event, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'event_type': event['type'],
+            'customer_id': data_object.get('customer') or '',
+            'payload': json.loads(payload),
+            'stripe_created': datetime.fromtimestamp(event['created'], tz=dt_timezone.utc),
+        }
+    )
     
-    elif event['type'] == 'invoice.payment_failed':
-        invoice = event['data']['object']
-        handle_payment_failed(invoice)
+    # Le traitement est fait par le worker Celery, après le commit
+    if created:
+        customer_id = stripe_event.customer_id
+        transaction.on_commit(lambda: schedule_stripe_events(customer_id))
     
     return HttpResponse(status=200)
 
 
-def handle_checkout_session(session):
-    """Traite un paiement réussi"""
-    user_id = session['metadata'].get('user_id')
-    
-    if user_id:
-        try:
-            from django.contrib.auth.models import User
-            user = User.objects.get(id=user_id)
-            profile = user.profile
-            
-            profile.is_premium = True
-            profile.stripe_customer_id = session['customer']
-            profile.stripe_subscription_id = session['subscription']
-            profile.save()
-            
-            print(f"✅ Compte Premium activé pour {user.username}")
-            
-        except User.DoesNotExist:
-            print(f"❌ Utilisateur {user_id} introuvable")
-
-
-def handle_subscription_cancelled(subscription):
-    """Traite l'annulation d'un abonnement"""
-    try:
-        profile = UserProfile.objects.get(stripe_subscription_id=subscription['id'])
-        profile.is_premium = False
-        profile.save()
-        
-        print(f"❌ Abonnement annulé pour {profile.user.username}")
-        
-    except UserProfile.DoesNotExist:
-        print(f"❌ Profil introuvable pour l'abonnement {subscription['id']}")
-
-
-def handle_payment_failed(invoice):
-    """Traite un paiement échoué"""
-    customer_id = invoice['customer']
-    
-    try:
-        profile = UserProfile.objects.get(stripe_customer_id=customer_id)
-        # Tu peux envoyer un email de rappel ici
-        print(f"⚠️ Paiement échoué pour {profile.user.username}")
-        
-    except UserProfile.DoesNotExist:
-        print(f"❌ Profil introuvable pour le client {customer_id}")
-
-
 @login_required
 def cancel_subscription(request):
     """Annule l'abonnement d'un utilisateur"""
@@ -556,10 +930,11 @@ def cancel_subscription(request):
     
     if profile.stripe_subscription_id:
         try:
-            stripe.Subscription.delete(profile.stripe_subscription_id)
+            billing.get_stripe().Subscription.delete(profile.stripe_subscription_id)
             
             profile.is_premium = False
             profile.stripe_subscription_id = ''
+            profile.subscription_status = 'canceled'
             profile.save()
             
             messages.success(request, 'Votre abonnement a été annulé avec succès.')
@@ -717,7 +1092,7 @@ def admin_toggle_subscription(request, user_id):
     
     if profile.is_premium:
         profile.is_premium = False
-        profile.stripe_subscription_id = None
+        profile.stripe_subscription_id = ''
         profile.save()
     else:
         profile.is_premium = True
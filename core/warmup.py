@@ -0,0 +1,38 @@
+"""
+Préchauffage au démarrage d'un process : compile les templates utilisés à
+chaque envoi de facture et construit les résolveurs d'URL, pour que la
+première requête ne paie pas ce coût.
+Appelé par les process qui servent des requêtes ou rendent des factures
+(config/wsgi.py, config/asgi.py et worker_process_init dans config/celery.py),
+pas par AppConfig.ready() : migrate, shell et les tests n'en ont pas besoin.
+"""
+from django.conf import settings
+from django.template.loader import get_template
+from django.urls import reverse
+from . import email_templates
+
+
+HOT_TEMPLATES = [
+    'invoices/invoice_pdf.html',
+    'base.html',
+    'core/dashboard.html',
+    'core/invoice_detail.html',
+]
+
+
+def warm_up():
+    """Charge les templates chauds dans le cache du loader et les URLs"""
+    for template_name in HOT_TEMPLATES:
+        get_template(template_name)
+    for name in email_templates.EMAIL_TEMPLATES:
+        email_templates.get_compiled(name)
+    
+    # Le premier reverse() construit les résolveurs (URLconf + namespaces)
+    reverse('landing')
+    reverse('core:dashboard')
+
+
+def warm_up_if_enabled():
+    """Préchauffe si TEMPLATE_WARMUP est actif (activé par défaut sur Render)"""
+    if settings.TEMPLATE_WARMUP:
+        warm_up()
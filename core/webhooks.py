@@ -0,0 +1,308 @@
+"""
+Webhooks sortants : événements de factures (créée, envoyée, payée, en retard).
+emit() écrit les événements dans la file WebhookEvent, dans la transaction
+de la modification ; le worker (deliver_pending) les envoie ensuite.
+Pour chaque URL, les événements en attente sont regroupés en un seul POST
+(jusqu'à WEBHOOK_BATCH_SIZE). Un échec repousse le lot avec un délai
+exponentiel. Après CIRCUIT_FAILURE_THRESHOLD échecs de suite, l'URL est
+suspendue un moment (disjoncteur). Les connexions HTTP sont réutilisées
+(requests.Session partagée par process).
+Une URL ne peut pas viser le réseau du serveur (boucle locale, réseaux
+privés, lien local dont 169.254.169.254...) : l'hôte est vérifié à
+l'enregistrement, puis à chaque envoi sur l'adresse effectivement
+utilisée pour la connexion (pas de seconde résolution DNS).
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from datetime import timedelta
+from urllib.parse import urlsplit
+from . import cache
+from .models import Invoice, WebhookEndpoint, WebhookEvent
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import time
+
+
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_MAX_BATCHES_PER_RUN = 50
+WEBHOOK_TIMEOUT = (3.05, 10)
+WEBHOOK_LEASE = 60
+WEBHOOK_MAX_ATTEMPTS = 10
+WEBHOOK_BACKOFF_BASE = 30
+WEBHOOK_BACKOFF_MAX = 6 * 60 * 60
+ENDPOINTS_CACHE_TIMEOUT = 10 * 60
+
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 5 * 60
+CIRCUIT_COOLDOWN_MAX = 60 * 60
+
+_session = None
+
+
+class UnsafeWebhookURL(ValueError):
+    """URL de webhook refusée : invalide, hôte introuvable ou adresse interne"""
+
+
+def is_internal_address(address):
+    """Adresse qui n'est pas publique (privée, boucle locale, lien local, réservée, multicast)"""
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return not address.is_global or address.is_multicast
+
+
+def check_url(url):
+    """
+    Vérifie une URL de webhook et retourne l'adresse IP à laquelle se
+    connecter. Toutes les adresses de l'hôte doivent être publiques, sauf
+    si WEBHOOK_ALLOW_PRIVATE_URLS (webhook_stub en local).
+    """
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        raise UnsafeWebhookURL("Port invalide")
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise UnsafeWebhookURL("URL invalide")
+
+    try:
+        infos = socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise UnsafeWebhookURL(f"Hôte introuvable : {parts.hostname}")
+
+    # L'identifiant de zone IPv6 (« fe80::1%eth0 ») n'est pas une adresse
+    addresses = [ipaddress.ip_address(info[4][0].split('%')[0]) for info in infos]
+    if not settings.WEBHOOK_ALLOW_PRIVATE_URLS:
+        for address in addresses:
+            if is_internal_address(address):
+                raise UnsafeWebhookURL(f"Adresse interne refusée : {parts.hostname} ({address})")
+    return str(addresses[0])
+
+
+def get_session():
+    """Session HTTP du process : les connexions vers chaque URL sont gardées ouvertes"""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        class PinnedAddressAdapter(HTTPAdapter):
+            """
+            Se connecte à l'adresse vérifiée par check_url, résolue au moment
+            de l'envoi : un changement DNS entre la vérification et la
+            connexion (DNS rebinding) ne peut pas rediriger le POST. Le
+            certificat TLS reste vérifié pour le nom d'hôte de l'URL.
+            """
+
+            def build_connection_pool_key_attributes(self, request, verify, cert=None):
+                host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+                hostname = host_params['host']
+                host_params['host'] = check_url(request.url)
+                if host_params['scheme'] == 'https':
+                    pool_kwargs['server_hostname'] = hostname
+                    pool_kwargs['assert_hostname'] = hostname
+                return host_params, pool_kwargs
+
+            def send(self, request, **kwargs):
+                # La connexion vise l'adresse IP : l'en-tête Host garde le nom
+                request.headers.setdefault('Host', urlsplit(request.url).netloc)
+                return super().send(request, **kwargs)
+
+        session = requests.Session()
+        # Pas de proxy ni de .netrc pris dans l'environnement
+        session.trust_env = False
+        adapter = PinnedAddressAdapter(pool_connections=50, pool_maxsize=10, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['User-Agent'] = 'FactureSnap-Webhooks/1.0'
+        _session = session
+    return _session
+
+
+# --- Émission ---------------------------------------------------------------
+
+def get_user_endpoints(user_id):
+    """URLs actives d'un utilisateur : [(id, événements)], gardées en cache"""
+    return cache.get_or_set(
+        'webhook-endpoints', user_id,
+        lambda: list(WebhookEndpoint.objects.filter(user_id=user_id, is_active=True).values_list('id', 'events')),
+        timeout=ENDPOINTS_CACHE_TIMEOUT,
+    )
+
+
+def emit(event_type, invoice_ids, user_ids):
+    """
+    Met en file l'événement pour les factures données, vers chaque URL
+    abonnée de leurs propriétaires. À appeler dans la transaction de la
+    modification : si elle est annulée, les événements le sont aussi.
+    """
+    subscribed = {}
+    for user_id in set(user_ids):
+        endpoint_ids = [endpoint_id for endpoint_id, events in get_user_endpoints(user_id) if event_type in events]
+        if endpoint_ids:
+            subscribed[user_id] = endpoint_ids
+
+    # Cas courant : personne n'écoute, aucune requête
+    if not subscribed:
+        return 0
+
+    from .api import INVOICE_FIELDS, values_for
+
+    fields = dict(INVOICE_FIELDS, user_id='user_id')
+    invoices = values_for(Invoice.objects.filter(id__in=invoice_ids, user_id__in=subscribed).order_by('id'), fields)
+
+    now = timezone.now()
+    events = []
+    for invoice in invoices:
+        user_id = invoice.pop('user_id')
+        for endpoint_id in subscribed[user_id]:
+            events.append(WebhookEvent(endpoint_id=endpoint_id, event_type=event_type, payload=invoice, next_attempt_at=now))
+
+    WebhookEvent.objects.bulk_create(events, batch_size=500)
+
+    from .taskss import schedule_webhook_delivery
+    transaction.on_commit(schedule_webhook_delivery)
+    return len(events)
+
+
+# --- Envoi ------------------------------------------------------------------
+
+def sign(secret, timestamp, body):
+    """Signature HMAC-SHA256 de « <timestamp>.<corps> »"""
+    message = f'{timestamp}.'.encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def backoff_delay(attempts):
+    """Délai avant la tentative suivante : exponentiel, plafonné, avec une part d'aléa"""
+    delay = min(WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1), WEBHOOK_BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 10)
+
+
+def claim_batch(endpoint_id):
+    """
+    Réserve un lot d'événements à envoyer pour une URL. Les lignes déjà
+    verrouillées par un autre worker sont sautées ; les lignes réservées sont
+    repoussées de WEBHOOK_LEASE secondes le temps de l'envoi.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(endpoint_id=endpoint_id, status='pending', next_attempt_at__lte=now)
+            .order_by('id')[:WEBHOOK_BATCH_SIZE]
+        )
+        if events:
+            WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+                next_attempt_at=now + timedelta(seconds=WEBHOOK_LEASE)
+            )
+    return events
+
+
+def post_batch(endpoint, events):
+    """Envoie un lot en un POST ; retourne None si accepté, sinon le message d'erreur"""
+    body = json.dumps({
+        'events': [
+            {
+                'id': f'evt_{event.id}',
+                'type': event.event_type,
+                'created_at': event.created_at,
+                'data': event.payload,
+            }
+            for event in events
+        ],
+    }, cls=DjangoJSONEncoder).encode()
+
+    timestamp = int(time.time())
+    headers = {
+        'Content-Type': 'application/json',
+        'X-FactureSnap-Timestamp': str(timestamp),
+        'X-FactureSnap-Signature': f'sha256={sign(endpoint.secret, timestamp, body)}',
+    }
+
+    try:
+        # Une redirection pourrait viser une adresse interne : elle compte comme un échec
+        response = get_session().post(endpoint.url, data=body, headers=headers, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'[:1000]
+
+    if 200 <= response.status_code < 300:
+        return None
+    return f'HTTP {response.status_code}: {response.text[:500]}'
+
+
+def record_success(endpoint, events):
+    now = timezone.now()
+    WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+        status='delivered', delivered_at=now, attempts=F('attempts') + 1, last_error='',
+    )
+    WebhookEndpoint.objects.filter(id=endpoint.id).update(
+        consecutive_failures=0, circuit_open_until=None, last_success_at=now, last_error='',
+    )
+
+
+def record_failure(endpoint, events, error):
+    now = timezone.now()
+    for event in events:
+        event.attempts += 1
+        event.last_error = error
+        if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+            event.status = 'failed'
+        else:
+            event.next_attempt_at = now + timedelta(seconds=backoff_delay(event.attempts))
+    WebhookEvent.objects.bulk_update(events, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    # Disjoncteur : suspension qui double à chaque nouvel échec, plafonnée
+    failures = endpoint.consecutive_failures + 1
+    circuit_open_until = None
+    if failures >= CIRCUIT_FAILURE_THRESHOLD:
+        cooldown = min(CIRCUIT_COOLDOWN * 2 ** (failures - CIRCUIT_FAILURE_THRESHOLD), CIRCUIT_COOLDOWN_MAX)
+        circuit_open_until = now + timedelta(seconds=cooldown)
+        print(f"⚠️ [WEBHOOK] {endpoint.url} suspendu {cooldown} s après {failures} échecs")
+
+    WebhookEndpoint.objects.filter(id=endpoint.id).update(
+        consecutive_failures=failures, circuit_open_until=circuit_open_until, last_error=error,
+    )
+    endpoint.consecutive_failures = failures
+
+
+def deliver_endpoint(endpoint):
+    """Envoie les lots en attente d'une URL ; s'arrête au premier échec"""
+    delivered = 0
+    for _ in range(WEBHOOK_MAX_BATCHES_PER_RUN):
+        events = claim_batch(endpoint.id)
+        if not events:
+            break
+
+        error = post_batch(endpoint, events)
+        if error is None:
+            record_success(endpoint, events)
+            delivered += len(events)
+        else:
+            print(f"❌ [WEBHOOK] {endpoint.url} : {error}")
+            record_failure(endpoint, events, error)
+            break
+    return delivered
+
+
+def deliver_pending():
+    """Envoie les événements en attente de toutes les URLs non suspendues"""
+    now = timezone.now()
+    endpoint_ids = (
+        WebhookEvent.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by().values('endpoint_id').distinct()
+    )
+    endpoints = WebhookEndpoint.objects.filter(id__in=endpoint_ids, is_active=True).filter(
+        Q(circuit_open_until__isnull=True) | Q(circuit_open_until__lte=now)
+    )
+
+    delivered = 0
+    for endpoint in endpoints:
+        delivered += deliver_endpoint(endpoint)
+    return delivered